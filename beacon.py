@@ -0,0 +1,3933 @@
+from __future__ import print_function
+# A beacon allows very limited queries against a set of variants without allowing someone
+# to download the list of variants
+# see ga4gh.org/#/beacon (UCSC redmine 14393)
+#
+# This module is started by the query script, so Python can keep its compiled bytecode.
+# A CGI runs a new Python for every request, so only the modules that every request needs
+# are imported here. The modules in CgiLazyModules are imported by the functions that use
+# them, testBeacon checks that a CGI query does not load them.
+
+import array
+import bisect
+import collections
+import gc
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import marshal
+import math
+import mmap
+import os
+from os.path import join, isfile, dirname
+import re
+import sqlite3
+import string
+import struct
+import sys
+import threading
+import time
+import urlparse
+import zlib
+
+# modules that a CGI query must not import, they are only needed by the other modes
+CgiLazyModules = ["cherrypy", "cgi", "cgitb", "gzip", "optparse", "socket", "email"]
+
+# current host name, if running as a CGI
+hostName = os.environ.get("HTTP_HOST", "localhost")
+
+# cache of hg.conf dict
+hgConf = None
+
+# descriptions of datasets that this beacon is serving
+DataSetDescs = {
+    "hgmd": "Human Genome Variation Database, only single-nucleotide variants, public version, provided by Biobase",
+    "lovd": "Leiden Open Varation Database installations that agreed to share their variants, only single-nucleotide variants and deletions",
+    "ousamg": "Variants from Oslo University Hospital",
+    "test": "small test data on Chromosome 1, from ICGC",
+    "test2": "another piece of test data from Chromosome 1, also from ICGC"
+}
+
+responses = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    429: "Too Many Requests",
+    500: "Internal Server Error"
+}
+contentTypes = {
+    "json": "application/json",
+    "text": "text/html"
+}
+
+# seconds that clients and proxies may reuse an info or query response, can be overriden in beacon.conf.
+# After that, they revalidate it with its ETag.
+CacheMaxAge = 300
+
+# maximum number of variants in one batch query, can be overriden in beacon.conf. Every variant is charged
+# to the bottleneck like a query, with the UCSC bottleneck on its own connection.
+BatchMaxSize = 100
+
+# special case: same datasets do not have alt alleles. In this case, an overlap is enough to trigger a "true"
+NoAltDataSets = ["hgmd"]
+
+# default read pragmas for the long-lived query connections, can be overriden in beacon.conf
+# mmap_size is in bytes, a negative cache_size is in KiB (see http://www.sqlite.org/pragma.html)
+DbMmapSize = 268435456
+DbCacheSize = -65536
+# number of prepared statements that every pooled connection keeps compiled
+DbCachedStatements = 256
+
+# default false positive rate of the per-dataset Bloom filters built by importFiles
+BloomFpRate = 0.01
+# memory budget of an import for sorting in MB, more rows are sorted in runs in temporary files next to the DB
+ImportMemory = 1024
+
+# lookup engine of long-running servers, "sqlite" or "memory", can be overriden in beacon.conf
+DefaultEngine = "sqlite"
+# memory budget of the "memory" engine in MB, can be overriden in beacon.conf
+MemoryBudget = 1024
+
+# number of lookup results that a long-running server keeps, can be overriden in beacon.conf, 0 disables the cache
+CacheEntries = 100000
+
+# bottleneck client: timeout in msecs, how long a long-running server keeps the delay of an IP in msecs
+# and the delay in msecs if the bottleneck server cannot be reached, 0 = let the requests through.
+# These can be overriden in beacon.conf.
+BottleneckTimeout = 200
+BottleneckCacheTtl = 1000
+BottleneckFailDelay = 0
+# a long-running server does not ask an unreachable bottleneck server again for this many seconds
+BottleneckRetryDelay = 5
+# maximum number of requests answered from the cache that are sent to the server with the next query
+BottleneckMaxPending = 100
+# maximum number of IPs whose delay is kept
+BottleneckCacheSize = 100000
+# requests of an IP with a bottleneck delay above this many msecs are delayed, above BotBlockDelay they are refused
+BotSleepDelay = 10000
+BotBlockDelay = 20000
+
+# per-IP query budget: length of the sliding window in seconds, number of IPs in the shared counter file
+# and its default location. The budgets and these can be set in beacon.conf.
+LimitWindow = 3600
+LimitSlots = 65536
+LimitFile = "/dev/shm/beaconLimits" if os.path.isdir("/dev/shm") else "/tmp/beaconLimits"
+
+# True if running as a long-lived server, not as a CGI that answers a single request
+serverMode = False
+
+
+def bottleneckExchange(sock, ips):
+    """ send one query per ip to a UCSC-style bottleneck server and return the list of delays it answered.
+    Queries and answers are strings prefixed with their length as one byte. The UCSC bottleneck
+    answers only the first query of a connection and then closes it. """
+    sock.sendall("".join(chr(len(ip)) + ip for ip in ips))
+    delays = []
+    buf = ""
+    while len(delays) < len(ips):
+        data = sock.recv(1024)
+        if not data:
+            break
+        buf += data
+        while len(buf) != 0 and len(buf) > ord(buf[0]):
+            msgLen = ord(buf[0])
+            delays.append(int(buf[1:1 + msgLen]))
+            buf = buf[1 + msgLen:]
+    return delays
+
+
+def queryBottleneck(host, port, ip, timeout=None, count=1):
+    """ contact UCSC-style bottleneck server to get current delay time, after count queries of ip.
+    timeout is in seconds. Raises EnvironmentError if the server cannot be reached or does not answer. """
+    import socket
+    delays = []
+    sendCount = count
+    while len(delays) < count:
+        s = socket.create_connection((host, int(port)), timeout)
+        try:
+            answers = bottleneckExchange(s, [ip] * sendCount)
+        finally:
+            s.close()
+        if len(answers) == 0:
+            raise socket.error("bottleneck server %s:%s closed the connection" % (host, port))
+        delays += answers
+        if len(answers) < sendCount:
+            # the server answers only the first query of a connection, the others need their own
+            sendCount = 1
+        sendCount = min(sendCount, count - len(delays))
+    return delays[-1]
+
+
+class BottleneckClient(object):
+    """ thread-safe bottleneck client of a long-running server.
+    - idle connections are kept and reused. The UCSC bottleneck closes every connection after one
+      answer, once this was seen, every query opens a new connection.
+    - connecting and reading time out after timeout seconds, a query that fails on a reused
+      connection is sent again on a new one
+    - the delay of an IP is kept for cacheTtl seconds. The server still counts the requests that
+      were answered from the cache: they are sent with the next query of the IP, on the same connection
+      if the server is persistent, else each on its own connection, as the UCSC bottleneck counts only
+      the first query of a connection.
+    - if the server cannot be reached, the delay is failDelay (0 = let the requests through) and
+      the server is not asked again for BottleneckRetryDelay seconds
+    """
+    def __init__(self, host, port, timeout, cacheTtl, failDelay):
+        self.addr = (host, int(port))
+        self.timeout = timeout
+        self.cacheTtl = cacheTtl
+        self.failDelay = failDelay
+        self.lock = threading.Lock()
+        self.idle = []  # open connections that no thread is using
+        self.persistent = True  # False once the server closed an idle connection, then none are kept
+        self.cache = {}  # ip -> [expiry time, delay, number of requests answered from the cache]
+        self.downUntil = 0  # do not ask the server before this time
+        self.queries = 0
+        self.cacheHits = 0
+        self.failures = 0
+
+    def getDelay(self, ip, count=1):
+        " return the current delay for ip in msecs, after count queries of ip "
+        now = time.time()
+        with self.lock:
+            entry = self.cache.get(ip)
+            if entry is not None and entry[0] > now and count == 1:
+                entry[2] += 1
+                self.cacheHits += 1
+                return entry[1]
+            if now < self.downUntil:
+                self.failures += 1
+                return self.failDelay
+            pending = entry[2] if entry is not None else 0
+
+        try:
+            delays = self.query([ip] * (count + min(pending, BottleneckMaxPending)))
+        except (EnvironmentError, ValueError) as e:
+            with self.lock:
+                self.failures += 1
+                self.downUntil = now + BottleneckRetryDelay
+            sys.stderr.write("bottleneck server %s:%d: %s\n" % (self.addr[0], self.addr[1], e))
+            return self.failDelay
+
+        with self.lock:
+            self.queries += 1
+            if self.cacheTtl > 0:
+                if len(self.cache) >= BottleneckCacheSize:
+                    self.cache = dict((key, val) for key, val in self.cache.iteritems() if val[0] > now)
+                self.cache[ip] = [now + self.cacheTtl, delays[-1], 0]
+            else:
+                self.cache.pop(ip, None)
+        return delays[-1]
+
+    def query(self, ips):
+        " send the queries, return the delays "
+        delays = self.exchange(ips if self.persistent else ips[:1])
+        while len(delays) < len(ips):
+            # the server answered only the first query of the connection, it drops the others
+            self.persistent = False
+            delays += self.exchange(ips[len(delays):len(delays) + 1])
+        return delays
+
+    def exchange(self, ips):
+        " send the queries on an idle or a new connection, return the delays that the server answered "
+        import socket
+        for attempt in range(2):
+            sock = self.getConnection()
+            reused = sock is not None
+            if sock is None:
+                sock = socket.create_connection(self.addr, self.timeout)
+            try:
+                delays = bottleneckExchange(sock, ips)
+            except EnvironmentError:
+                sock.close()
+                if reused:
+                    continue  # the server closed it while it was idle
+                raise
+            if len(delays) == 0:
+                sock.close()
+                if reused:
+                    continue
+                raise socket.error("connection closed without an answer")
+            if len(delays) == len(ips) and self.persistent:
+                with self.lock:
+                    self.idle.append(sock)
+            else:
+                sock.close()
+            return delays
+        raise socket.error("no answer")
+
+    def getConnection(self):
+        " return an idle connection that the server did not close or None "
+        import select
+        while True:
+            with self.lock:
+                if len(self.idle) == 0:
+                    return None
+                sock = self.idle.pop()
+            # an idle connection is only readable if the server closed it
+            if len(select.select([sock], [], [], 0)[0]) == 0:
+                return sock
+            sock.close()
+            self.persistent = False
+
+    def stats(self):
+        " return a dict with the counters of the client, for the stats page "
+        with self.lock:
+            return {"queries": self.queries, "cacheHits": self.cacheHits, "failures": self.failures,
+                    "cachedIps": len(self.cache), "idleConnections": len(self.idle)}
+
+
+def makeBottleneckClient():
+    " return a BottleneckClient for the bottleneck server in beacon.conf or None if there is none "
+    conf = parseHgConf()
+    if "bottleneck.host" not in conf:
+        return None
+    return BottleneckClient(conf["bottleneck.host"], conf["bottleneck.port"],
+                            float(conf.get("bottleneck.timeout", BottleneckTimeout)) / 1000,
+                            float(conf.get("bottleneck.cache-ttl", BottleneckCacheTtl)) / 1000,
+                            int(conf.get("bottleneck.fail-delay", BottleneckFailDelay)))
+
+
+# BottleneckClient of a long-running server or None
+bottleneckClient = None
+
+
+class DelayQueue(object):
+    """ a timer heap served by a single thread: func(item) is called when the delay of an item has passed.
+    The WSGI server parks the responses to throttled clients here, so they do not block a worker thread. """
+    def __init__(self, func):
+        self.func = func
+        self.heap = []  # (dueTime, sequence number, item)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        self.delayed = 0
+        self.thread = threading.Thread(target=self.run, name="DelayQueue")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, delay, item):
+        " call func(item) in delay seconds "
+        with self.cond:
+            heapq.heappush(self.heap, (time.time() + delay, next(self.seq), item))
+            self.delayed += 1
+            # only the earliest item can make the thread wake up earlier
+            if self.heap[0][2] is item:
+                self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > time.time()):
+                    self.cond.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if not self.running:
+                    return
+                now = time.time()
+                dueItems = []
+                while self.heap and self.heap[0][0] <= now:
+                    dueItems.append(heapq.heappop(self.heap)[2])
+            for item in dueItems:
+                self.func(item)
+
+    def stop(self):
+        " stop the thread, returns the items that are still waiting "
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+            items = [item for dueTime, seq, item in self.heap]
+            del self.heap[:]
+        self.thread.join()
+        return items
+
+    def stats(self):
+        " return a dict with the counters of the queue, for the stats page "
+        with self.cond:
+            return {"waiting": len(self.heap), "delayed": self.delayed}
+
+
+# DelayQueue of the WSGI server or None
+delayQueue = None
+
+
+class QueryBudget(object):
+    """ per-IP query counters in a hash table in a shared memory file, so all processes of a server and all CGI
+    processes share them, without a network hop. Queries and variants of batch queries have separate budgets.
+    A slot is (key, window, queries, queries of the previous window, batch variants, same of the previous window).
+    The budget is a sliding window: the counts of the previous window are weighted by the part of the previous
+    window that is still in the sliding window. """
+    HeaderFormat = struct.Struct("<8sII")  # magic, version, number of slots
+    SlotFormat = struct.Struct("<Q5I4x")
+    Magic = "BCNLIMIT"
+    Version = 1
+    # linear probing: an IP that is not in the table takes the slot with the oldest window of these
+    MaxProbes = 16
+
+    def __init__(self, fileName, queryLimit, batchLimit, window=LimitWindow, slots=LimitSlots):
+        import fcntl
+        self.lockf, self.lockEx, self.lockUn = fcntl.lockf, fcntl.LOCK_EX, fcntl.LOCK_UN
+        self.queryLimit = queryLimit
+        self.batchLimit = batchLimit
+        self.window = window
+        self.slots = slots
+        self.rejected = 0
+        # lockf() only locks against other processes
+        self.lock = threading.Lock()
+
+        size = self.HeaderFormat.size + slots * self.SlotFormat.size
+        header = self.HeaderFormat.pack(self.Magic, self.Version, slots)
+        self.fd = os.open(fileName, os.O_RDWR | os.O_CREAT, 0o666)
+        self.lockf(self.fd, self.lockEx)
+        try:
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+            self.mm = mmap.mmap(self.fd, size)
+            if self.mm[:len(header)] != header:
+                self.mm[:] = "\0" * size
+                self.mm[:len(header)] = header
+        finally:
+            self.lockf(self.fd, self.lockUn)
+
+    def charge(self, ip, cost, batch=False, now=None):
+        """ count cost queries of ip, or cost variants of a batch query. If this would take ip over its budget,
+        nothing is counted and False is returned. """
+        limit = self.batchLimit if batch else self.queryLimit
+        if limit <= 0:
+            return True
+        if now is None:
+            now = time.time()
+        window = int(now // self.window)
+        prevWeight = 1.0 - (now - window * self.window) / float(self.window)
+        key = struct.unpack("<Q", hashlib.md5(ip).digest()[:8])[0] | 1  # 0 is a free slot
+        start = key % self.slots
+        slotFormat = self.SlotFormat
+        mm = self.mm
+
+        with self.lock:
+            self.lockf(self.fd, self.lockEx)
+            try:
+                # the slot of ip or the one with the oldest window, which is a free slot if there is one
+                slot = None
+                for i in range(self.MaxProbes):
+                    offset = self.HeaderFormat.size + ((start + i) % self.slots) * slotFormat.size
+                    values = slotFormat.unpack_from(mm, offset)
+                    if values[0] == key:
+                        slot = offset, values
+                        break
+                    if slot is None or values[1] < slot[1][1]:
+                        slot = offset, values
+                    if values[0] == 0:
+                        # slots are never freed, so ip is not in the table
+                        break
+                offset, (slotKey, slotWindow, queries, prevQueries, batchVars, prevBatchVars) = slot
+                if slotKey != key or slotWindow < window - 1:
+                    queries = prevQueries = batchVars = prevBatchVars = 0
+                elif slotWindow == window - 1:
+                    queries, prevQueries, batchVars, prevBatchVars = 0, queries, 0, batchVars
+
+                if batch:
+                    if prevBatchVars * prevWeight + batchVars + cost > limit:
+                        self.rejected += 1
+                        return False
+                    batchVars += cost
+                else:
+                    if prevQueries * prevWeight + queries + cost > limit:
+                        self.rejected += 1
+                        return False
+                    queries += cost
+                slotFormat.pack_into(mm, offset, key, window, queries, prevQueries, batchVars, prevBatchVars)
+                return True
+            finally:
+                self.lockf(self.fd, self.lockUn)
+
+    def stats(self):
+        " return a dict with the budgets and the number of rejected requests of this process, for the stats page "
+        return {"queries": self.queryLimit, "batchVariants": self.batchLimit, "window": self.window,
+                "rejected": self.rejected}
+
+
+def makeQueryBudget():
+    " return a QueryBudget for the budgets in beacon.conf or None if there are none or the file cannot be opened "
+    conf = parseHgConf()
+    queryLimit = int(conf.get("beacon-limit-queries", 0))
+    batchLimit = int(conf.get("beacon-limit-batch", 0))
+    if queryLimit <= 0 and batchLimit <= 0:
+        return None
+    fileName = conf.get("beacon-limit-file", LimitFile)
+    try:
+        return QueryBudget(fileName, queryLimit, batchLimit, int(conf.get("beacon-limit-window", LimitWindow)))
+    except EnvironmentError as e:
+        # like an unreachable bottleneck server, this lets the requests through
+        sys.stderr.write("query budget file %s: %s\n" % (fileName, e))
+        return None
+
+
+# QueryBudget of a long-running server or None
+queryBudget = None
+
+
+def checkQueryBudget(ip, cost, batch=False):
+    " count cost queries or batch variants of ip, returns False if ip is over its query budget "
+    budget = queryBudget if serverMode else makeQueryBudget()
+    if budget is None:
+        return True
+    return budget.charge(ip, cost, batch)
+
+
+def parseConf(fname):
+    " parse a hg.conf style file, return as dict key -> value (both are strings) "
+    conf = {}
+    with open(fname) as cfile:
+        for line in cfile:
+            line = line.strip()
+            if line.startswith("#"):
+                continue
+            elif line.startswith("include "):
+                inclFname = line.split()[1]
+                inclPath = join(dirname(fname), inclFname)
+                if isfile(inclPath):
+                    inclDict = parseConf(inclPath)
+                    conf.update(inclDict)
+            elif "=" in line:  # string search for "="
+                key, value = line.split("=")
+                conf[key] = value
+
+    return conf
+
+
+def parseHgConf(confDir="."):
+    """ return beacon.conf or alternatively hg.conf as dict key:value """
+    global hgConf
+    if hgConf is not None:
+        return hgConf
+
+    hgConf = dict()  # python dict = hash table
+
+    currDir = dirname(__file__)
+    fname = join(currDir, confDir, "beacon.conf")
+    if not isfile(fname):
+        fname = join(currDir, confDir, "hg.conf")
+    elif not isfile(fname):
+        fname = join(currDir, "hg.conf")
+    elif not isfile(fname):
+        return {}
+    hgConf = parseConf(fname)
+
+    return hgConf
+
+
+def jsonErrMsg(errMsg=None):
+    " wrap error message into a JSON dict "
+    if errMsg is None:
+        sys.exit(0)
+
+    helpUrl = getBeaconDesc()["homepage"]
+
+    ret = {"errormsg": errMsg,
+           "more_info": "for a complete description of the parameters, read the help message at %s" % helpUrl}
+    return json.dumps(ret, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+def makeHelp():
+    " return help text to as a string "
+    lines = []
+    lines.append("<html><body>")
+    host = hostName  # convert from global to local var
+    if host.endswith(".ucsc.edu"):
+        helpDir = "/gbdb/hg19/beacon"
+    else:
+        helpDir = dirname(__file__)
+
+    helpPath = join(helpDir, "help.txt")
+    if not isfile(helpPath):
+        return jsonErrMsg("no file %s found. The beacon is not activated on this machine" % helpPath)
+
+    helpText = open(helpPath).read()
+    lines.append(helpText % locals())
+    lines.append("</body></html>")
+    return "\n".join(lines)
+
+
+def dataSetResources():
+    " Returns the list of DataSetResources "
+    totalSize = 0
+    dsrList = []
+    for refDb in getBeaconRefs():
+        cat = getCatalogue(refDb)
+        if cat is None:
+            continue
+        for tableName in cat.datasets:
+            itemCount = getDataSetMeta(cat, tableName)["itemCount"]
+
+            # the dataset ID is just the file basename without extension
+            dsId = tableName
+            dsr = (dsId, DataSetDescs.get(dsId, ""), itemCount)
+            dsrList.append(dsr)
+            totalSize += itemCount
+
+    return totalSize, dsrList
+
+
+def getBeaconDesc():
+    " return beaconDesc dict, built from beacon.conf "
+    parseHgConf()
+    # default values are set so the beacon works as part of
+    # a UCSC mirror installation without any config file
+    homepage = "http://%s/cgi-bin/hgBeacon" % hostName
+    beaconDesc = {
+        "id": hgConf.get("beacon-id", "ucsc-browser"),
+        "name": hgConf.get("beacon-name", "Genome Browser"),
+        "organization": hgConf.get("beacon-org", "UCSC"),
+        "description": hgConf.get("beacon-desc", "UCSC Genome Browser"),
+        "api": "0.2",
+        "homepage": hgConf.get("beacon-url", homepage),
+    }
+    return beaconDesc
+
+
+def getBeaconRefs():
+    """ return the list of valid reference assemblies from beacon.conf """
+    parseHgConf()
+    return hgConf.get("beacon-refs", "GRCh37").split(",")
+
+
+def beaconInfo():
+    " return a beaconInfo dict "
+    size, dsrList = dataSetResources()
+    if size == 0:
+        return jsonErrMsg("This beacon is not serving any data. There are either no *.sqlite files in the beacon directory or they contain no data.")
+
+    info = {
+        "beacon": getBeaconDesc(),
+        "references": getBeaconRefs(),
+        "datasets": dsrList,
+        "size": size
+    }
+    if serverMode:
+        info["engine"] = engineInfo()
+    return info
+
+
+def dataVersion():
+    """ return (etag, lastModified) of the data served by this beacon: a quoted ETag that changes with
+    every import and every change of the config and the unix time of the last import.
+    Costs one stat() per reference assembly, the variant tables are not read. """
+    parseHgConf()
+    state = [sorted(hgConf.items())]
+    lastModified = 0
+    for refDb in getBeaconRefs():
+        cat = getCatalogue(refDb)
+        if cat is None:
+            state.append((refDb, None))
+            continue
+        importTimes = [meta["importTime"] for meta in cat.meta.values() if meta["importTime"] is not None]
+        importStamp = max(importTimes) if len(importTimes) != 0 else cat.fileId[3]
+        state.append((refDb, cat.fileId, cat.schemaVersion, importStamp))
+        lastModified = max(lastModified, importStamp)
+    etag = '"%s"' % hashlib.md5(repr(state)).hexdigest()[:16]
+    return etag, int(lastModified)
+
+
+def httpDate(timestamp):
+    " format a unix time as an HTTP date, like email.utils.formatdate(usegmt=True), which is slow to import "
+    t = time.gmtime(timestamp)
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"][t.tm_wday], t.tm_mday,
+        ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"][t.tm_mon - 1],
+        t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def cacheHeaders(etag, lastModified):
+    " return the list of (name, value) HTTP headers that allow caching a response of the given version "
+    maxAge = int(parseHgConf().get("beacon-cache-max-age", CacheMaxAge))
+    return [
+        ("ETag", etag),
+        ("Last-Modified", httpDate(lastModified)),
+        ("Cache-Control", "public, max-age=%d" % maxAge),
+    ]
+
+
+def isNotModified(ifNoneMatch, ifModifiedSince, etag, lastModified):
+    """ return True if the request headers If-None-Match or If-Modified-Since (None if not sent)
+    show that the client already has the current version of a response. If-None-Match wins if both are sent. """
+    if ifNoneMatch is not None:
+        tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+        # a weak comparison is enough for GET, see RFC 7232
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    if ifModifiedSince is not None:
+        import email.utils
+        sinceTuple = email.utils.parsedate_tz(ifModifiedSince)
+        return sinceTuple is not None and email.utils.mktime_tz(sinceTuple) >= lastModified
+    return False
+
+
+def serverStats():
+    """ return a dict with the lookup engine, the result cache, the bottleneck client, the queue of
+    delayed responses and the query budget of a long-running server, for the stats page """
+    return {
+        "engine": engineInfo(),
+        "cache": lookupCache.stats() if lookupCache is not None else None,
+        "bottleneck": bottleneckClient.stats() if bottleneckClient is not None else None,
+        "delayQueue": delayQueue.stats() if delayQueue is not None else None,
+        "queryBudget": queryBudget.stats() if queryBudget is not None else None,
+    }
+
+
+def makeJson(data):
+    " convert a dictionary to a JSON-encoded string "
+    return json.dumps(data, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+def getBotDelay(ip, count=1):
+    """ return the bottleneck delay of ip in msecs, get bottleneck server from hg.conf.
+    count is the number of queries that the request is charged, the number of variants of a batch. """
+    conf = parseHgConf()
+    if "bottleneck.host" not in conf:
+        return 0
+    # an empty batch costs as much as one query
+    count = max(count, 1)
+    if bottleneckClient is not None:
+        delay = bottleneckClient.getDelay(ip, count)
+    else:
+        try:
+            delay = queryBottleneck(conf["bottleneck.host"], conf["bottleneck.port"], ip,
+                                    float(conf.get("bottleneck.timeout", BottleneckTimeout)) / 1000, count)
+        except (EnvironmentError, ValueError) as e:
+            sys.stderr.write("bottleneck server %s:%s: %s\n" % (conf["bottleneck.host"], conf["bottleneck.port"], e))
+            delay = int(conf.get("bottleneck.fail-delay", BottleneckFailDelay))
+    return delay
+
+
+def botDelay(ip, count=1):
+    " sleep for the bottleneck delay of ip after count queries. Returns False if ip is blocked. "
+    delay = getBotDelay(ip, count)
+    if delay > BotSleepDelay:
+        time.sleep(delay / 1000.0)
+    return delay <= BotBlockDelay
+
+
+def wsgiBotDelay(environ, count=1):
+    """ botDelay for the WSGI application. If the server can send the response later, as the server of
+    startWsgiServer can, the response is delayed instead of the request, so no thread has to sleep. """
+    delayResponse = environ.get("beacon.delay_response")
+    if delayResponse is None:
+        return botDelay(environ.get("REMOTE_ADDR"), count)
+    delay = getBotDelay(environ.get("REMOTE_ADDR"), count)
+    if delay > BotSleepDelay:
+        delayResponse(delay / 1000.0)
+    return delay <= BotBlockDelay
+
+
+def hgBotDelay(count=1):
+    " implement bottleneck delay for a CGI "
+    if not botDelay(os.environ["REMOTE_ADDR"], count):
+        print("Blocked")
+        sys.exit(0)
+
+
+BudgetErrMsg = "the query budget of this IP address is used up, please try again later"
+
+
+class BeaconError(Exception):
+    def __init__(self, msg, code=400):
+        self.msg = msg
+        self.code = code
+
+
+def checkReference(reference):
+    " make sure the reference is valid, returns the default reference if none was provided "
+    # default is GRCh37 if no assembly has been provided
+    if reference is None or reference == "":
+        reference = getBeaconRefs()[0]
+
+    # make sure that the assembly is a valid one
+    if reference not in getBeaconRefs():
+        raise BeaconError("invalid 'reference' parameter, valid ones are %s" % ",".join(getBeaconRefs()))
+    return reference
+
+
+def checkParams(chrom, pos, altBases, reference, track):
+    " make sure the parameters follow the spec "
+    reference = checkReference(reference)
+
+    # chrom is required
+    if chrom is None or chrom == "":
+        raise BeaconError("missing chromosome parameter")
+
+    # altBases is required and uppercase
+    if altBases is None or altBases == "":
+        raise BeaconError("missing alternateBases parameter")
+    altBases = altBases.upper()
+
+    # altBases can only be a DNA sequence (~SNP) or an indel
+    valid_altBases = re.compile("^([ACTG]+)|(I[ACTG]+)|(D\d+)$")
+    if re.match(valid_altBases, altBases) is None:
+        raise BeaconError("invalid alternateBases parameter, can only be a [ACTG]+ or I[ACTG]+ or D[0-9]+")
+
+    if track is not None:
+        if not track.isalnum():
+            raise BeaconError("'dataset' parameter must contain only alphanumeric characters")
+        if len(track) > 100:
+            raise BeaconError("'dataset' parameter must not be longer than 100 chars")
+
+    if pos is None or not pos.isdigit():
+        raise BeaconError("'position' parameter is not a number")
+    pos = int(pos)
+    # the packed keys have 32 bits for the position, no chromosome is longer
+    if pos >= PackedMaxPos:
+        raise BeaconError("'position' parameter must be less than %d" % PackedMaxPos)
+
+    # convert chrom to UCSC 'chr'+Num format
+    # we currently don't accept the new hg38 sequences
+    # -> is this a problem?
+    if not ((chrom.isdigit() and int(chrom) >= 1 and int(chrom) <= 22) or chrom in ["X", "Y", "M", "test"]):
+        raise BeaconError("invalid chromosome name %s" % chrom)
+
+    return chrom, pos, altBases, reference, track
+
+
+def lookupAllele(chrom, pos, allele, reference, dataset):
+    " check if an allele is present in a sqlite DB "
+    cat = getCatalogue(reference)
+    if cat is None:
+        raise BeaconError("no data for reference %s on this server" % reference, 500)
+    if dataset is not None and dataset not in cat.datasetSet:
+        raise BeaconError("dataset %s is not present on this server" % dataset, 500)
+
+    cache = lookupCache
+    if cache is None:
+        return lookupAlleleInCatalogue(cat, chrom, pos, allele, dataset)
+    key = (reference, dataset, chrom, pos, allele)
+    found = cache.get(key, cat.fileId)
+    if found is None:
+        found = lookupAlleleInCatalogue(cat, chrom, pos, allele, dataset)
+        cache.put(key, cat.fileId, found)
+    return found
+
+
+def lookupAlleleInCatalogue(cat, chrom, pos, allele, dataset):
+    " check if an allele is present in a dataset of cat or in any dataset, if dataset is None "
+    # most queries are misses, the Bloom filters answer them without going to sqlite
+    if not bloomMayContain(cat, chrom, pos, allele, dataset):
+        return False
+
+    memory = cat.memory
+    if dataset is None:
+        if memory is not None and memory.lookup(chrom, pos, allele, None):
+            return True
+        for store in cat.columnar.itervalues():
+            if store.lookup(chrom, pos, allele):
+                return True
+        sql = cat.anyLookupSql  # the datasets that are left in sqlite
+    elif memory is not None and dataset in memory.datasets:
+        return memory.lookup(chrom, pos, allele, dataset)
+    elif dataset in cat.columnar:
+        return cat.columnar[dataset].lookup(chrom, pos, allele)
+    else:
+        sql = cat.lookupSql[dataset]
+    if sql is None:
+        return False
+
+    conn = dbPool.get(cat.refDb, cat.fileId)
+    row = conn.execute(sql, cat.lookupParams(chrom, pos, allele)).fetchone()
+    return row[0] == 1
+
+
+def lookupAlleleJson(chrom, pos, altBases, refBases, reference, dataset):
+    " call lookupAllele and wrap the result into dictionaries "
+    chrom, pos, altBases, reference, dataset = checkParams(chrom, pos, altBases, reference, dataset)
+    exists = lookupAllele(chrom, pos, altBases, reference, dataset)
+
+    if chrom == "test" and pos == 0:
+        exists = True
+
+    ret = {"beacon": getBeaconDesc(), "query": makeQueryDict(chrom, pos, altBases, refBases, reference, dataset),
+           "response": {"exists": exists}}
+    return ret
+
+
+def makeQueryDict(chrom, pos, altBases, refBases, reference, dataset):
+    " return the query part of a response "
+    query = {
+        "alternateBases": altBases,
+        "referenceBases": refBases,
+        "chromosome": chrom.replace("chr", ""),
+        "position": pos,
+        "reference": reference
+    }
+    if dataset is not None:
+        query["dataset"] = dataset
+    return query
+
+
+def lookupAlleleBatch(variants, reference):
+    """ check a list of (chrom, pos, allele, dataset) tuples in one DB pass, dataset can be None.
+    Returns a list of True/False in the same order as variants. """
+    cat = getCatalogue(reference)
+    if cat is None:
+        raise BeaconError("no data for reference %s on this server" % reference, 500)
+    # only the variants that pass the Bloom filters go to the datasets
+    maybeIdx = [idx for idx, (chrom, pos, allele, dataset) in enumerate(variants)
+                if bloomMayContain(cat, chrom, pos, allele, dataset)]
+
+    found = set()
+    if cat.memory is not None:
+        found = cat.memory.lookupBatch([variants[idx] for idx in maybeIdx])
+        found = set(maybeIdx[i] for i in found)
+        maybeIdx = [idx for idx in maybeIdx if idx not in found]
+
+    if len(cat.columnar) != 0:
+        for idx in maybeIdx:
+            chrom, pos, allele, dataset = variants[idx]
+            for name, store in cat.columnar.iteritems():
+                if (dataset is None or dataset == name) and store.lookup(chrom, pos, allele):
+                    found.add(idx)
+                    break
+        maybeIdx = [idx for idx in maybeIdx if idx not in found]
+
+    if len(maybeIdx) == 0 or cat.batchSql is None:
+        return [idx in found for idx in range(len(variants))]
+
+    conn = dbPool.get(reference, cat.fileId)
+    # the pooled connections are read-only, but the variants go into a temporary table
+    conn.execute("PRAGMA query_only=OFF")
+    try:
+        conn.execute(BatchTableSql)
+        conn.execute("DELETE FROM temp.batchQuery")
+        rows = []
+        for idx in maybeIdx:
+            chrom, pos, allele, dataset = variants[idx]
+            params = cat.lookupParams(chrom, pos, allele)
+            rows.append((idx, chrom, pos, allele, dataset, params["chromPos"], params["alleleCode"]))
+        conn.executemany("INSERT INTO temp.batchQuery VALUES (?,?,?,?,?,?,?)", rows)
+        found.update(row[0] for row in conn.execute(cat.batchSql))
+        conn.execute("DELETE FROM temp.batchQuery")
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute("PRAGMA query_only=ON")
+
+    return [idx in found for idx in range(len(variants))]
+
+
+def parseBatchItem(item):
+    " return chrom, pos, altBases, dataset of a batch item, a list of 3-4 values or a dict with the query parameters "
+    if isinstance(item, dict):
+        values = [item.get(key) for key in ("chromosome", "position", "alternateBases", "dataset")]
+    elif isinstance(item, list) and len(item) in (3, 4):
+        values = item + [None] * (4 - len(item))
+    else:
+        raise BeaconError("batch items must be lists [chromosome, position, alternateBases, dataset]")
+    # JSON numbers are accepted for chromosome and position
+    return [str(val) if isinstance(val, (int, long)) else val for val in values]
+
+
+def lookupAlleleBatchJson(body, reference, ip=None):
+    """ parse a JSON list of variants, call lookupAlleleBatch and wrap the results into dictionaries.
+    Invalid variants get an "error" instead of a "response", they do not fail the whole batch.
+    If ip is set, the variants are counted against its query budget. """
+    return lookupAlleleBatchItems(parseBatchBody(body, ip), reference)
+
+
+def parseBatchBody(body, ip=None):
+    """ return the list of variants of a batch query body. If ip is set, they are counted against its
+    query budget. The servers charge the bottleneck once per variant before they are looked up. """
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise BeaconError("batch query body is not valid JSON")
+    if not isinstance(items, list):
+        raise BeaconError("batch query body must be a JSON list of variants")
+    maxSize = int(parseHgConf().get("beacon-batch-max", BatchMaxSize))
+    if len(items) > maxSize:
+        raise BeaconError("batch query has %d variants, the maximum is %d" % (len(items), maxSize))
+    if ip is not None and not checkQueryBudget(ip, len(items), batch=True):
+        raise BeaconError(BudgetErrMsg, 429)
+    return items
+
+
+def lookupAlleleBatchItems(items, reference):
+    " the lookups of lookupAlleleBatchJson() for the variants returned by parseBatchBody() "
+    reference = checkReference(reference)
+    cat = getCatalogue(reference)
+    results = []
+    variants = []  # (chrom, pos, altBases, dataset) of the valid items
+    for item in items:
+        try:
+            chrom, pos, altBases, dataset = parseBatchItem(item)
+            chrom, pos, altBases, reference, dataset = checkParams(chrom, pos, altBases, reference, dataset)
+            if dataset is not None and (cat is None or dataset not in cat.datasetSet):
+                raise BeaconError("dataset %s is not present on this server" % dataset)
+        except BeaconError as e:
+            results.append({"query": item, "error": e.msg})
+            continue
+        results.append({"query": makeQueryDict(chrom, pos, altBases, None, reference, dataset)})
+        variants.append((chrom, pos, altBases, dataset))
+
+    found = iter(lookupAlleleBatch(variants, reference))
+    for result in results:
+        if "error" in result:
+            continue
+        query = result["query"]
+        exists = next(found)
+        if query["chromosome"] == "test" and query["position"] == 0:
+            exists = True
+        result["response"] = {"exists": exists}
+
+    return {"beacon": getBeaconDesc(), "reference": reference, "results": results}
+
+
+def cgiExceptHook(*excInfo):
+    " like cgitb.enable(), but cgitb is only imported when there is an error "
+    import cgitb
+    cgitb.Hook().handle(excInfo)
+
+
+def main():
+    # detect if running under apache or was run from command line
+    if 'REQUEST_METHOD' in os.environ:
+        # the local host name, socket.getfqdn() can wait for a DNS server
+        localName = os.uname()[1] if hasattr(os, "uname") else ""
+        if not (localName.startswith("hgw") and localName.endswith("ucsc.edu")) \
+                or localName.startswith("hgwdev."):
+            # enable special CGI error handler not on the RR, but on hgwdev
+            sys.excepthook = cgiExceptHook
+        mainCgi()
+    else:
+        mainCommandLine()
+
+
+def parseArgs():
+    " parse command line options into args and options "
+    import optparse
+    parser = optparse.OptionParser("""usage: %prog [options] [referenceDb] [datasetName] filename(s) - import VCF, complete genomics or BED files into the beacon database.
+    - parameter 'datasetName' is optional and defaults to 'defaultDataset'.
+    - any existing dataset of the same name will be overwritten
+    - the data is written to beaconData.sqlite. You can use 'sqlite3' to inspect the data file.
+    - the input file can be gzip or bgzip compressed
+    """)
+
+    parser.add_option("-d", "--debug", dest="debug", action="store_true", help="show debug messages")
+    parser.add_option("-p", "--port", dest="port", action="store", type="int",
+                      help="start development server and listen on given port for queries")
+    parser.add_option("-w", "--wsgi-port", dest="wsgiPort", action="store", type="int",
+                      help="serve the WSGI application with cherrypy's WSGI server on given port")
+    parser.add_option("-f", "--format", dest="format", action="store", default="vcf",
+                      help="format of input file, one of vcf, lovd, hgmd, cga (=complete genomics), bed or auto "
+                      "(=detected from the first lines of every file). default %default")
+    parser.add_option("", "--store", dest="store", action="store", default="sqlite",
+                      help="where to store the dataset, sqlite (=a table in the DB) or columnar (=a read-only file next to the DB). default %default")
+    parser.add_option("", "--schema", dest="schema", action="store", type="int", default=DefaultSchema,
+                      help="schema of the table, 2 (=packed 64-bit keys) or 1 (=chrom, pos, allele with an index). default %default")
+    parser.add_option("", "--migrate", dest="migrate", action="store_true",
+                      help="convert the tables of the referenceDb to the packed schema, e.g. ./query --migrate GRCh37")
+    parser.add_option("", "--force", dest="force", action="store_true",
+                      help="import the files even if the dataset was imported from them and they did not change")
+    parser.add_option("", "--unchanged", dest="unchanged", action="store_true",
+                      help="only check if the dataset was imported from the files and they did not change, "
+                      "the exit status is 0 if so and 1 otherwise")
+    parser.add_option("", "--merge", dest="merge", action="store_true",
+                      help="add the variants of the files to an existing dataset instead of replacing it")
+    parser.add_option("", "--remove", dest="removeNames", action="append", default=[],
+                      help="delete the variants in this file from an existing dataset, can be used more than once "
+                      "and with --merge: ./query --remove retracted.vcf GRCh37 dataset")
+    parser.add_option("", "--backup", dest="backup", action="store_true",
+                      help="write a backup of datasets, e.g. before an import replaces them: ./query --backup GRCh37 dataset1 dataset2")
+    parser.add_option("", "--backup-dir", dest="backupDir", action="store",
+                      help="directory of the backup files. default: the directory of the DB")
+    parser.add_option("", "--keep-backups", dest="keepBackups", action="store", type="int", default=BackupKeep,
+                      help="number of backups of a dataset to keep, older ones are removed by --backup, 0 = all. default %default")
+    parser.add_option("", "--restore", dest="restore", action="store_true",
+                      help="replace datasets by the ones in backup files: ./query --restore backupFile(s)")
+    parser.add_option("-j", "--jobs", dest="jobs", action="store", type="int", default=1,
+                      help="number of processes that parse the input files, plain text files are split into ranges. default %default")
+    parser.add_option("", "--import-memory", dest="importMemory", action="store", type="int", default=ImportMemory,
+                      help="MB of memory for sorting the imported rows, more rows are sorted in temporary files next to the DB. default %default")
+    parser.add_option("", "--bloom-fp-rate", dest="bloomFpRate", action="store", type="float", default=BloomFpRate,
+                      help="false positive rate of the Bloom filter that is built for the dataset, 0 = no filter. default %default")
+    (options, args) = parser.parse_args()
+
+    if len(args) == 0 and not options.port and not options.wsgiPort:
+        parser.print_help()
+        sys.exit(0)
+    return args, options
+
+
+def dbMakeTable(conn, tableName):
+    " create an empty table with chrom/pos/allele fields "
+    conn.execute("DROP TABLE IF EXISTS %s" % tableName)
+    conn.commit()
+
+    _tableDef = (
+        'CREATE TABLE IF NOT EXISTS %s '
+        '('
+        '  chrom text,'  # chromosome
+        '  pos int,'  # start position, 0-based
+        # alternate allele, can also be IATG = insertion of ATG or D15 = deletion of 15 bp
+        '  allele text'
+        ')'
+    )
+    conn.execute(_tableDef % tableName)
+    conn.commit()
+
+
+# table with the precomputed metadata of the datasets in a DB, it is not a dataset itself
+MetaTable = "beacon_meta"
+
+# the same classification as alleleType(), for metadata computed by sqlite
+AlleleTypeSql = ("CASE WHEN length(allele)=1 THEN 'snv' WHEN substr(allele, 1, 1)='I' THEN 'ins' "
+                 "WHEN substr(allele, 1, 1)='D' THEN 'del' ELSE 'other' END")
+
+
+def alleleType(allele):
+    " return the type of a beacon allele: snv, ins (e.g. IATG), del (e.g. D15) or other "
+    if len(allele) == 1:
+        return "snv"
+    elif allele.startswith("I"):
+        return "ins"
+    elif allele.startswith("D"):
+        return "del"
+    return "other"
+
+
+def fileFingerprint(fileName, lineHash=None, options=None):
+    """ return a dict with the name, size and modification time of an imported file and, if given, the
+    hashLines() hash of its lines and the options of the import """
+    st = os.stat(fileName)
+    fingerprint = {"name": os.path.abspath(fileName), "size": st.st_size, "mtime": int(st.st_mtime)}
+    if lineHash is not None:
+        fingerprint["hash"] = "%016x" % lineHash
+    if options is not None:
+        fingerprint["options"] = options
+    return fingerprint
+
+
+def countAlleles(alleles, chromCounts, typeCounts):
+    " add the (chrom, pos, allele) rows to the Counters of variants per chromosome and per allele type "
+    for chrom, pos, allele in alleles:
+        chromCounts[chrom] += 1
+        typeCounts[alleleType(allele)] += 1
+
+
+def makeDataSetMeta(datasetName, alleles, fileNames, chromCounts=None, typeCounts=None, lineHashes=None, options=None):
+    """ return the metadata dict of a dataset from its (chrom, pos, allele) rows or, if alleles is None,
+    from the Counters filled by countAlleles(). lineHashes and options go into the fingerprints of the files. """
+    if alleles is not None:
+        chromCounts = collections.Counter()
+        typeCounts = collections.Counter()
+        countAlleles(alleles, chromCounts, typeCounts)
+    lineHashes = lineHashes or {}
+    return {
+        "dataset": datasetName,
+        "itemCount": sum(chromCounts.values()),
+        "chromCounts": dict(chromCounts),
+        "alleleTypeCounts": dict(typeCounts),
+        "importTime": time.time(),
+        "sourceFiles": [fileFingerprint(fileName, lineHashes.get(fileName), options) for fileName in fileNames],
+    }
+
+
+def dbWriteMeta(conn, meta, commit=True):
+    """ write the metadata dict of a dataset into the beacon_meta table. Without commit, it becomes part
+    of the caller's transaction. """
+    _tableDef = (
+        'CREATE TABLE IF NOT EXISTS %s '
+        '('
+        '  dataset text PRIMARY KEY,'
+        '  itemCount int,'  # number of variants
+        '  chromCounts text,'  # JSON object chrom -> number of variants
+        '  alleleTypeCounts text,'  # JSON object snv/ins/del/other -> number of variants
+        '  importTime real,'  # unix time of the import, NULL if computed later from the data
+        '  sourceFiles text'  # JSON list of the imported files with name, size and mtime
+        ')'
+    )
+    conn.execute(_tableDef % MetaTable)
+    conn.execute("INSERT OR REPLACE INTO %s VALUES (?,?,?,?,?,?)" % MetaTable,
+                 (meta["dataset"], meta["itemCount"], json.dumps(meta["chromCounts"]),
+                  json.dumps(meta["alleleTypeCounts"]), meta["importTime"], json.dumps(meta["sourceFiles"])))
+    if commit:
+        conn.commit()
+
+
+def dbReadMeta(conn):
+    " return a dict datasetName -> metadata dict with the rows of the beacon_meta table "
+    metas = {}
+    sql = "SELECT dataset, itemCount, chromCounts, alleleTypeCounts, importTime, sourceFiles FROM %s" % MetaTable
+    for dataset, itemCount, chromCounts, typeCounts, importTime, sourceFiles in conn.execute(sql):
+        metas[dataset] = {
+            "dataset": dataset,
+            "itemCount": itemCount,
+            "chromCounts": json.loads(chromCounts),
+            "alleleTypeCounts": json.loads(typeCounts),
+            "importTime": importTime,
+            "sourceFiles": json.loads(sourceFiles),
+        }
+    return metas
+
+
+# Schema version 2 of the dataset tables ("packed"): one 64-bit integer per variant, chromosome code << 53 |
+# position << 21 | allele code, as the INTEGER PRIMARY KEY. sqlite stores the rows in the b-tree of the key,
+# there is no separate index and a lookup is a single seek. The codes are shared by all tables of a DB,
+# the SNVs A, C, G, T are 0-3, so the code of most query alleles is known without a lookup.
+ChromTable = "beacon_chroms"
+AlleleTable = "beacon_alleles"
+PackedChromShift = 53
+PackedPosShift = 21
+PackedMaxChroms = 1 << (63 - PackedChromShift)
+PackedMaxPos = 1 << (PackedChromShift - PackedPosShift)
+PackedMaxAlleles = 1 << PackedPosShift
+SnvCodes = {"A": 0, "C": 1, "G": 2, "T": 3}
+PackedColumns = "(key INTEGER PRIMARY KEY)"
+PackedTableSql = "CREATE TABLE %s " + PackedColumns
+# schema of the tables that importFiles creates, 1 = (chrom, pos, allele) with a unique index
+DefaultSchema = 2
+
+# the tables of a DB that are not datasets
+InternalTables = [MetaTable, ChromTable, AlleleTable]
+# prefix of the tables that swapDataSet() creates for a short time, they are not datasets either
+SwapTablePrefix = "beacon_swap_"
+
+
+class PackError(Exception):
+    pass
+
+
+def dbMakeCodeTables(conn):
+    " create the tables with the chromosome and allele codes of the packed tables, if they do not exist "
+    conn.execute("CREATE TABLE IF NOT EXISTS %s (code INTEGER PRIMARY KEY, chrom text UNIQUE)" % ChromTable)
+    conn.execute("CREATE TABLE IF NOT EXISTS %s (code INTEGER PRIMARY KEY, allele text UNIQUE)" % AlleleTable)
+    conn.executemany("INSERT OR IGNORE INTO %s VALUES (?,?)" % AlleleTable,
+                     [(code, allele) for allele, code in SnvCodes.items()])
+
+
+def dbMakePackedTable(conn, tableName):
+    " create an empty table with the packed schema "
+    conn.execute("DROP TABLE IF EXISTS %s" % tableName)
+    conn.execute(PackedTableSql % tableName)
+    dbMakeCodeTables(conn)
+    conn.commit()
+
+
+def dbPackedTables(conn):
+    " return the set of the tables with the packed schema "
+    # a renamed table has its name in quotes
+    return set(row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE ?", ("%" + PackedColumns,)))
+
+
+def dbReadCodes(conn, tableName):
+    " return a dict name -> code of the chromosomes or alleles of the packed tables "
+    return dict((name, code) for code, name in conn.execute("SELECT * FROM %s" % tableName))
+
+
+class AlleleCoder(object):
+    """ converts (chrom, pos, allele) to packed keys and back. Chromosomes and alleles without a code get
+    the next free one, save() adds them to the code tables. """
+    def __init__(self, conn):
+        self.codes = {}  # code table -> dict name -> code
+        self.names = {}  # code table -> dict code -> name
+        self.newCodes = {}  # code table -> list of (code, name) that are not in the table yet
+        self.nextCodes = {}  # code table -> next free code
+        for tableName in (ChromTable, AlleleTable):
+            self.codes[tableName] = dbReadCodes(conn, tableName)
+            self.names[tableName] = dict((code, name) for name, code in self.codes[tableName].items())
+            self.newCodes[tableName] = []
+            self.nextCodes[tableName] = max(self.names[tableName] or [-1]) + 1
+        self.chromCodes = self.codes[ChromTable]
+        self.alleleCodes = self.codes[AlleleTable]
+
+    def addCode(self, tableName, name):
+        " give name the next free code of tableName, raises PackError if there is none "
+        code = self.nextCodes[tableName]
+        if code >= (PackedMaxChroms if tableName == ChromTable else PackedMaxAlleles):
+            raise PackError("more than %d different values in %s" % (code, tableName))
+        self.nextCodes[tableName] = code + 1
+        self.codes[tableName][name] = code
+        self.names[tableName][code] = name
+        self.newCodes[tableName].append((code, name))
+        return code
+
+    def merge(self, tableName, rows):
+        """ add the (code, name) rows of the code table of another DB, e.g. of a backup, so its packed keys
+        mean the same here. Raises PackError if a code or a name already has another meaning. """
+        codes = self.codes[tableName]
+        names = self.names[tableName]
+        for code, name in rows:
+            if names.get(code, name) != name or codes.get(name, code) != code:
+                raise PackError("the code %d of %s in %s is different in this database" % (code, name, tableName))
+            if code not in names:
+                codes[name] = code
+                names[code] = name
+                self.newCodes[tableName].append((code, name))
+                self.nextCodes[tableName] = max(self.nextCodes[tableName], code + 1)
+
+    def encode(self, chrom, pos, allele):
+        " return the packed key of a variant, raises PackError if it does not fit "
+        chromCode = self.chromCodes.get(chrom)
+        if chromCode is None:
+            chromCode = self.addCode(ChromTable, chrom)
+        alleleCode = self.alleleCodes.get(allele)
+        if alleleCode is None:
+            alleleCode = self.addCode(AlleleTable, allele)
+        if not 0 <= pos < PackedMaxPos:
+            raise PackError("position %d on %s does not fit into a packed key" % (pos, chrom))
+        return (chromCode << PackedChromShift) | (pos << PackedPosShift) | alleleCode
+
+    def decode(self, keys):
+        " return the list of (chrom, pos, allele) of a list of packed keys "
+        chromNames = self.names[ChromTable]
+        alleleNames = self.names[AlleleTable]
+        return [(chromNames[key >> PackedChromShift], (key >> PackedPosShift) & (PackedMaxPos - 1),
+                 alleleNames[key & (PackedMaxAlleles - 1)]) for key in keys]
+
+    def save(self, conn):
+        " write the new codes to the code tables "
+        for tableName, newCodes in self.newCodes.items():
+            conn.executemany("INSERT INTO %s VALUES (?,?)" % tableName, newCodes)
+            self.newCodes[tableName] = []
+
+
+def packAlleles(conn, alleles):
+    """ return the sorted packed keys of a list of (chrom, pos, allele). New chromosomes and alleles are added
+    to the code tables. Raises PackError if a position or the number of codes does not fit into the key. """
+    coder = AlleleCoder(conn)
+    keys = sorted(coder.encode(chrom, pos, allele) for chrom, pos, allele in alleles)
+    coder.save(conn)
+    return keys
+
+
+def makeRowsSql(tableName, packed):
+    " return a statement that returns the (chrom, pos, allele) rows of a table "
+    if not packed:
+        return "SELECT chrom, pos, allele FROM %s" % tableName
+    return ("SELECT c.chrom, (t.key >> %d) & %d, a.allele FROM %s t JOIN %s c ON c.code = t.key >> %d "
+            "JOIN %s a ON a.code = t.key & %d" % (PackedPosShift, PackedMaxPos - 1, tableName, ChromTable,
+                                                  PackedChromShift, AlleleTable, PackedMaxAlleles - 1))
+
+
+def computeDataSetMeta(cat, datasetName):
+    """ return the metadata dict of a dataset that was imported before the beacon_meta table existed,
+    computed from its data. The counts of a table come from sqlite, not from Python. """
+    if datasetName in cat.columnar:
+        store = cat.columnar[datasetName]
+        chromCounts = dict((chrom, count) for chrom, (start, count) in store.chroms.items())
+        ids = array.array("I")
+        ids.fromstring(store.data[store.alleleStart:store.alleleStart + store.numItems * 4])
+        if sys.byteorder != "little":
+            ids.byteswap()
+        typeCounts = collections.Counter()
+        for allele, count in collections.Counter(ids).items():
+            typeCounts[alleleType(store.alleleNames[allele])] += count
+        typeCounts = dict(typeCounts)
+    else:
+        conn = dbPool.get(cat.refDb, cat.fileId)
+        if datasetName in cat.packedTables:
+            chromNames = dict((code, chrom) for chrom, code in cat.chromCodes.items())
+            chromCounts = dict((chromNames[code], count) for code, count in conn.execute(
+                "SELECT key >> %d, COUNT(*) FROM %s GROUP BY 1" % (PackedChromShift, datasetName)))
+            typeCounts = dict(conn.execute(
+                "SELECT %s, COUNT(*) FROM %s t JOIN %s ON code = t.key & %d GROUP BY 1"
+                % (AlleleTypeSql, datasetName, AlleleTable, PackedMaxAlleles - 1)))
+        else:
+            chromCounts = dict(conn.execute("SELECT chrom, COUNT(*) FROM %s GROUP BY chrom" % datasetName))
+            typeCounts = dict(conn.execute("SELECT %s, COUNT(*) FROM %s GROUP BY 1" % (AlleleTypeSql, datasetName)))
+    return {
+        "dataset": datasetName,
+        "itemCount": sum(chromCounts.values()),
+        "chromCounts": chromCounts,
+        "alleleTypeCounts": typeCounts,
+        "importTime": None,
+        "sourceFiles": [],
+    }
+
+
+def getDataSetMeta(cat, datasetName):
+    """ return the metadata dict of a dataset. If the DB has none for it, compute it once per catalogue and
+    keep it in memory. A request never writes the DB, that would change its version and so the ETag,
+    --migrate writes the missing metadata with dbWriteMissingMeta(). """
+    meta = cat.meta.get(datasetName)
+    if meta is None:
+        meta = cat.meta[datasetName] = computeDataSetMeta(cat, datasetName)
+    return meta
+
+
+def dbWriteMissingMeta(conn, refDb):
+    " compute the metadata of the datasets that have none, imported by older versions, and write it into beacon_meta "
+    cat = getCatalogue(refDb)
+    # the catalogue can have computed it already, without writing it
+    written = dbReadMeta(conn) if MetaTable in dbListTables(conn) else {}
+    for datasetName in cat.datasets:
+        if datasetName not in written:
+            print("Writing the metadata of dataset %s" % datasetName)
+            dbWriteMeta(conn, getDataSetMeta(cat, datasetName))
+
+
+def dbFileName(refDb):
+    " return name of database file "
+    dbDir = dirname(__file__)  # directory where script is located
+    if hostName.endswith("ucsc.edu"):  # data is not in CGI directory at UCSC
+        dbDir = "/gbdb/hg19/beacon/"
+    # sqlite database
+    dbName = "beaconData.%s.sqlite" % refDb
+    dbPath = join(dbDir, dbName)
+    return dbPath
+
+
+def dbOpen(refDb, mustExist=False):
+    " open the sqlite db and return a DB connection object "
+    dbName = dbFileName(refDb)
+
+    if not isfile(dbName) and mustExist:
+        return None
+    conn = sqlite3.Connection(dbName)
+    return conn
+
+
+def dbOpenReadOnly(refDb):
+    """ open the sqlite db for the query path: read-only, with a large statement cache
+    and the read pragmas from beacon.conf. Returns None if the DB file does not exist. """
+    dbName = dbFileName(refDb)
+    if not isfile(dbName):
+        return None
+
+    parseHgConf()
+    # the pool hands out connections per thread, but closeAll() may run in another thread
+    conn = sqlite3.connect(dbName, check_same_thread=False, cached_statements=DbCachedStatements)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA mmap_size=%d" % int(hgConf.get("beacon-db-mmap-size", DbMmapSize)))
+    conn.execute("PRAGMA cache_size=%d" % int(hgConf.get("beacon-db-cache-size", DbCacheSize)))
+    return conn
+
+
+def dbFileId(refDb):
+    """ return the identity of the DB file of refDb as a tuple (device, inode, size, mtime, (size, mtime) of
+    the write-ahead log or None) or None if it does not exist. Used to detect changed DB files without
+    running SQL. The log changes when an import commits in WAL mode. Other files in the DB directory are
+    not part of it, the imports call dbBumpVersion() after renaming a Bloom filter or column store into place. """
+    dbName = dbFileName(refDb)
+    try:
+        st = os.stat(dbName)
+    except OSError:
+        return None
+    # readers create and remove an empty log, only one with data is a change
+    try:
+        walSt = os.stat(dbName + "-wal")
+        walId = (walSt.st_size, walSt.st_mtime) if walSt.st_size != 0 else None
+    except OSError:
+        walId = None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, walId)
+
+
+def dbBumpVersion(refDb):
+    """ change the mtime of the DB file of refDb and so its dbFileId(), after the files next to it changed.
+    The new mtime is later than the old one, even if the clock has not advanced since. """
+    dbName = dbFileName(refDb)
+    st = os.stat(dbName)
+    os.utime(dbName, (st.st_atime, max(time.time(), st.st_mtime + 0.001)))
+
+
+class DbPool(object):
+    """ thread-safe pool of long-lived read-only sqlite connections, keyed by reference assembly.
+    Every thread gets its own connection per assembly, so the prepared statements cached by a
+    connection are never shared between threads. """
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.conns = []  # all connections ever handed out, for closeAll()
+        self.generation = 0  # incremented by closeAll(), invalidates the per-thread dicts
+
+    def get(self, refDb, fileId=None):
+        """ return this thread's connection to refDb or None if there is no DB for refDb.
+        If fileId is given and the DB file has been replaced since the connection was
+        opened, a connection to the new file is returned. """
+        local = self.local
+        if getattr(local, "generation", None) != self.generation:
+            local.conns = {}
+            local.generation = self.generation
+
+        conn, openId = local.conns.get(refDb, (None, None))
+        if conn is not None and fileId is not None and fileId[:2] != openId:
+            conn = None  # the old file stays open until closeAll()
+
+        if conn is None:
+            openId = dbFileId(refDb)
+            conn = dbOpenReadOnly(refDb)
+            if conn is None or openId is None:
+                return None
+            local.conns[refDb] = (conn, openId[:2])
+            with self.lock:
+                self.conns.append(conn)
+        return conn
+
+    def closeAll(self):
+        " close all connections, the next get() in every thread opens a new one "
+        with self.lock:
+            self.generation += 1
+            for conn in self.conns:
+                conn.close()
+            self.conns = []
+
+
+# connections used by the query path, shared by all requests of a long-running server
+dbPool = DbPool()
+
+
+class DataSetCatalogue(object):
+    """ the datasets of one reference assembly: the tables in its DB and the column store files
+    next to it. Built once per DB file, getCatalogue() replaces it when the files or the schema change. """
+    def __init__(self, refDb, fileId, schemaVersion, tables, packedTables, conn):
+        self.refDb = refDb
+        self.fileId = fileId
+        self.schemaVersion = schemaVersion
+        # datasetName -> ColumnStore, a column store file has precedence over a table of the same name
+        self.columnar = openColumnStores(refDb)
+        self.dbTables = tables
+        self.tables = [t for t in tables if t not in self.columnar and t not in InternalTables]
+        # the tables with the packed schema and the codes of the chromosomes in their keys
+        self.packedTables = packedTables
+        self.chromCodes = dbReadCodes(conn, ChromTable) if ChromTable in tables else {}
+        self.datasets = self.tables + sorted(self.columnar.keys())
+        self.datasetSet = set(self.datasets)
+        # datasetName -> BloomFilter or None
+        self.blooms = dict((t, BloomFilter.load(bloomFileName(refDb, t))) for t in self.datasets)
+        self.allBlooms = len(self.datasets) != 0 and None not in self.blooms.values()
+        # datasetName -> metadata dict, getDataSetMeta() adds the datasets that are not in the DB's beacon_meta
+        self.meta = dbReadMeta(conn) if MetaTable in tables else {}
+        # MemoryEngine with the tables that fit into the memory budget or None
+        self.memory = loadMemoryEngine(refDb, conn, self.tables, packedTables, self.meta)
+        sqlTables = [t for t in self.tables if self.memory is None or t not in self.memory.datasets]
+        # the SQL strings never change for a catalogue, so every pooled connection
+        # compiles them only once into its statement cache
+        self.lookupSql = dict((t, makeLookupSql([t], packedTables)) for t in sqlTables)
+        self.anyLookupSql = makeLookupSql(sqlTables, packedTables)
+        self.batchSql = makeBatchSql(sqlTables, packedTables)
+
+    def lookupParams(self, chrom, pos, allele):
+        """ return the parameters of the lookup statements for a variant. For the packed tables, chromPos is
+        the key without the allele code, None if the chromosome is not in the DB. alleleCode is None if it
+        is not an SNV, the statement then gets it from the allele table. """
+        chromPos = None
+        chromCode = self.chromCodes.get(chrom)
+        if chromCode is not None and 0 <= pos < PackedMaxPos:
+            chromPos = (chromCode << PackedChromShift) | (pos << PackedPosShift)
+        return {"chrom": chrom, "pos": pos, "allele": allele, "chromPos": chromPos, "alleleCode": SnvCodes.get(allele)}
+
+
+# the allele code in a statement on the packed tables, for the parameters of DataSetCatalogue.lookupParams
+PackedAlleleCodeSql = "COALESCE(%(alleleCode)s, (SELECT code FROM " + AlleleTable + " WHERE allele=%(allele)s))"
+
+
+def makeLookupSql(tables, packedTables=()):
+    """ return a single statement that returns 1 if an allele exists in any of the tables, 0 otherwise.
+    Parameters are those of DataSetCatalogue.lookupParams. Returns None if tables is empty. """
+    if len(tables) == 0:
+        return None
+    selects = []
+    for tableName in tables:
+        if tableName in packedTables:
+            if tableName in NoAltDataSets:
+                selects.append("SELECT 1 FROM %s WHERE key BETWEEN :chromPos AND :chromPos + %d"
+                               % (tableName, PackedMaxAlleles - 1))
+            else:
+                selects.append("SELECT 1 FROM %s WHERE key = :chromPos | %s"
+                               % (tableName, PackedAlleleCodeSql % {"alleleCode": ":alleleCode", "allele": ":allele"}))
+        elif tableName in NoAltDataSets:
+            # some datasets don't have alt alleles, e.g. HGMD
+            selects.append("SELECT 1 FROM %s WHERE chrom=:chrom AND pos=:pos" % tableName)
+        else:
+            selects.append("SELECT 1 FROM %s WHERE chrom=:chrom AND pos=:pos AND allele=:allele" % tableName)
+    # EXISTS stops at the first row, so the tables after the first hit are never read
+    return "SELECT EXISTS (%s)" % " UNION ALL ".join(selects)
+
+
+# temporary table that holds the variants of a batch query, created once per pooled connection
+BatchTableSql = ("CREATE TEMP TABLE IF NOT EXISTS batchQuery (idx INTEGER PRIMARY KEY, chrom text, pos int, allele text, "
+                 "dataset text, chromPos int, alleleCode int)")
+
+
+def makeBatchSql(tables, packedTables=()):
+    """ return a single statement that returns the idx of all variants in temp.batchQuery that
+    exist in one of the tables, or in their dataset, if they have one. Returns None if tables is empty. """
+    if len(tables) == 0:
+        return None
+    selects = []
+    for tableName in tables:
+        if tableName in packedTables:
+            if tableName in NoAltDataSets:
+                join = "t.key BETWEEN q.chromPos AND q.chromPos + %d" % (PackedMaxAlleles - 1)
+            else:
+                join = "t.key = q.chromPos | " + PackedAlleleCodeSql % {"alleleCode": "q.alleleCode", "allele": "q.allele"}
+        else:
+            join = "t.chrom=q.chrom AND t.pos=q.pos"
+            if tableName not in NoAltDataSets:
+                join += " AND t.allele=q.allele"
+        selects.append("SELECT q.idx FROM temp.batchQuery q JOIN %s t ON %s WHERE q.dataset IS NULL OR q.dataset='%s'"
+                       % (tableName, join, tableName))
+    return " UNION ".join(selects)
+
+
+# reference assembly -> DataSetCatalogue
+catalogues = {}
+catalogueLock = threading.Lock()
+
+
+def getCatalogue(refDb):
+    """ return the DataSetCatalogue of refDb or None if there is no DB for it.
+    If the DB file did not change, this costs one stat() and no SQL statement. """
+    fileId = dbFileId(refDb)
+    if fileId is None:
+        return None
+    cat = catalogues.get(refDb)
+    if cat is not None and cat.fileId == fileId:
+        return cat
+
+    with catalogueLock:
+        cat = catalogues.get(refDb)
+        if cat is not None and cat.fileId == fileId:
+            return cat  # another thread was faster
+
+        conn = dbPool.get(refDb, fileId)
+        if conn is None:
+            return None
+        schemaVersion = conn.execute("PRAGMA schema_version").fetchone()[0]
+        if cat is not None and cat.fileId[:2] == fileId[:2] and cat.schemaVersion == schemaVersion:
+            # same file, only rows changed: the list of tables is still valid
+            tables = cat.dbTables
+            packedTables = cat.packedTables
+        else:
+            tables = [t for t in dbListTables(conn) if not t.startswith(("sqlite_", SwapTablePrefix))]
+            packedTables = dbPackedTables(conn)
+        cat = DataSetCatalogue(refDb, fileId, schemaVersion, tables, packedTables, conn)
+        catalogues[refDb] = cat
+        if lookupCache is not None:
+            lookupCache.invalidate(refDb)
+    return cat
+
+
+class LookupCache(object):
+    """ thread-safe LRU cache (reference, dataset, chrom, pos, allele) -> True/False of a long-running server.
+    Every result is stored with the fileId of the catalogue that answered it, a result from an older
+    version of the DB is a miss. getCatalogue() also removes them when it builds a new catalogue. """
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self.entries = collections.OrderedDict()  # key -> (fileId, found), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, fileId):
+        " return the cached result of key or None if it is not in the cache or out of date "
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != fileId:
+                self.misses += 1
+                return None
+            self.entries[key] = entry  # now the most recently used
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, fileId, found):
+        " add a result, removes the least recently used one if the cache is full "
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (fileId, found)
+            if len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, refDb):
+        " remove all results of a reference assembly "
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == refDb]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        " return a dict with the size and the counters of the cache "
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "maxEntries": self.maxEntries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": float(self.hits) / lookups if lookups != 0 else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# LookupCache of a long-running server or None
+lookupCache = None
+
+
+def makeLookupCache():
+    " return a LookupCache with beacon-cache-entries entries or None if the cache is disabled "
+    maxEntries = int(parseHgConf().get("beacon-cache-entries", CacheEntries))
+    if maxEntries <= 0:
+        return None
+    return LookupCache(maxEntries)
+
+
+def bloomFileName(refDb, datasetName):
+    " return name of the Bloom filter file of a dataset, next to the DB file "
+    return join(dirname(dbFileName(refDb)), "beaconData.%s.%s.bloom" % (refDb, datasetName))
+
+
+def bloomKey(chrom, pos, allele, noAlt):
+    """ return the two 64-bit hashes of a variant for the Bloom filters. Datasets without
+    alt alleles only store chrom and pos. md5 makes the filters independent of the process. """
+    if noAlt:
+        key = "%s:%d" % (chrom, pos)
+    else:
+        key = "%s:%d:%s" % (chrom, pos, allele)
+    if isinstance(key, unicode):
+        key = key.encode("utf8")
+    return struct.unpack("<QQ", hashlib.md5(key).digest())
+
+
+class BloomFilter(object):
+    """ Bloom filter over the variants of one dataset. mayContain() is never False for a variant
+    that is in the dataset, so a False answer does not have to go to sqlite. The file format is
+    a header (magic, number of bits, number of hashes, number of variants, noAlt flag) followed
+    by the bit array. The server memory-maps the file. """
+    magic = "BCNBLM01"
+    headerFormat = "<8sQIQB"
+    headerSize = struct.calcsize(headerFormat)
+
+    def __init__(self, bits, offset, numBits, numHashes, numItems, noAlt):
+        self.bits = bits  # mmap or bytearray
+        # read-only view of bits, its items are one-character strings for both
+        self.view = buffer(bits)
+        self.offset = offset  # start of the bit array in self.bits
+        self.numBits = numBits
+        self.numHashes = numHashes
+        self.numItems = numItems
+        self.noAlt = noAlt
+
+    @classmethod
+    def create(cls, capacity, fpRate, noAlt):
+        " return an empty BloomFilter with the given false positive rate for up to capacity variants "
+        capacity = max(capacity, 1)
+        numBits = int(math.ceil(-capacity * math.log(fpRate) / math.log(2) ** 2))
+        numBits = (numBits + 7) // 8 * 8
+        numHashes = max(1, int(round(float(numBits) / capacity * math.log(2))))
+        return cls(bytearray(numBits // 8), 0, numBits, numHashes, 0, noAlt)
+
+    @classmethod
+    def build(cls, alleles, fpRate, noAlt):
+        " return a new BloomFilter for a list of (chrom, pos, allele) with the given false positive rate "
+        bloom = cls.create(len(alleles), fpRate, noAlt)
+        bloom.addAll(alleles)
+        return bloom
+
+    def addAll(self, alleles):
+        " add (chrom, pos, allele) rows to a filter made by create() "
+        bits = self.bits
+        numBits = self.numBits
+        numHashes = self.numHashes
+        noAlt = self.noAlt
+        for chrom, pos, allele in alleles:
+            h1, h2 = bloomKey(chrom, pos, allele, noAlt)
+            for i in xrange(numHashes):
+                idx = (h1 + i * h2) % numBits
+                bits[idx >> 3] |= 1 << (idx & 7)
+            self.numItems += 1
+
+    def copy(self):
+        " return a copy of the filter in memory, e.g. of a memory-mapped one, that addAll() can change "
+        return BloomFilter(bytearray(self.bits[self.offset:]), 0, self.numBits, self.numHashes, self.numItems, self.noAlt)
+
+    def fpRate(self, numItems=None):
+        " return the false positive rate of the filter with its current number of variants or with numItems "
+        if numItems is None:
+            numItems = self.numItems
+        return (1 - math.exp(-float(self.numHashes) * numItems / self.numBits)) ** self.numHashes
+
+    def write(self, fileName):
+        " write to a temporary file and rename, so a reader never sees a partial filter "
+        tmpName = fileName + ".tmp"
+        with open(tmpName, "wb") as ofh:
+            ofh.write(struct.pack(self.headerFormat, self.magic, self.numBits, self.numHashes, self.numItems, self.noAlt))
+            ofh.write(self.bits[self.offset:])
+        os.rename(tmpName, fileName)
+
+    @classmethod
+    def load(cls, fileName):
+        " memory-map a Bloom filter file, returns None if there is no valid file "
+        if not isfile(fileName):
+            return None
+        with open(fileName, "rb") as ifh:
+            try:
+                bits = mmap.mmap(ifh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                return None  # empty or unreadable file
+        if len(bits) < cls.headerSize:
+            return None
+        magic, numBits, numHashes, numItems, noAlt = struct.unpack_from(cls.headerFormat, bits)
+        if magic != cls.magic or len(bits) != cls.headerSize + numBits // 8:
+            return None
+        return cls(bits, cls.headerSize, numBits, numHashes, numItems, bool(noAlt))
+
+    def mayContain(self, chrom, pos, allele, hashes=None):
+        """ return False if the variant is definitely not in the dataset. hashes can be a
+        dict noAlt -> bloomKey() that is shared between the filters of a query """
+        if hashes is None:
+            h1, h2 = bloomKey(chrom, pos, allele, self.noAlt)
+        else:
+            if self.noAlt not in hashes:
+                hashes[self.noAlt] = bloomKey(chrom, pos, allele, self.noAlt)
+            h1, h2 = hashes[self.noAlt]
+        view = self.view
+        offset = self.offset
+        numBits = self.numBits
+        for i in xrange(self.numHashes):
+            idx = (h1 + i * h2) % numBits
+            if not ord(view[offset + (idx >> 3)]) & (1 << (idx & 7)):
+                return False
+        return True
+
+
+def bloomMayContain(cat, chrom, pos, allele, dataset):
+    """ check the Bloom filters of the catalogue, returns False if the variant is definitely
+    not in the dataset or, if dataset is None, not in any dataset """
+    if dataset is not None:
+        bloom = cat.blooms.get(dataset)
+        return bloom is None or bloom.mayContain(chrom, pos, allele)
+    if not cat.allBlooms:
+        return True
+    hashes = {}
+    for bloom in cat.blooms.itervalues():
+        if bloom.mayContain(chrom, pos, allele, hashes):
+            return True
+    return False
+
+
+# the keys of the memory engine are int64 numbers, position << 32 | allele code
+MemoryMaxPos = 1 << 31
+
+
+class MemoryEngine(object):
+    """ lookup engine that holds datasets in memory. Every dataset is a dict chrom -> sorted
+    NumPy int64 array of the variants, packed as position << 32 | allele code, so a lookup is
+    a binary search with searchsorted() and a batch of lookups is a single vectorised call. """
+    def __init__(self, numpy):
+        self.numpy = numpy
+        self.alleleCodes = {}  # allele -> code, shared by all datasets
+        self.datasets = {}  # dataset -> chrom -> array
+        self.noAlt = set()  # datasets where only the position has to match
+        self.memUsed = 0  # bytes used by the arrays
+
+    def load(self, conn, tableName, noAlt, packed=False):
+        " load a table into memory "
+        numpy = self.numpy
+        alleleCodes = self.alleleCodes
+        chunks = {}  # chrom -> list of arrays
+        cur = conn.execute(makeRowsSql(tableName, packed))
+        while True:
+            rows = cur.fetchmany(100000)
+            if len(rows) == 0:
+                break
+            keys = {}  # chrom -> list of keys
+            for chrom, pos, allele in rows:
+                code = alleleCodes.get(allele)
+                if code is None:
+                    code = alleleCodes[allele] = len(alleleCodes)
+                keys.setdefault(chrom, []).append((pos << 32) | code)
+            for chrom, chromKeys in keys.iteritems():
+                chunks.setdefault(chrom, []).append(numpy.array(chromKeys, dtype=numpy.int64))
+
+        chromArrays = {}
+        for chrom, chromChunks in chunks.iteritems():
+            arr = numpy.concatenate(chromChunks)
+            arr.sort()
+            chromArrays[str(chrom)] = arr
+            self.memUsed += arr.nbytes
+        self.datasets[tableName] = chromArrays
+        if noAlt:
+            self.noAlt.add(tableName)
+
+    def lookup(self, chrom, pos, allele, dataset):
+        " return True if the allele is in the dataset or, if dataset is None, in any dataset in memory "
+        if dataset is None:
+            datasets = self.datasets.keys()
+        else:
+            datasets = [dataset]
+        code = self.alleleCodes.get(allele)
+        if pos >= MemoryMaxPos:
+            return False  # the datasets cannot have such a position, the key would overflow
+        for ds in datasets:
+            arr = self.datasets[ds].get(chrom)
+            if arr is None:
+                continue
+            if ds in self.noAlt:
+                idx = arr.searchsorted(pos << 32)
+                if idx < len(arr) and arr[idx] >> 32 == pos:
+                    return True
+            elif code is not None:
+                key = (pos << 32) | code
+                idx = arr.searchsorted(key)
+                if idx < len(arr) and arr[idx] == key:
+                    return True
+        return False
+
+    def lookupBatch(self, variants):
+        " return the set of indexes of the (chrom, pos, allele, dataset) variants that are in one of the datasets in memory "
+        numpy = self.numpy
+        # group the variants by chromosome, unknown alleles can only match datasets without alt alleles
+        byChrom = {}
+        for idx, (chrom, pos, allele, dataset) in enumerate(variants):
+            if pos >= MemoryMaxPos:
+                continue
+            code = self.alleleCodes.get(allele, -1)
+            byChrom.setdefault(chrom, []).append((idx, pos, code, dataset))
+
+        found = set()
+        for chrom, chromVariants in byChrom.iteritems():
+            idxs = numpy.array([v[0] for v in chromVariants], dtype=numpy.int64)
+            positions = numpy.array([v[1] for v in chromVariants], dtype=numpy.int64)
+            codes = numpy.array([v[2] for v in chromVariants], dtype=numpy.int64)
+            datasets = [v[3] for v in chromVariants]
+            for ds, chromArrays in self.datasets.iteritems():
+                arr = chromArrays.get(chrom)
+                if arr is None or len(arr) == 0:
+                    continue
+                wanted = numpy.array([d is None or d == ds for d in datasets])
+                if ds in self.noAlt:
+                    keys = positions << 32
+                    hits = arr[numpy.minimum(arr.searchsorted(keys), len(arr) - 1)] >> 32 == positions
+                else:
+                    keys = (positions << 32) | codes
+                    hits = (arr[numpy.minimum(arr.searchsorted(keys), len(arr) - 1)] == keys) & (codes >= 0)
+                found.update(idxs[hits & wanted].tolist())
+        return found
+
+
+def loadMemoryEngine(refDb, conn, tables, packedTables, metas):
+    """ return a MemoryEngine with all tables that fit into the memory budget, if the memory
+    engine is configured and we are running as a server. Otherwise returns None. """
+    conf = parseHgConf()
+    if not serverMode or conf.get("beacon-engine", DefaultEngine) != "memory":
+        return None
+    try:
+        import numpy
+    except ImportError:
+        sys.stderr.write("beacon-engine=memory needs the numpy package, using sqlite\n")
+        return None
+
+    # the budget is shared with the catalogues of the other reference assemblies
+    budget = int(conf.get("beacon-memory-budget", MemoryBudget)) * 1024 * 1024
+    for otherCat in catalogues.values():
+        if otherCat.refDb != refDb and otherCat.memory is not None:
+            budget -= otherCat.memory.memUsed
+
+    engine = MemoryEngine(numpy)
+    for tableName in tables:
+        if tableName in metas:
+            rowCount = metas[tableName]["itemCount"]
+        else:
+            rowCount = conn.execute("SELECT COUNT(*) FROM %s" % tableName).fetchone()[0]
+        if engine.memUsed + rowCount * 8 > budget:
+            sys.stderr.write("dataset %s is too large for beacon-memory-budget, using sqlite\n" % tableName)
+            continue
+        engine.load(conn, tableName, tableName in NoAltDataSets, tableName in packedTables)
+    return engine
+
+
+def engineInfo():
+    " return a dict with the lookup engine and its memory use, for /info "
+    inMemory = {}
+    memUsed = 0
+    for refDb, cat in catalogues.items():
+        if cat.memory is not None:
+            inMemory[refDb] = sorted(cat.memory.datasets.keys())
+            memUsed += cat.memory.memUsed
+    if len(inMemory) == 0:
+        return {"name": "sqlite"}
+    budget = int(parseHgConf().get("beacon-memory-budget", MemoryBudget)) * 1024 * 1024
+    return {"name": "memory", "memoryUsed": memUsed, "memoryBudget": budget, "datasetsInMemory": inMemory}
+
+
+def columnFileName(refDb, datasetName):
+    " return name of the column store file of a dataset, next to the DB file "
+    return join(dirname(dbFileName(refDb)), "beaconData.%s.%s.col" % (refDb, datasetName))
+
+
+def openColumnStores(refDb):
+    """ open the column store files of refDb, returns a dict datasetName -> ColumnStore.
+    Invalid files are skipped with a message on stderr. """
+    stores = {}
+    prefix = "beaconData.%s." % refDb
+    for fileName in glob.glob(columnFileName(refDb, "*")):
+        datasetName = os.path.basename(fileName)[len(prefix):-len(".col")]
+        try:
+            # checking the whole file is too slow for a CGI, but a server only does it once
+            stores[datasetName] = ColumnStore(fileName, verify=serverMode)
+        except ColumnStoreError as e:
+            sys.stderr.write("%s\n" % e)
+    return stores
+
+
+class ColumnStoreError(Exception):
+    pass
+
+
+class ColumnStore(object):
+    """ read-only file with the variants of one dataset, written by importFiles with store="columnar".
+    The server memory-maps the file, so all worker processes share one copy in the page cache.
+    All numbers are little-endian. The file has:
+    - a header: magic, crc32 of the metadata, crc32 of the columns, number of variants,
+      number of chromosomes, number of alleles, size of the metadata, fence step, noAlt flag
+    - the metadata: one (name, first variant, number of variants) entry per chromosome,
+      the fences: for every chromosome, the uint32 position of every fence step-th variant,
+      then the allele dictionary as (length, allele) entries, the index is the allele id
+    - the position column: one uint32 per variant, sorted by chromosome, position and allele id
+    - the allele column: one uint32 allele id per variant
+    A lookup bisects the fences of the chromosome and then a single block of positions.
+    """
+    magic = "BCNCOL01"
+    headerFormat = "<8sIIQIIIIB"
+    fenceStep = 256
+    headerSize = struct.calcsize(headerFormat)
+    chromFormat = "<32sQQ"
+    chromSize = struct.calcsize(chromFormat)
+    uint32 = struct.Struct("<I")
+
+    def __init__(self, fileName, verify=True):
+        """ open and check a column store file, raises ColumnStoreError if it is truncated or corrupt.
+        Only the metadata is checked against its crc32, unless verify is True. """
+        with open(fileName, "rb") as ifh:
+            try:
+                data = mmap.mmap(ifh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError) as e:
+                raise ColumnStoreError("cannot open column store %s: %s" % (fileName, e))
+        if len(data) < self.headerSize:
+            raise ColumnStoreError("column store %s is truncated" % fileName)
+        magic, metaCrc, colCrc, numItems, numChroms, numAlleles, metaSize, fenceStep, noAlt = \
+            struct.unpack_from(self.headerFormat, data)
+        if magic != self.magic:
+            raise ColumnStoreError("%s is not a column store file" % fileName)
+        colStart = self.headerSize + metaSize
+        if len(data) != colStart + numItems * 8:
+            raise ColumnStoreError("column store %s is truncated" % fileName)
+        meta = data[self.headerSize:colStart]
+        if zlib.crc32(meta) & 0xffffffff != metaCrc:
+            raise ColumnStoreError("column store %s is corrupt, wrong metadata checksum" % fileName)
+        if verify:
+            crc = 0
+            for start in xrange(colStart, len(data), 16 * 1024 * 1024):
+                crc = zlib.crc32(data[start:start + 16 * 1024 * 1024], crc)
+            if crc & 0xffffffff != colCrc:
+                raise ColumnStoreError("column store %s is corrupt, wrong checksum" % fileName)
+
+        self.chroms = {}  # chrom -> (first variant, number of variants)
+        self.fences = {}  # chrom -> array with the position of every fenceStep-th variant
+        offset = numChroms * self.chromSize
+        for i in range(numChroms):
+            name, start, count = struct.unpack_from(self.chromFormat, meta, i * self.chromSize)
+            name = name.rstrip("\0")
+            self.chroms[name] = (start, count)
+            numFences = (count + fenceStep - 1) // fenceStep
+            fences = array.array("I")
+            fences.fromstring(meta[offset:offset + numFences * 4])
+            if sys.byteorder != "little":
+                fences.byteswap()
+            self.fences[name] = fences
+            offset += numFences * 4
+        self.alleleNames = []  # allele id -> allele
+        for i in range(numAlleles):
+            alleleLen = struct.unpack_from("<H", meta, offset)[0]
+            self.alleleNames.append(meta[offset + 2:offset + 2 + alleleLen])
+            offset += 2 + alleleLen
+        self.alleleIds = dict((allele, i) for i, allele in enumerate(self.alleleNames))  # allele -> allele id
+
+        self.data = data
+        self.numItems = numItems
+        self.fenceStep = fenceStep
+        self.noAlt = bool(noAlt)
+        self.posStart = colStart
+        self.alleleStart = colStart + numItems * 4
+
+    @classmethod
+    def write(cls, fileName, alleles, noAlt):
+        """ write (chrom, pos, allele) rows to a temporary file and rename it to fileName. The rows can be
+        an iterator, they have to be sorted and only the columns are kept in memory. """
+        alleleIds = {}  # allele -> id in the order of appearance, renumbered by name below
+        chromEntries = []  # [chrom, first variant, number of variants]
+        positions = array.array("I")
+        ids = array.array("I")
+        for idx, (chrom, pos, allele) in enumerate(alleles):
+            if len(chromEntries) == 0 or chromEntries[-1][0] != chrom:
+                chromEntries.append([str(chrom), idx, 0])
+            chromEntries[-1][2] += 1
+            positions.append(pos)
+            alleleId = alleleIds.get(allele)
+            if alleleId is None:
+                alleleId = alleleIds[allele] = len(alleleIds)
+            ids.append(alleleId)
+        # with the ids in the order of the allele names, the rows are sorted by chromosome, position and id
+        alleleNames = sorted(alleleIds)
+        newIds = [0] * len(alleleNames)
+        for i, allele in enumerate(alleleNames):
+            newIds[alleleIds[allele]] = i
+        ids = array.array("I", (newIds[alleleId] for alleleId in ids))
+        fences = array.array("I")
+        for chrom, start, count in chromEntries:
+            fences.extend(positions[start:start + count:cls.fenceStep])
+        if sys.byteorder != "little":
+            positions.byteswap()
+            ids.byteswap()
+            fences.byteswap()
+
+        meta = "".join(struct.pack(cls.chromFormat, chrom, start, count) for chrom, start, count in chromEntries)
+        meta += fences.tostring()
+        meta += "".join(struct.pack("<H", len(allele)) + allele for allele in alleleNames)
+        posData = positions.tostring()
+        idData = ids.tostring()
+        colCrc = zlib.crc32(idData, zlib.crc32(posData)) & 0xffffffff
+        header = struct.pack(cls.headerFormat, cls.magic, zlib.crc32(meta) & 0xffffffff, colCrc,
+                             len(positions), len(chromEntries), len(alleleNames), len(meta), cls.fenceStep, noAlt)
+
+        tmpName = fileName + ".tmp"
+        with open(tmpName, "wb") as ofh:
+            for part in (header, meta, posData, idData):
+                ofh.write(part)
+        os.rename(tmpName, fileName)
+
+    def lookup(self, chrom, pos, allele):
+        " return True if the allele is in the store, for noAlt stores only the position has to match "
+        chromRange = self.chroms.get(chrom)
+        if chromRange is None:
+            return False
+        alleleId = self.alleleIds.get(allele)
+        if alleleId is None and not self.noAlt:
+            return False
+
+        # the first variant at pos is between the last fence < pos and the next fence
+        start, count = chromRange
+        step = self.fenceStep
+        data = self.data
+        posStart = self.posStart
+        blockIdx = bisect.bisect_left(self.fences[chrom], pos)
+        if blockIdx == 0:
+            lo = start
+        else:
+            blockStart = (blockIdx - 1) * step
+            blockLen = min(step + 1, count - blockStart)
+            block = struct.unpack_from("<%dI" % blockLen, data, posStart + (start + blockStart) * 4)
+            lo = start + blockStart + bisect.bisect_left(block, pos)
+
+        # the alleles at pos follow, sorted by allele id
+        unpack = self.uint32.unpack_from
+        end = start + count
+        while lo < end and unpack(data, posStart + lo * 4)[0] == pos:
+            if self.noAlt or unpack(data, self.alleleStart + lo * 4)[0] == alleleId:
+                return True
+            lo += 1
+        return False
+
+
+def dbListTables(conn):
+    " return list of tables in sqlite db "
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    rows = cursor.fetchall()
+    tables = []
+    for row in rows:
+        tables.append(row[0])
+    return tables
+
+
+def dbQuery(conn, query, params):
+    cursor = conn.cursor()
+    if params is None:
+        cursor.execute(query)
+    else:
+        cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def readAllelesVcf(ifh):
+    """ read alleles in VCF file
+        yields chrom, pos, allele tuples
+    """
+    rowCount = 0
+    skipCount = 0
+    emptyCount = 0
+    for line in ifh:
+        if line.startswith("#"):
+            continue
+        fields = string.split(line.rstrip("\n"), "\t", maxsplit=5)
+        chrom, pos, varId, ref, alt = fields[:5]
+        if chrom.startswith("chr"):
+            chrom = chrom.replace("chr", "")
+        pos = int(pos) - 1  # VCF is 1-based, beacon is 0-based
+
+        if alt == ".":
+            emptyCount += 1
+            continue
+
+        refIsOne = len(ref) == 1
+        altIsOne = len(alt) == 1
+
+        if refIsOne and altIsOne:
+            # single bp subst
+            beaconAllele = alt
+        elif not refIsOne and altIsOne:
+            # deletion
+            # skip first nucleotide, VCF always adds one nucleotide
+            beaconAllele = "D" + str(len(ref) - 1)
+            pos += 1
+        elif refIsOne and not altIsOne:
+            # insertion
+            beaconAllele = "I" + alt[1:]
+            pos += 1
+        elif not refIsOne and not altIsOne:
+            skipCount += 1
+        else:
+            print("Error: invalid VCF fields: ", fields)
+            sys.exit(1)
+
+        rowCount += 1
+        if rowCount % 500000 == 0:
+            print("Read %d rows..." % rowCount)
+
+        yield chrom, pos, beaconAllele
+
+    print("skipped %d VCF lines with empty ALT alleles" % emptyCount)
+    print("skipped %d VCF lines with both ALT and REF alleles len != 1, cannot encode as beacon queries" % skipCount)
+
+
+def readAllelesLovd(ifh):
+    """ read the LOVD bed file, yields (chrom, pos, altAllele) tuples.
+    This function is only used internally at UCSC.
+    """
+    rowCount = 0
+    skipCount = 0
+    for line in ifh:
+        if line.startswith("chrom"):
+            continue
+        chrom, start, end, desc = line.rstrip("\n").split("\t")[:4]
+
+        if desc[-2] == ">":
+            mutDesc = desc[-3:]
+            ref, _, alt = mutDesc
+            assert(len(mutDesc) == 3)
+        elif desc.endswith("del"):
+            alt = "D" + str(int(end) - int(start))
+        else:
+            skipCount += 1
+            continue
+
+        chrom = chrom.replace("chr", "")
+        start = int(start)
+        rowCount += 1
+        yield chrom, start, alt
+
+    print("read %d alleles, skipped %d non-SNV or del alleles" % (rowCount, skipCount))
+
+
+def readAllelesHgmd(ifh):
+    """ read the HGMD bed file, yields (chrom, pos, altAllele) tuples.
+    This function is only used internally at UCSC.
+    """
+    # chr1 2338004 2338005 PEX10:CM090797 0 2338004 2338005 PEX10 CM090797 substitution
+    rowCount = 0
+    skipCount = 0
+    for line in ifh:
+        fields = line.rstrip("\n").split("\t")
+        chrom, start, end = fields[:3]
+        desc = fields[10]
+        start = int(start)
+        end = int(end)
+
+        if desc == "substitution":
+            assert(end - start == 1)
+            alt = "*"
+        else:
+            skipCount += 1
+            continue
+
+        chrom = chrom.replace("chr", "")
+        rowCount += 1
+        yield chrom, start, alt
+
+    print("read %d alleles, skipped %d non-SNV alleles" % (rowCount, skipCount))
+
+
+def readAllelesCga(ifh):
+    """ read a CGA variant file, yields (chrom, pos, altAllele) tuples.
+    See http://blog.personalgenomes.org/2014/05/30/pgp-harvard-data-in-google-cloud-storage/
+    """
+    # 5 2   all chr1    11085   11109   ref =   =
+    # 300     2       1       chr1    22157   22158   snp     A       G       80      80      VQHIGH          dbsnp.80:rs370187
+    rowCount = 0
+    skipCount = 0
+    for line in ifh:
+        if line.startswith("#") or len(line) == 1:
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if fields[6] != "snp":
+            skipCount += 1
+            continue
+        chrom = fields[3].replace("chr", "")
+        start = int(fields[4])
+        # end = int(fields[4])
+        # ref = fields[7]
+        alt = fields[8]
+        rowCount += 1
+        yield chrom, start, alt
+
+    print("read %d alleles, skipped %d non-SNP alleles" % (rowCount, skipCount))
+
+
+def readAllelesBed(ifh):
+    """ read a bed file with the format chrom, start, end, allele, yields (chrom, pos, altAllele) tuples
+    e.g. "chr1    889637  889638  C"
+    """
+    rowCount = 0
+    skipCount = 0
+    for line in ifh:
+        fields = line.rstrip("\n").split("\t")
+        chrom, start, end, alt = fields[:4]
+        start = int(start)
+        end = int(end)
+
+        if (end - start) != 1:
+            skipCount += 1
+            continue
+
+        chrom = chrom.replace("chr", "")
+        rowCount += 1
+        yield chrom, start, alt
+
+    print("read %d alleles, skipped %d alleles with length <> 1-bp" % (rowCount, skipCount))
+
+
+# the readers of the input formats. Every reader yields (chrom, pos, allele) rows as it reads the lines,
+# the duplicates are removed by the ExternalSorter of the import, for all formats in the same way.
+AlleleReaders = {
+    "vcf": readAllelesVcf,
+    "lovd": readAllelesLovd,
+    "hgmd": readAllelesHgmd,
+    "cga": readAllelesCga,
+    "bed": readAllelesBed,
+}
+
+# format of the option --format that detects the format of every file from its first lines
+AutoFormat = "auto"
+
+# number of lines at the start of a file that the format detection reads
+SniffLines = 100
+
+
+def sniffFields(lines):
+    " return the tab-separated fields of the first line that is not empty or a comment, or None "
+    for line in lines:
+        if not line.startswith("#") and line.strip() != "":
+            return line.rstrip("\n").split("\t")
+    return None
+
+
+def isBedFields(fields, minCount):
+    " True if fields has at least minCount fields and the second and third are positions, like a bed line "
+    return fields is not None and len(fields) >= minCount and fields[1].isdigit() and fields[2].isdigit()
+
+
+def isVcfFields(fields):
+    " True if fields look like a VCF data line: at least 8 fields, a numeric POS and REF and ALT made of bases "
+    if fields is None or len(fields) < 8 or not fields[1].isdigit():
+        return False
+    ref, alt = fields[3].upper(), fields[4].upper()
+    return ref != "" and set(ref) <= set("ACGTN") and (alt == "." or alt != "" and set(alt) <= set("ACGTN,"))
+
+
+def sniffVcf(lines):
+    " a VCF file without a header is recognized from its data lines "
+    return lines[0].startswith("##fileformat=VCF") or any(line.startswith("#CHROM\t") for line in lines) \
+        or isVcfFields(sniffFields(lines))
+
+
+def sniffCga(lines):
+    return any(line.startswith(">locus\t") for line in lines)
+
+
+def sniffHgmd(lines):
+    " the name is gene:accession and the 11th field the type of the variant, a BED12 file has block sizes there "
+    fields = sniffFields(lines)
+    return isBedFields(fields, 11) and ":" in fields[3] and fields[10].isalpha()
+
+
+def sniffLovd(lines):
+    fields = sniffFields(lines[1:] if lines[0].startswith("chrom") else lines)
+    return isBedFields(fields, 4) and (fields[3][-2:-1] == ">" or fields[3].endswith("del"))
+
+
+def sniffBed(lines):
+    return isBedFields(sniffFields(lines), 4)
+
+
+# the tests that detect the format of a file from its first lines, in the order in which they are tried
+FormatSniffers = [
+    ("vcf", sniffVcf),
+    ("cga", sniffCga),
+    ("hgmd", sniffHgmd),
+    ("lovd", sniffLovd),
+    ("bed", sniffBed),
+]
+
+
+def sniffFormat(fileName):
+    " return the format of a plain or compressed file, detected from its first lines. Raises ParseError. "
+    lines = readLines(fileName, threads=1)
+    try:
+        header = list(itertools.islice(lines, SniffLines))
+    finally:
+        lines.close()
+    if len(header) != 0:
+        for format, sniffer in FormatSniffers:
+            if sniffer(header):
+                return format
+    raise ParseError("cannot detect the format of %s, use --format" % fileName)
+
+
+def fileFormat(fileName, format):
+    " return the format of a file: format, or the detected one if format is AutoFormat "
+    return sniffFormat(fileName) if format == AutoFormat else format
+
+
+def listInputFiles(names):
+    """ return the input files of the command line: files as they are, directories are replaced by the
+    files in them, in alphabetical order. Hidden files and tabix or csi indexes are skipped. """
+    fileNames = []
+    for name in names:
+        if not os.path.isdir(name):
+            fileNames.append(name)
+            continue
+        for baseName in sorted(os.listdir(name)):
+            path = join(name, baseName)
+            if baseName.startswith(".") or baseName.endswith((".tbi", ".csi")) or not isfile(path):
+                continue
+            fileNames.append(path)
+    return fileNames
+
+
+# largest number of bytes of an input file that one import process parses at a time
+ImportRangeSize = 8 * 1024 * 1024
+# smallest part of a file that an import process parses at a time, with a small memory budget
+MinRangeSize = 64 * 1024
+
+
+class ParseError(Exception):
+    pass
+
+
+def readLineRange(ifh, start, end):
+    " yields the lines of a file that start in the byte range [start, end) "
+    if start != 0:
+        # the line that overlaps the start belongs to the previous range
+        ifh.seek(start - 1)
+        ifh.readline()
+    pos = ifh.tell()
+    while pos < end:
+        line = ifh.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+
+# BGZF blocks that one thread inflates at a time, a block has at most 64 KB
+BgzfBatchSize = 64
+
+
+def iterLines(chunks):
+    " yields the lines of an iterable of strings, like iterating over a file "
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + chunk).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if rest:
+        yield rest
+
+
+def isBgzf(header):
+    " True if the first bytes of a file are the header of a BGZF block, as written by bgzip "
+    # gzip magic, deflate, FEXTRA flag and the 'BC' subfield with the size of the block
+    return len(header) >= 18 and header[:4] == "\x1f\x8b\x08\x04" and header[12:16] == "BC\x02\x00"
+
+
+def readBgzfBlocks(ifh):
+    " yields the compressed blocks of a BGZF file "
+    while True:
+        header = ifh.read(18)
+        if len(header) == 0:
+            return
+        if not isBgzf(header):
+            raise IOError("invalid BGZF block at offset %d of %s" % (ifh.tell() - len(header), ifh.name))
+        blockSize = struct.unpack("<H", header[16:18])[0] + 1
+        block = header + ifh.read(blockSize - 18)
+        if len(block) != blockSize:
+            raise IOError("%s is truncated" % ifh.name)
+        yield block
+
+
+def inflateBgzfBlocks(blocks):
+    " return the data of a list of BGZF blocks. zlib does not hold the GIL, so threads can run this in parallel. "
+    # every block is a gzip member, wbits 31 checks its header and crc32
+    return "".join([zlib.decompress(block, 31) for block in blocks])
+
+
+def readBgzf(ifh, threads):
+    """ yields the data of a BGZF file, inflated by threads threads. Two batches per thread are
+    inflated in advance, not the whole file. """
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(threads)
+    try:
+        batches = iterChunks(readBgzfBlocks(ifh), BgzfBatchSize)
+        pending = collections.deque(pool.apply_async(inflateBgzfBlocks, (batch,))
+                                    for batch in itertools.islice(batches, 2 * threads))
+        while len(pending) != 0:
+            data = pending.popleft().get()
+            for batch in itertools.islice(batches, 1):
+                pending.append(pool.apply_async(inflateBgzfBlocks, (batch,)))
+            yield data
+    finally:
+        pool.terminate()
+
+
+def findExecutable(name):
+    " return the path of a program in PATH or None "
+    for dirName in os.environ.get("PATH", "").split(os.pathsep):
+        path = join(dirName, name)
+        if isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def readGzipPipe(fileName, program):
+    " yields the lines of a gzip file, decompressed by the program, pigz or gzip, in another process "
+    import subprocess
+    proc = subprocess.Popen([program, "-dc", fileName], stdout=subprocess.PIPE, bufsize=1024 * 1024)
+    try:
+        for line in proc.stdout:
+            yield line
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise IOError("%s -dc %s failed" % (program, fileName))
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            proc.wait()
+
+
+def readLines(fileName, threads=None):
+    """ yields the lines of a plain, gzip or BGZF file. BGZF blocks are inflated by threads threads, default
+    one per CPU. Other gzip files are decompressed by pigz or gzip, if there is one, else by Python. """
+    with open(fileName, "rb") as ifh:
+        header = ifh.read(18)
+        ifh.seek(0)
+        if isBgzf(header):
+            for line in iterLines(readBgzf(ifh, threads or os.sysconf("SC_NPROCESSORS_ONLN"))):
+                yield line
+            return
+        if header[:2] != "\x1f\x8b":
+            for line in ifh:
+                yield line
+            return
+
+    program = findExecutable("pigz") or findExecutable("gzip")
+    if program is not None:
+        for line in readGzipPipe(fileName, program):
+            yield line
+        return
+    import gzip
+    with gzip.open(fileName) as ifh:
+        for line in ifh:
+            yield line
+
+
+def readFileAlleles(fileName, format, start=0, end=None, lineHashes=None):
+    """ yields the (chrom, pos, allele) rows of a plain or compressed file, or of the lines that start in a
+    byte range of a plain file. If lineHashes is a dict, the hash of the lines is added to its value for fileName. """
+    ifh = None
+    if end is None:
+        lines = readLines(fileName)
+    else:
+        ifh = open(fileName, "rb")
+        lines = readLineRange(ifh, start, end)
+    if lineHashes is not None:
+        lines = hashLines(lines, lineHashes, fileName)
+    try:
+        for row in AlleleReaders[format](lines):
+            yield row
+    finally:
+        if ifh is not None:
+            ifh.close()
+
+
+def hashLines(lines, lineHashes, fileName):
+    """ yields lines and, at the end, adds their hash to lineHashes[fileName]. The hash is the sum of the crc32
+    and adler32 of every line as a 64-bit number, so it does not depend on the order of the lines and the
+    processes of readInParallel() can hash parts of a file. """
+    crc32 = zlib.crc32
+    adler32 = zlib.adler32
+    total = 0
+    for line in lines:
+        total += ((crc32(line) & 0xffffffff) << 32) | (adler32(line) & 0xffffffff)
+        yield line
+    addLineHash(lineHashes, fileName, total)
+
+
+def addLineHash(lineHashes, fileName, lineHash):
+    " add a hash of lines to the one of fileName in the dict lineHashes "
+    lineHashes[fileName] = (lineHashes.get(fileName, 0) + lineHash) & 0xffffffffffffffff
+
+
+def fileLineHash(fileName):
+    " return the hash of the lines of a plain or compressed file, the same as during an import "
+    lineHashes = {}
+    for line in hashLines(readLines(fileName), lineHashes, fileName):
+        pass
+    return lineHashes[fileName]
+
+
+def isCompressed(fileName):
+    " True if a file starts with the gzip magic number, like BGZF files "
+    with open(fileName, "rb") as ifh:
+        return ifh.read(2) == "\x1f\x8b"
+
+
+def splitFiles(fileNames, format, jobs, rangeSize=ImportRangeSize):
+    """ yields the tasks for parsing files with jobs processes: (fileName, format, start, end, data). Plain
+    files are split into byte ranges of at most rangeSize bytes, data is None. A compressed file cannot be
+    split, it is decompressed here and data is a string of its lines of about rangeSize bytes, so no process
+    holds the rows of a whole file. With AutoFormat, the format of every file is detected here. """
+    for fileName in fileNames:
+        fileFmt = fileFormat(fileName, format)
+        if isCompressed(fileName):
+            for data in joinLines(readLines(fileName), rangeSize):
+                yield fileName, fileFmt, 0, None, data
+            continue
+        size = os.path.getsize(fileName)
+        if size <= rangeSize:
+            yield fileName, fileFmt, 0, None, None
+            continue
+        # at least one range per job, so a single file keeps all processes busy
+        fileRangeSize = min(rangeSize, size // jobs + 1)
+        for start in range(0, size, fileRangeSize):
+            yield fileName, fileFmt, start, start + fileRangeSize, None
+
+
+def joinLines(lines, size):
+    " yields strings of whole lines of at least size bytes, except the last one "
+    chunk = []
+    chunkSize = 0
+    for line in lines:
+        chunk.append(line)
+        chunkSize += len(line)
+        if chunkSize >= size:
+            yield "".join(chunk)
+            chunk = []
+            chunkSize = 0
+    if len(chunk) != 0:
+        yield "".join(chunk)
+
+
+def parseTask(task):
+    """ the rows of one task of splitFiles() and the hash of its lines, marshalled. Runs in a process of the pool
+    of readInParallel(). """
+    gc.disable()
+    fileName, format, start, end, data = task
+    try:
+        lineHashes = {}
+        if data is None:
+            rows = list(readFileAlleles(fileName, format, start, end, lineHashes))
+        else:
+            rows = list(AlleleReaders[format](hashLines(iterLines([data]), lineHashes, fileName)))
+        return marshal.dumps((rows, lineHashes))
+    except SystemExit:
+        # the readers exit on invalid lines, a pool process must not
+        raise ParseError("cannot parse %s" % fileName)
+
+
+def readInParallel(tasks, jobs, lineHashes=None):
+    """ yields the rows of the tasks of splitFiles(), parsed by a pool of jobs processes. Two tasks
+    per process are started in advance, so the parsed rows that wait for the writer are limited.
+    If lineHashes is a dict, the hashes of the lines of the files are added to it. """
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        tasks = iter(tasks)
+        pending = collections.deque(pool.apply_async(parseTask, (task,)) for task in itertools.islice(tasks, 2 * jobs))
+        while len(pending) != 0:
+            result = pending.popleft()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(parseTask, (task,)))
+            rows, taskHashes = marshal.loads(result.get())
+            if lineHashes is not None:
+                for fileName, lineHash in taskHashes.items():
+                    addLineHash(lineHashes, fileName, lineHash)
+            for row in rows:
+                yield row
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iterChunks(rows, size):
+    " yields lists of at most size elements from the iterable rows "
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def printTime(time1, time2, rowCount):
+    timeDiff = time2 - time1
+    print("Time: %f secs for %d rows, %d rows/sec" % (timeDiff, rowCount, rowCount / timeDiff))
+
+
+def resetPeakRss():
+    " start a new measurement of peakRss(), only possible on Linux "
+    try:
+        with open("/proc/self/clear_refs", "w") as ofh:
+            ofh.write("5")
+    except EnvironmentError:
+        pass
+
+
+def peakRss():
+    " return the peak resident memory of the process in MB, since resetPeakRss() on Linux "
+    try:
+        with open("/proc/self/status") as ifh:
+            for line in ifh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) // 1024
+    except EnvironmentError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def printPhase(name, startTime, rowCount):
+    " print the speed and the peak memory of a phase of the import, start measuring the next one "
+    timeDiff = max(time.time() - startTime, 1e-6)
+    print("%s: %f secs for %d rows, %d rows/sec, peak memory %d MB" % (name, timeDiff, rowCount, rowCount / timeDiff,
+                                                                        peakRss()))
+    resetPeakRss()
+
+
+def uniqueRows(rows):
+    " yields the sorted rows without the duplicates "
+    prev = None
+    for row in rows:
+        if row != prev:
+            yield row
+            prev = row
+
+
+class ExternalSorter(object):
+    """ sorts and removes the duplicates of more rows than fit into memory. Every maxRows rows are sorted
+    and written to a temporary file as a run, iterating merges the runs. The merge keeps one chunk of every
+    run in memory, so when there are more than maxRows / chunkSize runs, they are merged into one first.
+    The rows have to be marshallable. """
+    chunkSize = 1000  # rows per marshal record of a run
+
+    def __init__(self, maxRows, tmpDir=None):
+        self.maxRows = maxRows
+        self.maxRuns = max(maxRows // self.chunkSize, 2)
+        self.tmpDir = tmpDir
+        self.rows = []
+        self.runs = []  # temporary files, deleted when closed
+        self.rowCount = 0  # rows added, with duplicates
+
+    def extend(self, rows):
+        " add the rows of an iterable "
+        rows = iter(rows)
+        while True:
+            oldLen = len(self.rows)
+            self.rows.extend(itertools.islice(rows, self.maxRows - oldLen))
+            self.rowCount += len(self.rows) - oldLen
+            if len(self.rows) < self.maxRows:
+                return
+            self.spill()
+
+    def writeRun(self, rows):
+        " write sorted rows without their duplicates to a new run "
+        import tempfile
+        ofh = tempfile.TemporaryFile(prefix="beaconImport", dir=self.tmpDir)
+        for chunk in iterChunks(uniqueRows(rows), self.chunkSize):
+            marshal.dump(chunk, ofh)
+        ofh.seek(0)
+        self.runs.append(ofh)
+
+    def spill(self):
+        " write the rows in memory to a new run "
+        self.rows.sort()
+        self.writeRun(self.rows)
+        self.rows = []
+        if len(self.runs) > self.maxRuns:
+            runs = self.runs
+            self.runs = []
+            self.writeRun(heapq.merge(*[self.readRun(ifh) for ifh in runs]))
+
+    @staticmethod
+    def readRun(ifh):
+        " yields the rows of a run and closes it "
+        try:
+            while True:
+                for row in marshal.load(ifh):
+                    yield row
+        except EOFError:
+            ifh.close()
+
+    def __iter__(self):
+        " yields the sorted rows without duplicates, only once "
+        self.rows.sort()
+        if len(self.runs) == 0:
+            rows = self.rows
+        else:
+            rows = heapq.merge(self.rows, *[self.readRun(ifh) for ifh in self.runs])
+        self.runs = []
+        return uniqueRows(rows)
+
+    def close(self):
+        " remove the runs "
+        for ifh in self.runs:
+            ifh.close()
+        self.runs = []
+        self.rows = []
+
+
+def importFiles(refDb, fileNames, datasetName, format, bloomFpRate=BloomFpRate, store="sqlite", schema=DefaultSchema,
+                importMemory=ImportMemory, jobs=1, force=False):
+    """ open the sqlite db, create a table datasetName and write the data in fileName into it.
+    The table has the packed schema or, if schema is 1 or the variants exceed the limits of the packed keys,
+    the (chrom, pos, allele) schema.
+    If store is "columnar", the data is written to a column store file instead of the table.
+    Also writes a Bloom filter for the dataset, unless bloomFpRate is 0, and its row in beacon_meta.
+    The rows are streamed: parsed into sorted runs of at most importMemory MB, then merged and written.
+    With jobs > 1, that many processes parse the files. The dataset is built in a shadow DB and replaces
+    the live one in a single transaction, the server answers from the old data until then.
+    Unless force is True, nothing is done if the dataset was imported from the same, unchanged files. """
+    if format != AutoFormat and format not in AlleleReaders:
+        print("Unknown format %s" % format)
+        sys.exit(1)
+    options = {"format": format, "schema": schema, "store": store, "bloomFpRate": bloomFpRate}
+    if not force and sourcesUnchanged(refDb, datasetName, fileNames, options):
+        print("The files of dataset %s did not change since its import, use --force to import them again" % datasetName)
+        return
+
+    # the new data is built next to the live files and swapped in at the end, so the server answers
+    # from the old data until then and a failed import leaves it untouched
+    bloomName = bloomFileName(refDb, datasetName)
+    colName = columnFileName(refDb, datasetName)
+    shadowName = shadowDbFileName(refDb, datasetName)
+    for fileName in (shadowName, shadowName + "-journal", stagedFileName(bloomName), stagedFileName(colName)):
+        if isfile(fileName):
+            os.remove(fileName)
+
+    # for the column store, the DB is only needed to list the datasets of the assembly
+    conn = dbOpen(refDb)
+    packed = store == "sqlite" and schema == 2
+    if packed:
+        dbMakeCodeTables(conn)
+        conn.commit()
+
+    shadow = None
+    if store == "sqlite":
+        # the shadow DB is thrown away if anything goes wrong, so it is written as fast as possible
+        shadow = sqlite3.Connection(shadowName)
+        shadow.execute("PRAGMA synchronous=OFF")
+        # http://blog.quibb.org/2010/08/fast-bulk-inserts-into-sqlite/
+        shadow.execute("PRAGMA count_changes=OFF")
+        # http://web.utk.edu/~jplyon/sqlite/SQLite_optimization_FAQ.html
+        # the page cache is part of the memory budget, a negative size is in KiB
+        shadow.execute("PRAGMA cache_size=%d" % -int(importMemory * 1024))
+        # http://www.sqlite.org/pragma.html#pragma_journal_mode
+        shadow.execute("PRAGMA journal_mode=OFF")
+        # the sort of CREATE INDEX needs temporary space as big as the table, it must not be memory
+        shadow.execute("PRAGMA temp_store=file")
+        if packed:
+            shadow.execute(PackedTableSql % datasetName)
+        else:
+            dbMakeTable(shadow, datasetName)
+        shadow.commit()
+
+    # see http://stackoverflow.com/questions/1711631/improve-insert-per-second-performance-of-sqlite
+    # for background why I do it like this
+    print("Reading files %s into database table %s" % (",".join(fileNames), datasetName))
+    resetPeakRss()
+    startTime = time.time()
+
+    coder = AlleleCoder(conn) if packed else None
+    lineHashes = {}
+    try:
+        try:
+            sorter = sortFileAlleles(refDb, fileNames, format, coder, importMemory, jobs, lineHashes)
+        except PackError as e:
+            # the codes of the packed keys are limited, the (chrom, pos, allele) schema has no limits
+            print("%s, importing the files again with the (chrom, pos, allele) schema" % e)
+            packed = False
+            coder = None
+            lineHashes = {}
+            shadow.execute("DROP TABLE %s" % datasetName)
+            dbMakeTable(shadow, datasetName)
+            startTime = time.time()
+            sorter = sortFileAlleles(refDb, fileNames, format, coder, importMemory, jobs, lineHashes)
+    except (PackError, ParseError) as e:
+        if shadow is not None:
+            shadow.close()
+            os.remove(shadowName)
+        print("Error: %s" % e)
+        sys.exit(1)
+    printPhase("Parsing and sorting, %d runs on disk" % len(sorter.runs), startTime, sorter.rowCount)
+
+    # one pass over the merged rows writes the data, the Bloom filter and the metadata. The number of rows
+    # before removing the duplicates is known, the filter is made for that many.
+    loadTime = time.time()
+    noAlt = datasetName in NoAltDataSets
+    bloom = BloomFilter.create(sorter.rowCount, bloomFpRate, noAlt) if bloomFpRate > 0 else None
+    chromCounts = collections.Counter()
+    typeCounts = collections.Counter()
+
+    def mergedAlleles():
+        " yields the chunks of the merged rows and adds them to the filter and the metadata "
+        for rows in iterChunks(sorter, 50000):
+            alleles = coder.decode(rows) if packed else rows
+            countAlleles(alleles, chromCounts, typeCounts)
+            if bloom is not None:
+                bloom.addAll(alleles)
+            yield rows
+
+    if store == "columnar":
+        print("Writing column store %s" % stagedFileName(colName))
+        ColumnStore.write(stagedFileName(colName), itertools.chain.from_iterable(mergedAlleles()), noAlt)
+    else:
+        print("Loading alleles into shadow database %s" % shadowName)
+        if packed:
+            # the keys are sorted, so the rows are appended to the b-tree
+            sql = "INSERT INTO %s (key) VALUES (?)" % datasetName
+        else:
+            sql = "INSERT INTO %s (chrom, pos, allele) VALUES (?,?,?)" % datasetName
+        for rows in mergedAlleles():
+            shadow.executemany(sql, [(key,) for key in rows] if packed else rows)
+            shadow.commit()
+        # the index and the statistics are built here, the swap copies them with the rows
+        if not packed:
+            print("Indexing database table")
+            shadow.execute("CREATE UNIQUE INDEX '%s_index' ON '%s' ('chrom', 'pos', 'allele')" %
+                           (datasetName, datasetName))
+        shadow.execute("ANALYZE")
+        shadow.commit()
+        shadow.close()
+    meta = makeDataSetMeta(datasetName, None, fileNames, chromCounts, typeCounts, lineHashes, options)
+    rowCount = meta["itemCount"]
+    printPhase("Merging and writing", loadTime, rowCount)
+    if bloom is not None:
+        print("Writing Bloom filter %s" % stagedFileName(bloomName))
+        bloom.write(stagedFileName(bloomName))
+
+    print("Replacing dataset %s" % datasetName)
+    swapTime = time.time()
+    swapDataSet(conn, refDb, datasetName, meta, shadowName, coder, store, importMemory)
+    printPhase("Replacing", swapTime, rowCount)
+    if isfile(shadowName):
+        os.remove(shadowName)
+
+
+def sourcesUnchanged(refDb, datasetName, fileNames, options):
+    """ return True if the dataset was imported from the same files with the same options and the files
+    did not change. The fast case costs one stat() per file: the same size and modification time. A file
+    with the same size and a new modification time, e.g. downloaded again, is read to compare the hash of
+    its lines, which the import computed while parsing. """
+    conn = dbOpen(refDb, mustExist=True)
+    if conn is None:
+        return False
+    try:
+        tables = dbListTables(conn)
+        if MetaTable not in tables:
+            return False
+        meta = dbReadMeta(conn).get(datasetName)
+    finally:
+        conn.close()
+    if meta is None or len(meta["sourceFiles"]) != len(fileNames):
+        return False
+    if datasetName not in tables and not isfile(columnFileName(refDb, datasetName)):
+        return False
+    if options["bloomFpRate"] > 0 and not isfile(bloomFileName(refDb, datasetName)):
+        return False
+
+    rehash = []
+    for fileName, source in zip(fileNames, meta["sourceFiles"]):
+        if source.get("options") != options:
+            return False
+        try:
+            fingerprint = fileFingerprint(fileName)
+        except OSError:
+            return False
+        if fingerprint["name"] != source["name"] or fingerprint["size"] != source["size"]:
+            return False
+        if fingerprint["mtime"] != source["mtime"]:
+            if "hash" not in source:
+                return False
+            rehash.append((fileName, source["hash"]))
+    for fileName, lineHash in rehash:
+        print("%s has a new modification time, comparing its contents" % fileName)
+        if "%016x" % fileLineHash(fileName) != lineHash:
+            return False
+    return True
+
+
+def sortFileAlleles(refDb, fileNames, format, coder, importMemory, jobs, lineHashes=None):
+    """ parse files into an ExternalSorter that uses at most importMemory MB and keeps its runs next to the
+    DB of refDb. With a coder, the rows are packed keys. If lineHashes is a dict, the hashes of the lines
+    of the files are added to it. Raises PackError or ParseError. """
+    # the packed schema sorts the keys, the others (chrom, pos, allele). Both are deduplicated by the sorter,
+    # a sorted int takes about 40 bytes in memory, a sorted tuple about 200.
+    tmpDir = dirname(os.path.abspath(dbFileName(refDb)))
+    sorter = ExternalSorter(max(int(importMemory * 1000000) // (200 if coder is None else 40), 1), tmpDir)
+    # the parser creates no reference cycles, so the garbage collector would only slow it down
+    gc.disable()
+    try:
+        if jobs > 1:
+            # the tasks in the pipeline of readInParallel() and their rows stay within the memory budget
+            rangeSize = min(ImportRangeSize, max(int(importMemory * 1000000) // (10 * jobs), MinRangeSize))
+            alleles = readInParallel(splitFiles(fileNames, format, jobs, rangeSize), jobs, lineHashes)
+        else:
+            alleles = itertools.chain.from_iterable(readFileAlleles(fileName, fileFormat(fileName, format),
+                                                                    lineHashes=lineHashes)
+                                                    for fileName in fileNames)
+        if coder is not None:
+            alleles = itertools.starmap(coder.encode, alleles)
+        sorter.extend(alleles)
+    except (PackError, ParseError):
+        sorter.close()
+        raise
+    finally:
+        gc.enable()
+    return sorter
+
+
+def shadowDbFileName(refDb, datasetName):
+    " return name of the DB file that a dataset is imported into before it replaces the live one "
+    return join(dirname(dbFileName(refDb)), "beaconData.%s.%s.import.sqlite" % (refDb, datasetName))
+
+
+def stagedFileName(fileName):
+    " return the name that a new Bloom filter or column store file has until it is renamed to fileName "
+    return fileName + ".import"
+
+
+def swapDataSet(conn, refDb, datasetName, meta, shadowName, coder, store, importMemory):
+    """ replace a dataset of the live DB by the one built by importFiles() or restored from a backup, then
+    rename its staged Bloom filter and column store file into place. The table of the shadow DB is first
+    copied into a staging table of the live DB by copyShadowTable(). Then one short transaction renames the
+    old table away and the staging table into its place and writes the new allele codes and the metadata, so
+    they appear together. With the DB in WAL mode, readers never wait. If meta is None, the metadata is
+    removed and computed again later. """
+    bloomName = bloomFileName(refDb, datasetName)
+    colName = columnFileName(refDb, datasetName)
+    stagingName = SwapTablePrefix + "new_" + datasetName
+    retiredName = SwapTablePrefix + "old_" + datasetName
+    dbEnterWal(conn, importMemory)
+    conn.execute("DROP TABLE IF EXISTS main.%s" % retiredName)
+    if store == "sqlite":
+        copyShadowTable(conn, datasetName, shadowName, stagingName, coder is None)
+    # a write lock now, so the swap cannot fail because another import commits first
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # the old filter would hide new variants, without one the server asks the DB
+        if isfile(bloomName):
+            os.remove(bloomName)
+        if store == "sqlite":
+            # renaming is quick, the old table is dropped after the commit
+            if datasetName in dbListTables(conn):
+                conn.execute("ALTER TABLE main.%s RENAME TO %s" % (datasetName, retiredName))
+            conn.execute("ALTER TABLE main.%s RENAME TO %s" % (stagingName, datasetName))
+            # the statistics are not renamed with their table
+            conn.execute("DELETE FROM main.sqlite_stat1 WHERE tbl=?", (datasetName,))
+            conn.execute("UPDATE main.sqlite_stat1 SET tbl=? WHERE tbl=?", (datasetName, stagingName))
+        if coder is not None:
+            coder.save(conn)
+        if meta is not None:
+            dbWriteMeta(conn, meta, commit=False)
+        elif MetaTable in dbListTables(conn):
+            # computed again from the data when the server needs it
+            conn.execute("DELETE FROM %s WHERE dataset=?" % MetaTable, (datasetName,))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        conn.execute("DROP TABLE IF EXISTS main.%s" % stagingName)
+        raise
+
+    if store == "columnar":
+        # a column store has precedence over a table of the same name, the new one goes live with the rename
+        os.rename(stagedFileName(colName), colName)
+        conn.execute("DROP TABLE IF EXISTS main.%s" % datasetName)
+    else:
+        conn.execute("DROP TABLE IF EXISTS main.%s" % retiredName)
+        if isfile(colName):
+            os.remove(colName)
+    if isfile(stagedFileName(bloomName)):
+        os.rename(stagedFileName(bloomName), bloomName)
+    dbLeaveWal(conn)
+    dbBumpVersion(refDb)
+
+
+def copyShadowTable(conn, datasetName, shadowName, stagingName, indexed):
+    """ copy the table datasetName of a shadow DB into the table stagingName of the live DB, in its own
+    transaction. With indexed, the table gets the unique index of the (chrom, pos, allele) tables. The
+    statistics of ANALYZE are copied from the shadow DB or, for a backup, which has none, computed here.
+    The staging table is not a dataset, so the server does not see it. """
+    conn.execute("ATTACH DATABASE ? AS shadow", (shadowName,))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # left over by an import that was killed
+            conn.execute("DROP TABLE IF EXISTS main.%s" % stagingName)
+            # the shadow table was created by dbMakeTable() or from PackedTableSql, only the name changes
+            tableSql = conn.execute("SELECT sql FROM shadow.sqlite_master WHERE type='table' AND name=?",
+                                    (datasetName,)).fetchone()[0]
+            conn.execute("CREATE TABLE main.%s (%s" % (stagingName, tableSql.split("(", 1)[1]))
+            indexName = None
+            if indexed:
+                # an index cannot be renamed, the new one gets the name that the live one does not have
+                indexNames = set(row[0] for row in conn.execute("SELECT name FROM main.sqlite_master WHERE type='index'"))
+                indexName = "%s_index" % datasetName
+                if indexName in indexNames:
+                    indexName = "%s_index2" % datasetName
+                conn.execute("CREATE UNIQUE INDEX main.'%s' ON '%s' ('chrom', 'pos', 'allele')" % (indexName, stagingName))
+            # the rows of the shadow are sorted, so they are appended to the b-trees of the table and the index
+            conn.execute("INSERT INTO main.%s SELECT * FROM shadow.%s" % (stagingName, datasetName))
+
+            hasStats = conn.execute("SELECT 1 FROM shadow.sqlite_master WHERE name='sqlite_stat1'").fetchone()
+            if hasStats is not None and conn.execute("SELECT 1 FROM shadow.sqlite_stat1 WHERE tbl=?",
+                                                     (datasetName,)).fetchone() is not None:
+                # creates the sqlite_stat1 table if the live DB has none yet
+                conn.execute("ANALYZE main.sqlite_master")
+                conn.execute("INSERT INTO main.sqlite_stat1 SELECT ?, CASE WHEN idx IS NULL THEN NULL ELSE ? END, stat "
+                             "FROM shadow.sqlite_stat1 WHERE tbl=?", (stagingName, indexName, datasetName))
+            else:
+                conn.execute("ANALYZE main.%s" % stagingName)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE shadow")
+
+
+def dbEnterWal(conn, importMemory):
+    """ prepare a connection to the live DB for a transaction that changes a dataset: with a write-ahead log,
+    readers never wait for it and see either the old or the new dataset """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # the transactions are explicit, DDL statements would commit them
+    conn.isolation_level = None
+    conn.execute("PRAGMA cache_size=%d" % -int(importMemory * 1024))
+    conn.execute("PRAGMA temp_store=file")
+
+
+def dbLeaveWal(conn):
+    " move the changes into the DB file and switch the DB back to a rollback journal, if it is not open elsewhere "
+    # the log does not keep the size of the changes
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    # without a log, a CGI does not create and remove the -wal and -shm files for every request.
+    # A long-running server keeps its connections open, then the DB stays in WAL mode until the next import.
+    conn.execute("PRAGMA busy_timeout=0")
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    except sqlite3.OperationalError:
+        print("The DB is still open elsewhere and stays in WAL mode")
+
+
+def mergeFiles(refDb, fileNames, datasetName, format, removeNames=[], bloomFpRate=BloomFpRate,
+               importMemory=ImportMemory, jobs=1):
+    """ add the variants in fileNames to an existing dataset and delete the ones in removeNames, in one
+    transaction. The rows are sorted like an import and applied in key order, so the work depends on the
+    number of added and removed variants, not on the size of the dataset. The metadata is updated with the
+    variants that really were added or removed, its new import time changes the version of the data. """
+    if format != AutoFormat and format not in AlleleReaders:
+        print("Unknown format %s" % format)
+        sys.exit(1)
+    if isfile(columnFileName(refDb, datasetName)):
+        print("Dataset %s is a column store file, which cannot be changed. Import all its files again." % datasetName)
+        sys.exit(1)
+    conn = dbOpen(refDb)
+    tables = dbListTables(conn)
+    if datasetName not in tables:
+        conn.close()
+        if len(fileNames) == 0:
+            print("There is no dataset %s in %s" % (datasetName, refDb))
+            sys.exit(1)
+        print("There is no dataset %s yet, importing the files" % datasetName)
+        importFiles(refDb, fileNames, datasetName, format, bloomFpRate, importMemory=importMemory, jobs=jobs)
+        return
+
+    packed = datasetName in dbPackedTables(conn)
+    meta = dbReadMeta(conn).get(datasetName) if MetaTable in tables else None
+    if meta is None:
+        # a dataset of an older version, its counts are computed once from the data
+        meta = getDataSetMeta(getCatalogue(refDb), datasetName)
+
+    print("Reading files %s to merge into database table %s" % (",".join(fileNames + removeNames), datasetName))
+    resetPeakRss()
+    startTime = time.time()
+    coder = AlleleCoder(conn) if packed else None
+    lineHashes = {}
+    try:
+        addSorter = sortFileAlleles(refDb, fileNames, format, coder, importMemory, jobs, lineHashes)
+        removeSorter = sortFileAlleles(refDb, removeNames, format, coder, importMemory, jobs)
+    except (PackError, ParseError) as e:
+        print("Error: %s" % e)
+        sys.exit(1)
+    printPhase("Parsing and sorting", startTime, addSorter.rowCount + removeSorter.rowCount)
+
+    mergeTime = time.time()
+    if packed:
+        insertSql = "INSERT OR IGNORE INTO %s (key) VALUES (?)" % datasetName
+        deleteSql = "DELETE FROM %s WHERE key=?" % datasetName
+    else:
+        insertSql = "INSERT OR IGNORE INTO %s (chrom, pos, allele) VALUES (?,?,?)" % datasetName
+        deleteSql = "DELETE FROM %s WHERE chrom=? AND pos=? AND allele=?" % datasetName
+    bloomName = bloomFileName(refDb, datasetName)
+    bloom = BloomFilter.load(bloomName)
+    # with room for as many variants again, a filter that gets too full is built again once per doubling
+    rebuildBloom = (bloom is not None and bloomFpRate > 0 and
+                    bloom.fpRate(bloom.numItems + addSorter.rowCount) > 2 * bloomFpRate)
+    if bloom is not None and not rebuildBloom:
+        bloom = bloom.copy()
+    added = (collections.Counter(), collections.Counter())
+    removed = (collections.Counter(), collections.Counter())
+
+    dbEnterWal(conn, importMemory)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        addedAlleles = applyRows(conn, insertSql, addSorter, coder, added, None if rebuildBloom else bloom)
+        removedAlleles = applyRows(conn, deleteSql, removeSorter, coder, removed, None)
+        if coder is not None:
+            coder.save(conn)
+
+        itemCount = meta["itemCount"] + addedAlleles - removedAlleles
+        if addedAlleles == 0:
+            bloom = None  # a filter with removed variants is still valid
+        elif rebuildBloom:
+            print("Rebuilding the Bloom filter, it is too full")
+            bloom = BloomFilter.create(2 * itemCount, bloomFpRate, bloom.noAlt)
+            bloom.addAll(conn.execute(makeRowsSql(datasetName, packed)))
+        if bloom is not None:
+            bloom.write(stagedFileName(bloomName))
+            # like in swapDataSet(), the old filter would hide the new variants
+            os.remove(bloomName)
+
+        chromCounts = collections.Counter(meta["chromCounts"])
+        chromCounts.update(added[0])
+        chromCounts.subtract(removed[0])
+        typeCounts = collections.Counter(meta["alleleTypeCounts"])
+        typeCounts.update(added[1])
+        typeCounts.subtract(removed[1])
+        meta = dict(meta, itemCount=itemCount, importTime=time.time(),
+                    chromCounts=dict((chrom, count) for chrom, count in chromCounts.items() if count != 0),
+                    alleleTypeCounts=dict((type, count) for type, count in typeCounts.items() if count != 0),
+                    sourceFiles=meta["sourceFiles"] +
+                    [fileFingerprint(fileName, lineHashes.get(fileName), {"format": format, "merge": True})
+                     for fileName in fileNames] +
+                    [dict(fileFingerprint(fileName, None, {"format": format, "merge": True}), removed=True)
+                     for fileName in removeNames])
+        dbWriteMeta(conn, meta, commit=False)
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+
+    if bloom is not None:
+        os.rename(stagedFileName(bloomName), bloomName)
+    dbLeaveWal(conn)
+    conn.close()
+    dbBumpVersion(refDb)
+    print("Added %d variants, removed %d, the dataset has %d now" % (addedAlleles, removedAlleles, itemCount))
+    printPhase("Merging", mergeTime, addedAlleles + removedAlleles)
+
+
+def applyRows(conn, sql, sorter, coder, counters, bloom):
+    """ run the INSERT OR IGNORE or DELETE statement sql for every row of a sorter, in key order. The variants
+    that it changed are counted into the Counters (per chromosome, per allele type) and added to the Bloom
+    filter. Returns their number. """
+    cursor = conn.cursor()
+    changedCount = 0
+    for rows in iterChunks(sorter, 50000):
+        changed = [row for row in rows if cursor.execute(sql, (row,) if coder is not None else row).rowcount == 1]
+        alleles = coder.decode(changed) if coder is not None else changed
+        countAlleles(alleles, counters[0], counters[1])
+        if bloom is not None:
+            bloom.addAll(alleles)
+        changedCount += len(changed)
+    return changedCount
+
+
+def migrateDb(refDb):
+    """ write the missing metadata of older datasets, convert the (chrom, pos, allele) tables of the DB of refDb
+    to the packed schema, one transaction per table, and print the size of the DB before and after """
+    dbName = dbFileName(refDb)
+    conn = dbOpen(refDb, mustExist=True)
+    if conn is None:
+        print("There is no database %s" % dbName)
+        sys.exit(1)
+    sizeBefore = os.path.getsize(dbName)
+    dbWriteMissingMeta(conn, refDb)
+    packedTables = dbPackedTables(conn)
+    tables = [t for t in dbListTables(conn) if not t.startswith(("sqlite_", SwapTablePrefix))
+              and t not in InternalTables and t not in packedTables]
+    if len(tables) == 0:
+        print("All tables of %s have the packed schema already" % dbName)
+        return
+
+    # the transactions are explicit, DDL statements would commit them
+    conn.isolation_level = None
+    for tableName in tables:
+        print("Converting table %s" % tableName)
+        startTime = time.time()
+        conn.execute("BEGIN")
+        dbMakeCodeTables(conn)
+        conn.execute("INSERT INTO {0} (chrom) SELECT DISTINCT chrom FROM {1} WHERE chrom NOT IN (SELECT chrom FROM {0}) "
+                     "ORDER BY chrom".format(ChromTable, tableName))
+        conn.execute("INSERT INTO {0} (allele) SELECT DISTINCT allele FROM {1} WHERE allele NOT IN (SELECT allele FROM {0}) "
+                     "ORDER BY allele".format(AlleleTable, tableName))
+        errors = []
+        for codeTable, maxCodes in ((ChromTable, PackedMaxChroms), (AlleleTable, PackedMaxAlleles)):
+            if conn.execute("SELECT MAX(code) FROM %s" % codeTable).fetchone()[0] >= maxCodes:
+                errors.append("more than %d different values in %s" % (maxCodes, codeTable))
+        if conn.execute("SELECT EXISTS (SELECT 1 FROM %s WHERE pos < 0 OR pos >= %d)" % (tableName, PackedMaxPos)).fetchone()[0]:
+            errors.append("a position does not fit into a packed key")
+        if len(errors) != 0:
+            conn.execute("ROLLBACK")
+            print("Error: cannot convert %s: %s" % (tableName, ", ".join(errors)))
+            sys.exit(1)
+
+        tmpName = tableName + "_packed"
+        conn.execute("DROP TABLE IF EXISTS %s" % tmpName)
+        conn.execute(PackedTableSql % tmpName)
+        conn.execute("INSERT OR IGNORE INTO %s (key) SELECT (c.code << %d) | (t.pos << %d) | a.code FROM %s t "
+                     "JOIN %s c ON c.chrom = t.chrom JOIN %s a ON a.allele = t.allele ORDER BY 1"
+                     % (tmpName, PackedChromShift, PackedPosShift, tableName, ChromTable, AlleleTable))
+        conn.execute("DROP TABLE %s" % tableName)
+        conn.execute("ALTER TABLE %s RENAME TO %s" % (tmpName, tableName))
+        conn.execute("COMMIT")
+        printTime(startTime, time.time(), conn.execute("SELECT COUNT(*) FROM %s" % tableName).fetchone()[0])
+
+    print("Compacting the database")
+    conn.execute("VACUUM")
+    conn.close()
+    sizeAfter = os.path.getsize(dbName)
+    print("Size of %s: %d MB before, %d MB after, %.0f%%" % (dbName, sizeBefore / 1000000, sizeAfter / 1000000,
+                                                              100.0 * sizeAfter / sizeBefore))
+
+
+# backups of single datasets, written before an import replaces them. A backup is a sqlite file with the
+# table of the dataset, its metadata and allele codes, and its Bloom filter and column store file.
+BackupKeep = 5
+BackupInfoTable = "beacon_backup_info"
+BackupFilesTable = "beacon_backup_files"
+# the files of a dataset are copied into the backup in blobs of this size
+BackupChunkSize = 1024 * 1024
+
+
+def backupFileName(backupDir, refDb, datasetName, timeStamp):
+    " return name of a backup file of a dataset, the time stamp sorts like the time "
+    return join(backupDir, "beaconData.%s.%s.%s.backup" % (refDb, datasetName, timeStamp))
+
+
+def listBackups(backupDir, refDb, datasetName):
+    " return the names of the backup files of a dataset in backupDir, the oldest first "
+    pattern = re.compile(r"^beaconData\.%s\.%s\.\d{8}-\d{6}-\d{6}\.backup$" % (re.escape(refDb), re.escape(datasetName)))
+    return sorted(join(backupDir, name) for name in os.listdir(backupDir) if pattern.match(name))
+
+
+def backupDataSet(refDb, datasetName, backupDir=None, keep=BackupKeep):
+    """ write a backup of a dataset into backupDir, by default the DB directory, and remove all but the
+    newest keep backups of the dataset, unless keep is 0. The work depends on the size of the dataset, not
+    of the DB. Returns the name of the backup file or None if the dataset does not exist. """
+    conn = dbOpen(refDb, mustExist=True)
+    if conn is None:
+        return None
+    tables = dbListTables(conn)
+    bloomName = bloomFileName(refDb, datasetName)
+    colName = columnFileName(refDb, datasetName)
+    if datasetName not in tables and not isfile(colName):
+        conn.close()
+        return None
+
+    startTime = time.time()
+    backupDir = backupDir or dirname(dbFileName(refDb)) or "."
+    now = time.time()
+    timeStamp = "%s-%06d" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now % 1 * 1000000))
+    backupName = backupFileName(backupDir, refDb, datasetName, timeStamp)
+    tmpName = backupName + ".tmp"
+    print("Writing backup %s" % backupName)
+
+    # the transactions are explicit, DDL statements would commit them
+    conn.isolation_level = None
+    conn.execute("ATTACH DATABASE ? AS backup", (tmpName,))
+    try:
+        conn.execute("PRAGMA backup.journal_mode=OFF")
+        conn.execute("PRAGMA backup.synchronous=OFF")
+        conn.execute("CREATE TABLE backup.%s (refDb text, dataset text, backupTime real)" % BackupInfoTable)
+        conn.execute("INSERT INTO backup.%s VALUES (?,?,?)" % BackupInfoTable, (refDb, datasetName, now))
+        # one read transaction, so the table, its codes and its metadata are from the same import
+        conn.execute("BEGIN")
+        rowCount = 0
+        if datasetName in tables:
+            tableSql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?",
+                                    (datasetName,)).fetchone()[0]
+            conn.execute(re.sub("^CREATE TABLE ", "CREATE TABLE backup.", tableSql))
+            conn.execute("INSERT INTO backup.%s SELECT * FROM main.%s" % (datasetName, datasetName))
+            rowCount = conn.execute("SELECT COUNT(*) FROM backup.%s" % datasetName).fetchone()[0]
+            if datasetName in dbPackedTables(conn):
+                # only the codes of this dataset, the code tables can be much bigger
+                for tableName, codeSql in ((ChromTable, "key >> %d" % PackedChromShift),
+                                           (AlleleTable, "key & %d" % (PackedMaxAlleles - 1))):
+                    conn.execute("CREATE TABLE backup.{0} AS SELECT * FROM main.{0} WHERE code IN "
+                                 "(SELECT DISTINCT {1} FROM main.{2})".format(tableName, codeSql, datasetName))
+        if MetaTable in tables:
+            conn.execute("CREATE TABLE backup.%s AS SELECT * FROM main.%s WHERE dataset=?" % (MetaTable, MetaTable),
+                         (datasetName,))
+        conn.execute("COMMIT")
+
+        conn.execute("CREATE TABLE backup.%s (name text, chunk int, data blob)" % BackupFilesTable)
+        for name, fileName in (("bloom", bloomName), ("col", colName)):
+            if not isfile(fileName):
+                continue
+            with open(fileName, "rb") as ifh:
+                for chunk, data in enumerate(iter(lambda: ifh.read(BackupChunkSize), "")):
+                    conn.execute("INSERT INTO backup.%s VALUES (?,?,?)" % BackupFilesTable,
+                                 (name, chunk, sqlite3.Binary(data)))
+    except:
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.OperationalError:
+            pass  # the error was not in the transaction
+        conn.execute("DETACH DATABASE backup")
+        conn.close()
+        if isfile(tmpName):
+            os.remove(tmpName)
+        raise
+    conn.execute("DETACH DATABASE backup")
+    conn.close()
+    os.rename(tmpName, backupName)
+    printPhase("Backup", startTime, rowCount)
+
+    if keep > 0:
+        for oldName in listBackups(backupDir, refDb, datasetName)[:-keep]:
+            print("Removing old backup %s" % oldName)
+            os.remove(oldName)
+    return backupName
+
+
+def restoreDataSet(backupName, importMemory=ImportMemory):
+    """ replace a dataset by the one in a backup file written by backupDataSet(), like an import.
+    Returns (refDb, datasetName). """
+    startTime = time.time()
+    # connecting would create a missing file
+    if not isfile(backupName):
+        print("Error: cannot restore %s: no such file" % backupName)
+        sys.exit(1)
+    backup = sqlite3.Connection(backupName)
+    try:
+        backupTables = dbListTables(backup)
+    except sqlite3.DatabaseError:
+        backupTables = []
+    if BackupInfoTable not in backupTables:
+        backup.close()
+        print("Error: cannot restore %s: not a backup of a dataset" % backupName)
+        sys.exit(1)
+    refDb, datasetName = backup.execute("SELECT refDb, dataset FROM %s" % BackupInfoTable).fetchone()
+    refDb, datasetName = str(refDb), str(datasetName)
+    print("Restoring dataset %s of %s from %s" % (datasetName, refDb, backupName))
+    meta = None
+    if MetaTable in backupTables:
+        meta = dbReadMeta(backup).get(datasetName)
+
+    # the files are written under the names of an import, swapDataSet() renames them into place
+    fileNames = {"bloom": bloomFileName(refDb, datasetName), "col": columnFileName(refDb, datasetName)}
+    ofhs = {}
+    for name, chunk, data in backup.execute("SELECT name, chunk, data FROM %s ORDER BY name, chunk" % BackupFilesTable):
+        if name not in ofhs:
+            ofhs[name] = open(stagedFileName(fileNames[name]), "wb")
+        ofhs[name].write(data)
+    for ofh in ofhs.values():
+        ofh.close()
+    store = "columnar" if "col" in ofhs else "sqlite"
+
+    conn = dbOpen(refDb)
+    coder = None
+    if ChromTable in backupTables:
+        # the keys of the backup are only valid with its codes
+        dbMakeCodeTables(conn)
+        conn.commit()
+        coder = AlleleCoder(conn)
+        try:
+            for tableName in (ChromTable, AlleleTable):
+                coder.merge(tableName, backup.execute("SELECT code, %s FROM %s" % (
+                    "chrom" if tableName == ChromTable else "allele", tableName)))
+        except PackError as e:
+            print("Error: cannot restore %s: %s" % (backupName, e))
+            sys.exit(1)
+    rowCount = backup.execute("SELECT COUNT(*) FROM %s" % datasetName).fetchone()[0] if datasetName in backupTables else 0
+    backup.close()
+
+    swapDataSet(conn, refDb, datasetName, meta, backupName, coder, store, importMemory)
+    conn.close()
+    printPhase("Restoring", startTime, meta["itemCount"] if meta is not None else rowCount)
+    return refDb, datasetName
+
+
+def makeDevServer():
+    " return the CherryPy application of the development webserver "
+    # imported here, as a CGI does not need cherrypy and the @ lines need it
+    import cherrypy
+
+    def checkNotModified():
+        " set the caching headers of the response, raises a 304 if the client has the current version "
+        etag, lastModified = dataVersion()
+        for name, value in cacheHeaders(etag, lastModified):
+            cherrypy.response.headers[name] = value
+        reqHeaders = cherrypy.request.headers
+        if isNotModified(reqHeaders.get("If-None-Match"), reqHeaders.get("If-Modified-Since"), etag, lastModified):
+            raise cherrypy.HTTPRedirect([], 304)
+
+    class DevServer(object):
+        @cherrypy.expose
+        def query(self, chromosome=None, position=None, referenceBases=None, alternateBases=None, reference=None, dataset=None):
+            if chromosome is None and position is None and alternateBases is None:
+                return makeHelp()
+
+            checkNotModified()
+            if not checkQueryBudget(cherrypy.request.remote.ip, 1):
+                raise cherrypy.HTTPError(429, BudgetErrMsg)
+            try:
+                cherrypy.response.headers['Content-Type'] = contentTypes["json"]
+                queryResp = beaconQuery(chromosome, position, referenceBases, alternateBases, reference, dataset)
+                return makeJson(queryResp)
+            except BeaconError as e:
+                raise cherrypy.HTTPError(e.code, e.msg)
+            except Exception as e:
+                raise cherrypy.HTTPError(500, str(e))
+
+        @cherrypy.expose
+        @cherrypy.tools.json_out()
+        def info(self):
+            checkNotModified()
+            return beaconInfo()
+
+        @cherrypy.expose
+        @cherrypy.tools.json_out()
+        def stats(self):
+            # changes with every request, unlike info
+            cherrypy.response.headers["Cache-Control"] = "no-cache"
+            return serverStats()
+
+        @cherrypy.expose
+        def batch(self, reference=None):
+            if cherrypy.request.method != "POST":
+                raise cherrypy.HTTPError(405, "batch queries must be sent with POST")
+
+            try:
+                cherrypy.response.headers['Content-Type'] = contentTypes["json"]
+                bodyLen = int(cherrypy.request.headers.get("Content-Length") or 0)
+                batchResp = lookupAlleleBatchJson(cherrypy.request.rfile.read(bodyLen), reference, cherrypy.request.remote.ip)
+                return makeJson(batchResp)
+            except BeaconError as e:
+                raise cherrypy.HTTPError(e.code, e.msg)
+            except Exception as e:
+                raise cherrypy.HTTPError(500, str(e))
+        # the body is JSON, no matter what Content-Type the client sends
+        batch._cp_config = {"request.process_request_body": False}
+
+    return DevServer()
+
+
+def initServer():
+    " prepare a long-running server: switch on serverMode, create the result cache and load the datasets "
+    global serverMode, lookupCache, bottleneckClient, queryBudget
+    serverMode = True
+    lookupCache = makeLookupCache()
+    bottleneckClient = makeBottleneckClient()
+    queryBudget = makeQueryBudget()
+    # load the datasets now, not on the first request
+    for refDb in getBeaconRefs():
+        getCatalogue(refDb)
+
+
+def startDevServer(port):
+    " start the development webserver "
+    try:
+        import cherrypy
+    except ImportError:
+        print("You are trying to start the development webserver but the cherryPy directory cannot be found.")
+        print("You have to re-download or copy the beacon directory again from github or your source to this directory and include the cherryPy/ subdirectory.")
+        sys.exit(1)
+    initServer()
+    cherrypy.config.update({'server.socket_port': port, 'server.socket_host': '0.0.0.0'})
+    cherrypy.quickstart(makeDevServer())
+    sys.exit(0)
+
+
+def mainCommandLine():
+    " main function if called from command line "
+    args, options = parseArgs()
+
+    if options.port:
+        startDevServer(options.port)
+    if options.wsgiPort:
+        startWsgiServer(options.wsgiPort)
+
+    if options.migrate:
+        if len(args) != 1 or args[0] not in getBeaconRefs():
+            print("--migrate needs one reference assembly, one of: %s" % ",".join(getBeaconRefs()))
+            sys.exit(1)
+        migrateDb(args[0])
+        sys.exit(0)
+
+    if options.backup:
+        if len(args) < 2 or args[0] not in getBeaconRefs():
+            print("--backup needs a reference assembly, one of: %s, and dataset names" % ",".join(getBeaconRefs()))
+            sys.exit(1)
+        if options.keepBackups < 0:
+            print("--keep-backups must be at least 0")
+            sys.exit(1)
+        for datasetName in args[1:]:
+            if backupDataSet(args[0], datasetName, options.backupDir, options.keepBackups) is None:
+                print("There is no dataset %s in %s, nothing to back up" % (datasetName, args[0]))
+        sys.exit(0)
+
+    if options.restore:
+        if len(args) == 0:
+            print("--restore needs the names of backup files")
+            sys.exit(1)
+        for backupName in args:
+            restoreDataSet(backupName, options.importMemory)
+        sys.exit(0)
+
+    merge = options.merge or len(options.removeNames) != 0
+    if len(args) < 3 and not (len(args) == 2 and len(options.removeNames) != 0):
+        print("You need to specify at least an assembly, a datasetName and one fileName to import")
+        sys.exit(1)
+    refDb = args[0]
+    datasetName = args[1]
+    fileNames = listInputFiles(args[2:])
+    options.removeNames = listInputFiles(options.removeNames)
+
+    if refDb not in getBeaconRefs():
+        print("The reference assembly '%s' is not valid." % refDb)
+        print("Please specify one of these reference assemblies:")
+        print(",".join(getBeaconRefs()))
+        sys.exit(1)
+
+    if options.store not in ("sqlite", "columnar"):
+        print("--store must be sqlite or columnar")
+        sys.exit(1)
+    if options.schema not in (1, 2):
+        print("--schema must be 1 or 2")
+        sys.exit(1)
+
+    if options.jobs < 1:
+        print("--jobs must be at least 1")
+        sys.exit(1)
+
+    if options.unchanged:
+        options = {"format": options.format, "schema": options.schema, "store": options.store,
+                   "bloomFpRate": options.bloomFpRate}
+        sys.exit(0 if sourcesUnchanged(refDb, datasetName, fileNames, options) else 1)
+    if merge:
+        mergeFiles(refDb, fileNames, datasetName, options.format, options.removeNames, options.bloomFpRate,
+                   options.importMemory, options.jobs)
+    else:
+        importFiles(refDb, fileNames, datasetName, options.format, options.bloomFpRate, options.store, options.schema,
+                    options.importMemory, options.jobs, options.force)
+
+
+def beaconQuery(chrom, pos, refBases, altBases, reference, dataset):
+    """ query the beacon, returns a JSON or text string """
+    if chrom is None and pos is None and altBases is None:
+        printResponse(makeHelp(), contentTypes["text"], 400)
+        sys.exit(0)
+
+    return lookupAlleleJson(chrom, pos, altBases, refBases, reference, dataset)
+
+
+def mainCgi():
+    url = os.environ["REQUEST_URI"]
+    parsedUrl = urlparse.urlparse(url)
+
+    # react based on symlink that was used to call this script
+    page = parsedUrl[2].split("/")[-1]  # last part of path is REST endpoint
+    if page == "batch":
+        mainCgiBatch(parsedUrl)
+        sys.exit(0)
+
+    # the answers to info and query change only with an import, a client that has
+    # the current version does not need to wait for the bottleneck
+    etag, lastModified = dataVersion()
+    headers = cacheHeaders(etag, lastModified)
+    if isNotModified(os.environ.get("HTTP_IF_NONE_MATCH"), os.environ.get("HTTP_IF_MODIFIED_SINCE"), etag, lastModified):
+        printResponse("", None, 304, headers)
+        sys.exit(0)
+
+    if page == "info":
+        printResponse(makeJson(beaconInfo()), contentTypes["json"], headers=headers)
+        sys.exit(0)
+
+    if not checkQueryBudget(os.environ["REMOTE_ADDR"], 1):
+        printResponse(BudgetErrMsg, contentTypes["text"], 429)
+        sys.exit(0)
+    hgBotDelay()
+
+    # get CGI parameters, the cgi module is slow to import and only needed for POSTed forms
+    if os.environ.get("REQUEST_METHOD", "GET") == "GET":
+        params = urlparse.parse_qs(os.environ.get("QUERY_STRING", ""))
+        getParam = lambda name: params.get(name, [None])[0]
+    else:
+        import cgi
+        getParam = cgi.FieldStorage().getfirst
+
+    chrom = getParam("chromosome")
+    pos = getParam("position")
+    refBases = getParam("referenceBases")
+    altBases = getParam("alternateBases")
+    reference = getParam("reference")
+    dataset = getParam("dataset")
+
+    try:
+        queryResp = beaconQuery(chrom, pos, refBases, altBases, reference, dataset)
+        printResponse(makeJson(queryResp), contentTypes["json"], headers=headers)
+    except BeaconError as e:
+        printResponse(e.msg, contentTypes["text"], e.code)
+    except Exception as e:
+        printResponse(str(e), contentTypes["text"], 500)
+
+
+def mainCgiBatch(parsedUrl):
+    " answer a batch query, the variants are the POSTed body, the reference can be a URL parameter "
+    if os.environ.get("REQUEST_METHOD") != "POST":
+        printResponse("batch queries must be sent with POST", contentTypes["text"], 405)
+        return
+
+    reference = urlparse.parse_qs(parsedUrl[4]).get("reference", [None])[0]
+    body = sys.stdin.read(int(os.environ.get("CONTENT_LENGTH") or 0))
+    try:
+        items = parseBatchBody(body, os.environ["REMOTE_ADDR"])
+        hgBotDelay(len(items))
+        batchResp = lookupAlleleBatchItems(items, reference)
+        printResponse(makeJson(batchResp), contentTypes["json"])
+    except BeaconError as e:
+        printResponse(e.msg, contentTypes["text"], e.code)
+    except Exception as e:
+        printResponse(str(e), contentTypes["text"], 500)
+
+
+def printResponse(body, contentType="text/html", responseCode=200, headers=[]):
+    " print a CGI response, headers is a list of additional (name, value) headers, contentType can be None "
+    headerLines = ["Status: {} {}".format(responseCode, responses.get(responseCode, "Unknown response code"))]
+    if contentType is not None:
+        headerLines.append("Content-Type: {}".format(contentType))
+    headerLines.extend("{}: {}".format(name, value) for name, value in headers)
+    print("{}\n\n{}".format("\n".join(headerLines), body))
+    sys.stdout.flush()
+
+
+wsgiInitLock = threading.Lock()
+wsgiReady = False
+
+
+def application(environ, start_response):
+    """ WSGI entry point, serves query, info, batch and stats. Mount it with mod_wsgi, e.g.
+    WSGIScriptAliasMatch ^/(query|info|batch|stats)$ /var/www/html/beacon/query, or run ./query -w 8888.
+    The process keeps its DB connections, datasets and config between requests. """
+    global wsgiReady
+    if not wsgiReady:
+        with wsgiInitLock:
+            if not wsgiReady:
+                initServer()
+                wsgiReady = True
+
+    # the endpoint is the last part of the path, as for the CGI symlinks
+    page = (environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")).split("/")[-1]
+    try:
+        if page == "batch":
+            return wsgiBatch(environ, start_response)
+        elif page == "stats":
+            return wsgiResponse(start_response, makeJson(serverStats()), contentTypes["json"],
+                                headers=[("Cache-Control", "no-cache")])
+        elif page not in ("query", "info"):
+            return wsgiResponse(start_response, "unknown endpoint %s" % page, contentTypes["text"], 404)
+
+        etag, lastModified = dataVersion()
+        headers = cacheHeaders(etag, lastModified)
+        if isNotModified(environ.get("HTTP_IF_NONE_MATCH"), environ.get("HTTP_IF_MODIFIED_SINCE"), etag, lastModified):
+            return wsgiResponse(start_response, "", None, 304, headers)
+        if page == "info":
+            return wsgiResponse(start_response, makeJson(beaconInfo()), contentTypes["json"], headers=headers)
+
+        params = urlparse.parse_qs(environ.get("QUERY_STRING", ""))
+        chrom, pos, refBases, altBases, reference, dataset = [params.get(name, [None])[0] for name in
+            ("chromosome", "position", "referenceBases", "alternateBases", "reference", "dataset")]
+        if chrom is None and pos is None and altBases is None:
+            return wsgiResponse(start_response, makeHelp(), contentTypes["text"], 400)
+        if not checkQueryBudget(environ.get("REMOTE_ADDR"), 1):
+            return wsgiResponse(start_response, BudgetErrMsg, contentTypes["text"], 429)
+        if not wsgiBotDelay(environ):
+            return wsgiResponse(start_response, "Blocked", contentTypes["text"], 429)
+        queryResp = lookupAlleleJson(chrom, pos, altBases, refBases, reference, dataset)
+        return wsgiResponse(start_response, makeJson(queryResp), contentTypes["json"], headers=headers)
+    except BeaconError as e:
+        return wsgiResponse(start_response, e.msg, contentTypes["text"], e.code)
+    except Exception as e:
+        return wsgiResponse(start_response, str(e), contentTypes["text"], 500)
+
+
+def wsgiBatch(environ, start_response):
+    " answer a batch query, the variants are the POSTed body, the reference can be a URL parameter "
+    if environ.get("REQUEST_METHOD") != "POST":
+        return wsgiResponse(start_response, "batch queries must be sent with POST", contentTypes["text"], 405)
+    reference = urlparse.parse_qs(environ.get("QUERY_STRING", "")).get("reference", [None])[0]
+    body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+    items = parseBatchBody(body, environ.get("REMOTE_ADDR"))
+    if not wsgiBotDelay(environ, len(items)):
+        return wsgiResponse(start_response, "Blocked", contentTypes["text"], 429)
+    batchResp = lookupAlleleBatchItems(items, reference)
+    return wsgiResponse(start_response, makeJson(batchResp), contentTypes["json"])
+
+
+def wsgiResponse(start_response, body, contentType, responseCode=200, headers=[]):
+    " start a WSGI response like printResponse and return its body "
+    status = "{} {}".format(responseCode, responses.get(responseCode, "Unknown response code"))
+    responseHeaders = list(headers)
+    if contentType is not None:
+        responseHeaders.append(("Content-Type", contentType))
+    responseHeaders.append(("Content-Length", str(len(body))))
+    start_response(status, responseHeaders)
+    return [body]
+
+
+def makeWsgiServer(port, numthreads=16):
+    """ return the WSGI server of cherrypy for the application, changed so that a delayed response does not
+    block its worker thread: the response is written into a buffer and the connection is parked in a
+    DelayQueue. When the delay has passed, the connection goes back into the queue of the worker threads,
+    which send the response and continue with the next request of the connection. """
+    import socket
+    from cherrypy import wsgiserver
+
+    class DelayedResponseBuffer(object):
+        " takes the place of the wfile of a connection while the response is delayed "
+        def __init__(self):
+            self.chunks = []
+            self.bytes_written = 0
+
+        def sendall(self, data):
+            self.chunks.append(data)
+            self.bytes_written += len(data)
+
+    class DelayingRequest(wsgiserver.HTTPRequest):
+        def respond(self):
+            conn = self.conn
+            try:
+                wsgiserver.HTTPRequest.respond(self)
+            except Exception:
+                # the error is sent right away
+                if conn.delayedResponse is not None:
+                    conn.wfile, conn.delayedResponse = conn.socketWfile, None
+                raise
+            if conn.delayedResponse is not None:
+                conn.wfile = conn.socketWfile
+                conn.keepAlive = not self.close_connection
+                # end communicate() of the worker thread, the connection is not closed, see below
+                self.close_connection = True
+
+    class DelayingConnection(wsgiserver.HTTPConnection):
+        RequestHandlerClass = DelayingRequest
+        delayedResponse = None
+
+        def delayResponse(self, delay):
+            " called by the application: send the response delay seconds later "
+            self.delay = delay
+            self.socketWfile = self.wfile
+            self.wfile = self.delayedResponse = DelayedResponseBuffer()
+
+        def communicate(self):
+            if self.delayedResponse is not None:
+                # back from the DelayQueue
+                chunks = self.delayedResponse.chunks
+                self.delayedResponse = None
+                try:
+                    self.wfile.sendall("".join(chunks))
+                except socket.error:
+                    return
+                if not self.keepAlive:
+                    return
+            wsgiserver.HTTPConnection.communicate(self)
+
+        def close(self):
+            if self.delayedResponse is not None:
+                self.server.delayQueue.add(self.delay, self)
+            else:
+                wsgiserver.HTTPConnection.close(self)
+
+    class DelayingGateway(wsgiserver.WSGIGateway_10):
+        def get_environ(self):
+            env = wsgiserver.WSGIGateway_10.get_environ(self)
+            env["beacon.delay_response"] = self.req.conn.delayResponse
+            return env
+
+    class DelayingWSGIServer(wsgiserver.CherryPyWSGIServer):
+        ConnectionClass = DelayingConnection
+
+        def __init__(self, *args, **kwargs):
+            wsgiserver.CherryPyWSGIServer.__init__(self, *args, **kwargs)
+            self.gateway = DelayingGateway
+            self.delayQueue = DelayQueue(self.requests.put)
+
+        def stop(self):
+            for conn in self.delayQueue.stop():
+                wsgiserver.HTTPConnection.close(conn)
+            wsgiserver.CherryPyWSGIServer.stop(self)
+
+    global delayQueue
+    server = DelayingWSGIServer(("0.0.0.0", port), application, numthreads=numthreads, request_queue_size=128)
+    delayQueue = server.delayQueue
+    return server
+
+
+def startWsgiServer(port):
+    " serve the WSGI application with the WSGI server that is part of cherrypy "
+    try:
+        from cherrypy import wsgiserver
+    except ImportError:
+        print("You are trying to start the WSGI server but the cherryPy directory cannot be found.")
+        sys.exit(1)
+    initServer()
+    global wsgiReady
+    wsgiReady = True
+    server = makeWsgiServer(port)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    # deactivate this on the RR, but useful for debugging: prints a http header
+    # on errors
+    main()
@@ -34,3 +34,32 @@ else
   echo "Filtered $DATA_DIR/$TEST_VCF from $ORIG_LINES to $FILT_LINES"
 fi
 rm $FILT_VCF
+
+# the Python bottleneck server answers like the UCSC one and keeps its state over a restart
+BN_PORT=17799
+BN_STATE=$DATA_DIR/bottleneck.json
+rm -f $BN_STATE
+utils/bottleneck.py start -port=$BN_PORT -state=$BN_STATE -foreground &
+BN_PID=$!
+sleep 1
+utils/bottleneck.py query 10.1.2.3 3 -port=$BN_PORT
+DELAY=$(utils/bottleneck.py query 10.1.2.3 -port=$BN_PORT | cut -d' ' -f1)
+if [[ $DELAY -lt 550 || $DELAY -gt 600 ]]; then
+  echo "Expected a delay of about 600 msecs after 4 queries, got $DELAY"
+  kill $BN_PID
+  exit 1
+fi
+kill $BN_PID
+wait $BN_PID || true
+utils/bottleneck.py start -port=$BN_PORT -state=$BN_STATE -foreground &
+BN_PID=$!
+sleep 1
+DELAY=$(utils/bottleneck.py query 10.1.2.3 -port=$BN_PORT | cut -d' ' -f1)
+kill $BN_PID
+wait $BN_PID || true
+rm $BN_STATE
+if [[ $DELAY -lt 700 ]]; then
+  echo "The delay did not survive a restart of the bottleneck server, got $DELAY"
+  exit 1
+fi
+echo "Bottleneck server delay after restart: $DELAY msecs"
@@ -0,0 +1,1041 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# Micro-benchmarks for the beacon server, run from the repo base directory:
+#   utils/benchmark.py pool [-n 20000]
+#   utils/benchmark.py datasets [-n 5000] [-s 1,2,5,10,20,50]
+#   utils/benchmark.py bloom [-n 20000] [-r 200000] [--fp-rate 0.01]
+#   utils/benchmark.py engine [-n 20000] [-r 200000] [-b 1000]
+#   utils/benchmark.py info [-n 200] [-r 1000000]
+#   utils/benchmark.py cache [-n 50000] [-r 200000] [--hot 2000] [--entries 100000]
+#   utils/benchmark.py wsgi [-n 200] [-c 4]
+#   utils/benchmark.py startup [-n 30]
+#   utils/benchmark.py bottleneck [-n 5000] [--ips 1000]
+#   utils/benchmark.py daemon [-n 200000] [-c 1000] [--ips 100000] [-p 10] [-j 2]
+#   utils/benchmark.py throttle [-t 5] [--robots 100] [--delay 1000]
+#   utils/benchmark.py budget [-n 200000] [--ips 100000] [-j 2]
+#   utils/benchmark.py schema [-n 20000] [-r 50000000] [-b 1000]
+#   utils/benchmark.py import [-s 100000,1000000,10000000] [--import-memory 100]
+#   utils/benchmark.py jobs [-r 10000000] [-j 1,2,4,8,16]
+#   utils/benchmark.py gunzip [-r 2000000] [-t 1,2,4]
+#   utils/benchmark.py swap [-r 2000000] [--schema 2]
+#   utils/benchmark.py backup [-r 5000000] [-s 10000,100000,1000000]
+#   utils/benchmark.py merge [-r 5000000] [-s 10000,100000,1000000]
+#   utils/benchmark.py fingerprint [-s 100000,1000000,10000000]
+#   utils/benchmark.py formats [-s 100000,1000000,10000000] [--import-memory 100]
+
+import argparse
+import httplib
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import SocketServer
+import StringIO
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+
+    pool_parser = subparsers.add_parser("pool", help="per-request latency of pooled connections vs one connection per request")
+    pool_parser.add_argument('-n', '--num', type=int, default=20000, help="number of queries per run. Default: %(default)s")
+    pool_parser.add_argument('-r', '--reference', default="GRCh37", help="reference assembly to query. Default: %(default)s")
+    pool_parser.add_argument('-d', '--dataset', default="test", help="dataset to take the hits from. Default: %(default)s")
+
+    datasets_parser = subparsers.add_parser("datasets", help="miss latency of an all-datasets query as the number of datasets grows")
+    datasets_parser.add_argument('-n', '--num', type=int, default=5000, help="number of queries per run. Default: %(default)s")
+    datasets_parser.add_argument('-r', '--rows', type=int, default=10000, help="number of variants per dataset. Default: %(default)s")
+    datasets_parser.add_argument('-s', '--sizes', type=comma_ints, default=[1, 2, 5, 10, 20, 50],
+                                 help="comma delimited numbers of datasets. Default: 1,2,5,10,20,50")
+
+    bloom_parser = subparsers.add_parser("bloom", help="hit and miss latency with and without the Bloom filters")
+    bloom_parser.add_argument('-n', '--num', type=int, default=20000, help="number of hits and of misses per run. Default: %(default)s")
+    bloom_parser.add_argument('-r', '--rows', type=int, default=200000, help="number of variants in the dataset. Default: %(default)s")
+    bloom_parser.add_argument('-s', '--datasets', type=int, default=5, help="number of datasets. Default: %(default)s")
+    bloom_parser.add_argument('--fp-rate', type=float, default=0.01, help="false positive rate of the filters. Default: %(default)s")
+
+    engine_parser = subparsers.add_parser("engine", help="single and batch lookup latency of the sqlite and memory engines and the column store")
+    engine_parser.add_argument('-n', '--num', type=int, default=20000, help="number of queries per run. Default: %(default)s")
+    engine_parser.add_argument('-r', '--rows', type=int, default=200000, help="number of variants per dataset. Default: %(default)s")
+    engine_parser.add_argument('-s', '--datasets', type=int, default=5, help="number of datasets. Default: %(default)s")
+    engine_parser.add_argument('-b', '--batch-size', type=int, default=1000, help="variants per batch query. Default: %(default)s")
+
+    info_parser = subparsers.add_parser("info", help="/info latency with COUNT(*) per request vs the beacon_meta table")
+    info_parser.add_argument('-n', '--num', type=int, default=200, help="number of /info requests per run. Default: %(default)s")
+    info_parser.add_argument('-r', '--rows', type=int, default=1000000, help="number of variants per dataset. Default: %(default)s")
+    info_parser.add_argument('-s', '--datasets', type=int, default=3, help="number of datasets. Default: %(default)s")
+
+    cache_parser = subparsers.add_parser("cache", help="lookup latency of a skewed workload with and without the LRU result cache")
+    cache_parser.add_argument('-n', '--num', type=int, default=50000, help="number of queries per run. Default: %(default)s")
+    cache_parser.add_argument('-r', '--rows', type=int, default=200000, help="number of variants per dataset. Default: %(default)s")
+    cache_parser.add_argument('-s', '--datasets', type=int, default=5, help="number of datasets. Default: %(default)s")
+    cache_parser.add_argument('--hot', type=int, default=2000, help="number of variants that get 90%% of the queries. Default: %(default)s")
+    cache_parser.add_argument('--entries', type=int, default=100000, help="size of the cache. Default: %(default)s")
+
+    wsgi_parser = subparsers.add_parser("wsgi", help="requests/sec and latency of the CGI compared to the WSGI application")
+    wsgi_parser.add_argument('-n', '--num', type=int, default=200, help="number of requests per run. Default: %(default)s")
+    wsgi_parser.add_argument('-c', '--clients', type=int, default=4, help="number of concurrent clients. Default: %(default)s")
+    wsgi_parser.add_argument('-r', '--reference', default="GRCh37", help="reference assembly to query. Default: %(default)s")
+    wsgi_parser.add_argument('-d', '--dataset', default="test", help="dataset to take the hits from. Default: %(default)s")
+
+    startup_parser = subparsers.add_parser("startup", help="wall time of one CGI run of the query script, to track over releases")
+    startup_parser.add_argument('-n', '--num', type=int, default=30, help="number of runs per request type. Default: %(default)s")
+
+    bottleneck_parser = subparsers.add_parser("bottleneck", help="latency added by the bottleneck query, one connection per request vs the pooled client")
+    bottleneck_parser.add_argument('-n', '--num', type=int, default=5000, help="number of requests per run. Default: %(default)s")
+    bottleneck_parser.add_argument('--ips', type=int, default=1000, help="number of client IPs. Default: %(default)s")
+
+    daemon_parser = subparsers.add_parser("daemon", help="load test of utils/bottleneck.py with synthetic IPs")
+    daemon_parser.add_argument('-n', '--num', type=int, default=200000, help="number of queries. Default: %(default)s")
+    daemon_parser.add_argument('-c', '--connections', type=int, default=1000, help="number of open client connections. Default: %(default)s")
+    daemon_parser.add_argument('--ips', type=int, default=100000, help="number of synthetic client IPs. Default: %(default)s")
+    daemon_parser.add_argument('-p', '--pipeline', type=int, default=10, help="queries sent at once on a connection. Default: %(default)s")
+    daemon_parser.add_argument('-j', '--jobs', type=int, default=2, help="number of client processes. Default: %(default)s")
+
+    throttle_parser = subparsers.add_parser("throttle", help="requests/sec of a normal client while throttled clients wait, sleeping vs delayed responses")
+    throttle_parser.add_argument('-t', '--time', type=float, default=5, help="seconds per run. Default: %(default)s")
+    throttle_parser.add_argument('--robots', type=int, default=100, help="number of throttled clients. Default: %(default)s")
+    throttle_parser.add_argument('--delay', type=int, default=1000, help="delay of the throttled clients in msecs. Default: %(default)s")
+    throttle_parser.add_argument('-c', '--threads', type=int, default=16, help="number of server threads. Default: %(default)s")
+
+    budget_parser = subparsers.add_parser("budget", help="latency of the per-IP query budget in shared memory")
+    budget_parser.add_argument('-n', '--num', type=int, default=200000, help="number of queries per run. Default: %(default)s")
+    budget_parser.add_argument('--ips', type=int, default=100000, help="number of client IPs. Default: %(default)s")
+    budget_parser.add_argument('-j', '--jobs', type=int, default=2, help="number of processes that share the counters. Default: %(default)s")
+
+    schema_parser = subparsers.add_parser("schema", help="DB size and lookup latency of the (chrom, pos, allele) tables vs the packed schema")
+    schema_parser.add_argument('-n', '--num', type=int, default=20000, help="number of queries per run. Default: %(default)s")
+    schema_parser.add_argument('-r', '--rows', type=int, default=50000000,
+                               help="number of variants, distributed like utils/gen_vcf.py. Default: %(default)s")
+    schema_parser.add_argument('-b', '--batch-size', type=int, default=1000, help="variants per batch query. Default: %(default)s")
+
+    import_parser = subparsers.add_parser("import", help="speed and peak memory of the import phases, sorting in memory vs in runs on disk")
+    import_parser.add_argument('-s', '--sizes', type=comma_ints, default=[100000, 1000000, 10000000],
+                               help="comma delimited numbers of variants of the VCF files. Default: 100000,1000000,10000000")
+    import_parser.add_argument('--import-memory', type=int, default=100, help="memory budget of the import in MB. Default: %(default)s")
+    import_parser.add_argument('--schema', type=int, default=2, help="schema of the imported table. Default: %(default)s")
+
+    jobs_parser = subparsers.add_parser("jobs", help="import speed with 1, 2, 4... parsing processes")
+    jobs_parser.add_argument('-r', '--rows', type=int, default=10000000, help="number of variants of the VCF file. Default: %(default)s")
+    jobs_parser.add_argument('-j', '--jobs', type=comma_ints, default=[1, 2, 4, 8, 16],
+                             help="comma delimited numbers of parsing processes. Default: 1,2,4,8,16")
+    jobs_parser.add_argument('--schema', type=int, default=2, help="schema of the imported table. Default: %(default)s")
+
+    gunzip_parser = subparsers.add_parser("gunzip", help="MB/sec of reading the lines of a gzip and a BGZF file, Python's gzip vs readLines()")
+    gunzip_parser.add_argument('-r', '--rows', type=int, default=2000000, help="number of variants of the VCF file. Default: %(default)s")
+    gunzip_parser.add_argument('-t', '--threads', type=comma_ints, default=[1, 2, 4],
+                               help="comma delimited numbers of threads that inflate BGZF blocks. Default: 1,2,4")
+
+    swap_parser = subparsers.add_parser("swap", help="lookup latency and wrong answers while a dataset is imported again")
+    swap_parser.add_argument('-r', '--rows', type=int, default=2000000, help="number of variants of the VCF file. Default: %(default)s")
+    swap_parser.add_argument('--schema', type=int, default=2, help="schema of the imported table. Default: %(default)s")
+
+    backup_parser = subparsers.add_parser("backup", help="time of a dataset backup and restore vs copying the whole DB file")
+    backup_parser.add_argument('-r', '--rows', type=int, default=5000000, help="number of variants of the big dataset. Default: %(default)s")
+    backup_parser.add_argument('-s', '--sizes', type=comma_ints, default=[10000, 100000, 1000000],
+                               help="comma delimited numbers of variants of the backed up dataset. Default: 10000,100000,1000000")
+
+    merge_parser = subparsers.add_parser("merge", help="time of merging new variants into a dataset vs importing all of them again")
+    merge_parser.add_argument('-r', '--rows', type=int, default=5000000, help="number of variants of the dataset. Default: %(default)s")
+    merge_parser.add_argument('-s', '--sizes', type=comma_ints, default=[10000, 100000, 1000000],
+                              help="comma delimited numbers of added and removed variants. Default: 10000,100000,1000000")
+    merge_parser.add_argument('--schema', type=int, default=2, help="schema of the imported table. Default: %(default)s")
+
+    fingerprint_parser = subparsers.add_parser("fingerprint", help="time of an import of unchanged files vs a forced import")
+    fingerprint_parser.add_argument('-s', '--sizes', type=comma_ints, default=[100000, 1000000, 10000000],
+                                    help="comma delimited numbers of variants. Default: 100000,1000000,10000000")
+
+    formats_parser = subparsers.add_parser("formats", help="speed and peak memory of importing bed files and a directory of mixed formats")
+    formats_parser.add_argument('-s', '--sizes', type=comma_ints, default=[100000, 1000000, 10000000],
+                                help="comma delimited numbers of variants. Default: 100000,1000000,10000000")
+    formats_parser.add_argument('--import-memory', type=int, default=100, help="memory budget of the import in MB. Default: %(default)s")
+    args = parser.parse_args()
+
+    beacon = load_beacon()
+    if args.command == "pool":
+        bench_pool(beacon, args)
+    elif args.command == "datasets":
+        bench_datasets(beacon, args)
+    elif args.command == "bloom":
+        bench_bloom(beacon, args)
+    elif args.command == "engine":
+        bench_engine(beacon, args)
+    elif args.command == "info":
+        bench_info(beacon, args)
+    elif args.command == "cache":
+        bench_cache(beacon, args)
+    elif args.command == "wsgi":
+        bench_wsgi(beacon, args)
+    elif args.command == "startup":
+        bench_startup(beacon, args)
+    elif args.command == "bottleneck":
+        bench_bottleneck(beacon, args)
+    elif args.command == "daemon":
+        bench_daemon(beacon, args)
+    elif args.command == "throttle":
+        bench_throttle(beacon, args)
+    elif args.command == "budget":
+        bench_budget(beacon, args)
+    elif args.command == "schema":
+        bench_schema(beacon, args)
+    elif args.command == "import":
+        bench_import(beacon, args)
+    elif args.command == "jobs":
+        bench_jobs(beacon, args)
+    elif args.command == "gunzip":
+        bench_gunzip(beacon, args)
+    elif args.command == "swap":
+        bench_swap(beacon, args)
+    elif args.command == "backup":
+        bench_backup(beacon, args)
+    elif args.command == "merge":
+        bench_merge(beacon, args)
+    elif args.command == "fingerprint":
+        bench_fingerprint(beacon, args)
+    elif args.command == "formats":
+        bench_formats(beacon, args)
+
+
+###
+
+
+def load_beacon():
+    " import the beacon server module "
+    if not os.path.isfile("beacon.py"):
+        print("Cannot locate beacon.py, run this from the repo base directory")
+        sys.exit(1)
+    sys.path.insert(0, os.getcwd())  # for beacon.py and the cherrypy directory, like when query is run
+    import beacon
+    return beacon
+
+
+def comma_ints(arg_str):
+    try:
+        return [int(x) for x in arg_str.split(',')]
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+class TempDbDir(object):
+    " context manager that redirects the beacon DB files into a temporary directory "
+    def __init__(self, beacon):
+        self.beacon = beacon
+
+    def __enter__(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_db_file_name = self.beacon.dbFileName
+        self.beacon.dbFileName = lambda refDb: os.path.join(self.tmp_dir, "beaconData.%s.sqlite" % refDb)
+        return self.tmp_dir
+
+    def __exit__(self, *exc_info):
+        self.beacon.dbFileName = self.orig_db_file_name
+        self.beacon.dbPool.closeAll()
+        self.beacon.catalogues.clear()
+        shutil.rmtree(self.tmp_dir)
+
+
+def random_rows(num, chrom="1"):
+    " return num random (chrom, pos, allele) tuples "
+    return [(chrom, random.randint(0, 249250621), random.choice("ACGT")) for i in range(num)]
+
+
+def make_db(beacon, reference, tables):
+    " create DB tables with the given dict tableName -> rows, the same way as an import "
+    conn = beacon.dbOpen(reference)
+    for table_name, rows in tables.items():
+        beacon.dbMakeTable(conn, table_name)
+        conn.executemany("INSERT INTO %s VALUES (?,?,?)" % table_name, sorted(set(rows)))
+        conn.execute("CREATE UNIQUE INDEX '%s_index' ON '%s' ('chrom', 'pos', 'allele')" % (table_name, table_name))
+    conn.commit()
+    conn.close()
+
+
+def make_queries(beacon, reference, dataset, num):
+    " return num (chrom, pos, allele) tuples, half of them hits from dataset, half misses "
+    conn = beacon.dbOpen(reference, mustExist=True)
+    rows = conn.execute("SELECT chrom, pos, allele FROM %s" % dataset).fetchall()
+    conn.close()
+    queries = []
+    for i in range(num):
+        chrom, pos, allele = random.choice(rows)
+        if i % 2:
+            pos += 1000000000  # guaranteed miss
+        queries.append((str(chrom), pos, str(allele)))
+    return queries
+
+
+def time_calls(func, arg_list):
+    " call func once per argument tuple, return the sorted latencies in seconds "
+    latencies = []
+    for args in arg_list:
+        start = time.time()
+        func(*args)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return latencies
+
+
+def print_latencies(name, latencies):
+    " print median, mean and p99 of latencies in microseconds "
+    num = len(latencies)
+    print("{:<28} n={:<7} median={:8.1f}us  mean={:8.1f}us  p99={:8.1f}us".format(
+        name, num, latencies[num // 2] * 1e6, sum(latencies) / num * 1e6, latencies[int(num * 0.99)] * 1e6))
+
+
+class OpenPerRequest(object):
+    " stand-in for beacon.dbPool that opens a fresh connection for every request, like before the pool "
+    def __init__(self, beacon):
+        self.beacon = beacon
+
+    def get(self, refDb, fileId=None):
+        return self.beacon.dbOpen(refDb, mustExist=True)
+
+
+def bench_pool(beacon, args):
+    queries = make_queries(beacon, args.reference, args.dataset, args.num)
+    arg_list = [(chrom, pos, allele, args.reference, args.dataset) for chrom, pos, allele in queries]
+
+    pool = beacon.dbPool
+    beacon.dbPool = OpenPerRequest(beacon)
+    print_latencies("open per request", time_calls(beacon.lookupAllele, arg_list))
+
+    beacon.dbPool = pool
+    print_latencies("pooled connection", time_calls(beacon.lookupAllele, arg_list))
+
+
+def lookup_per_table(beacon, chrom, pos, allele, reference):
+    " the all-datasets lookup as it was before the single statement: one SELECT per table "
+    cat = beacon.getCatalogue(reference)
+    conn = beacon.dbPool.get(reference, cat.fileId)
+    for table_name in cat.tables:
+        cur = conn.cursor()
+        if table_name in beacon.NoAltDataSets:
+            cur.execute("SELECT * from %s WHERE chrom=? AND pos=?" % table_name, (chrom, pos))
+        else:
+            cur.execute("SELECT * from %s WHERE chrom=? AND pos=? AND allele=?" % table_name, (chrom, pos, allele))
+        if cur.fetchone() is not None:
+            return True
+    return False
+
+
+def bench_datasets(beacon, args):
+    misses = random_rows(args.num, chrom="2")  # all datasets are on chrom 1
+    for size in args.sizes:
+        with TempDbDir(beacon):
+            make_db(beacon, "benchRef", dict(("ds%d" % i, random_rows(args.rows)) for i in range(size)))
+            arg_list = [(chrom, pos, allele, "benchRef") for chrom, pos, allele in misses]
+            print_latencies("%d datasets, per table" % size,
+                            time_calls(lambda *a: lookup_per_table(beacon, *a), arg_list))
+            print_latencies("%d datasets, one statement" % size,
+                            time_calls(lambda *a: beacon.lookupAllele(*(a + (None,))), arg_list))
+
+
+def bench_bloom(beacon, args):
+    with TempDbDir(beacon):
+        tables = dict(("ds%d" % i, list(set(random_rows(args.rows)))) for i in range(args.datasets))
+        make_db(beacon, "benchRef", tables)
+        all_rows = [row for rows in tables.values() for row in rows]
+        hits = [(chrom, pos, allele, "benchRef", None) for chrom, pos, allele in random.sample(all_rows, args.num)]
+        misses = [(chrom, pos, allele, "benchRef", None) for chrom, pos, allele in random_rows(args.num, chrom="2")]
+
+        print_latencies("hits, sqlite only", time_calls(beacon.lookupAllele, hits))
+        print_latencies("misses, sqlite only", time_calls(beacon.lookupAllele, misses))
+
+        for table_name, rows in tables.items():
+            beacon.BloomFilter.build(rows, args.fp_rate, False).write(beacon.bloomFileName("benchRef", table_name))
+        beacon.catalogues.clear()
+        print_latencies("hits, Bloom filters", time_calls(beacon.lookupAllele, hits))
+        print_latencies("misses, Bloom filters", time_calls(beacon.lookupAllele, misses))
+
+
+def bench_engine(beacon, args):
+    with TempDbDir(beacon):
+        tables = dict(("ds%d" % i, list(set(random_rows(args.rows)))) for i in range(args.datasets))
+        make_db(beacon, "benchRef", tables)
+        all_rows = [row for rows in tables.values() for row in rows]
+        variants = random.sample(all_rows, args.num // 2) + random_rows(args.num // 2)
+        random.shuffle(variants)
+        singles = [(chrom, pos, allele, "benchRef", None) for chrom, pos, allele in variants]
+        batches = [([(chrom, pos, allele, None) for chrom, pos, allele in variants[i:i + args.batch_size]], "benchRef")
+                   for i in range(0, len(variants), args.batch_size)]
+
+        beacon.serverMode = True
+        for engine in ["sqlite", "memory"]:
+            beacon.parseHgConf()["beacon-engine"] = engine
+            beacon.catalogues.clear()
+            beacon.getCatalogue("benchRef")
+            print_latencies("%s, single lookups" % engine, time_calls(beacon.lookupAllele, singles))
+            print_latencies("%s, batches of %d" % (engine, args.batch_size), time_calls(beacon.lookupAlleleBatch, batches))
+        print("memory engine: %d bytes" % beacon.engineInfo()["memoryUsed"])
+
+        # column store files have precedence over the tables
+        beacon.parseHgConf()["beacon-engine"] = "sqlite"
+        for table_name, rows in tables.items():
+            beacon.ColumnStore.write(beacon.columnFileName("benchRef", table_name), sorted(rows), False)
+        beacon.catalogues.clear()
+        print_latencies("columnar, single lookups", time_calls(beacon.lookupAllele, singles))
+        print_latencies("columnar, batches of %d" % args.batch_size, time_calls(beacon.lookupAlleleBatch, batches))
+
+
+def count_per_request(beacon, cat, dataset_name):
+    " the /info dataset size as it was before beacon_meta: one COUNT(*) per request "
+    conn = beacon.dbPool.get(cat.refDb, cat.fileId)
+    return {"itemCount": conn.execute("SELECT COUNT(*) FROM %s" % dataset_name).fetchone()[0]}
+
+
+def bench_info(beacon, args):
+    with TempDbDir(beacon):
+        make_db(beacon, "benchRef", dict(("ds%d" % i, random_rows(args.rows)) for i in range(args.datasets)))
+        beacon.parseHgConf()["beacon-refs"] = "benchRef"
+        arg_list = [()] * args.num
+
+        get_meta = beacon.getDataSetMeta
+        beacon.getDataSetMeta = lambda cat, dataset_name: count_per_request(beacon, cat, dataset_name)
+        print_latencies("COUNT(*) per request", time_calls(beacon.beaconInfo, arg_list))
+
+        beacon.getDataSetMeta = get_meta
+        start = time.time()
+        beacon.beaconInfo()
+        print("computing the missing metadata: %.3f secs" % (time.time() - start))
+        print_latencies("beacon_meta", time_calls(beacon.beaconInfo, arg_list))
+
+
+def bench_cache(beacon, args):
+    with TempDbDir(beacon):
+        tables = dict(("ds%d" % i, list(set(random_rows(args.rows)))) for i in range(args.datasets))
+        make_db(beacon, "benchRef", tables)
+        all_rows = [row for rows in tables.values() for row in rows]
+        hot = random.sample(all_rows, args.hot // 2) + random_rows(args.hot // 2)
+        variants = [random.choice(hot) if random.random() < 0.9 else random.choice(all_rows) for i in range(args.num)]
+        arg_list = [(chrom, pos, allele, "benchRef", None) for chrom, pos, allele in variants]
+
+        beacon.lookupCache = None
+        print_latencies("no cache", time_calls(beacon.lookupAllele, arg_list))
+        beacon.lookupCache = beacon.LookupCache(args.entries)
+        print_latencies("LRU cache", time_calls(beacon.lookupAllele, arg_list))
+        print("cache: %(hits)d hits, %(misses)d misses, %(entries)d entries" % beacon.lookupCache.stats())
+
+
+def time_concurrent(func, arg_list, clients):
+    " call func once per argument tuple from several threads, return the sorted latencies and requests/sec "
+    latencies = []
+    lock = threading.Lock()
+    chunks = [arg_list[i::clients] for i in range(clients)]
+
+    def client(chunk):
+        chunk_latencies = time_calls(func, chunk)
+        with lock:
+            latencies.extend(chunk_latencies)
+
+    start = time.time()
+    threads = [threading.Thread(target=client, args=(chunk,)) for chunk in chunks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    req_per_sec = len(arg_list) / (time.time() - start)
+    latencies.sort()
+    return latencies, req_per_sec
+
+
+def cgi_request(query_string, page="query"):
+    " run the query script as a CGI, the way Apache does it "
+    env = dict(os.environ, REQUEST_METHOD="GET", REQUEST_URI="/%s?%s" % (page, query_string),
+               QUERY_STRING=query_string, REMOTE_ADDR="127.0.0.1")
+    proc = subprocess.Popen([sys.executable, "query"], env=env, stdout=subprocess.PIPE)
+    proc.communicate()
+
+
+class WsgiClient(object):
+    " one keep-alive HTTP connection per client thread "
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, query_string):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = httplib.HTTPConnection("127.0.0.1", self.port)
+        conn.request("GET", "/query?" + query_string)
+        conn.getresponse().read()
+
+
+def bench_wsgi(beacon, args):
+    from cherrypy import wsgiserver
+
+    queries = make_queries(beacon, args.reference, args.dataset, args.num)
+    arg_list = [("chromosome=%s&position=%d&alternateBases=%s&reference=%s" % (chrom, pos, allele, args.reference),)
+                for chrom, pos, allele in queries]
+
+    latencies, req_per_sec = time_concurrent(cgi_request, arg_list, args.clients)
+    print_latencies("CGI", latencies)
+    print("CGI: %.1f requests/sec" % req_per_sec)
+
+    server = wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), beacon.application, numthreads=args.clients)
+    server_thread = threading.Thread(target=server.start)
+    server_thread.daemon = True
+    server_thread.start()
+    while not server.ready:
+        time.sleep(0.01)
+    client = WsgiClient(server.socket.getsockname()[1])
+    latencies, req_per_sec = time_concurrent(client.request, arg_list, args.clients)
+    server.stop()
+    print_latencies("WSGI", latencies)
+    print("WSGI: %.1f requests/sec" % req_per_sec)
+
+
+def bench_startup(beacon, args):
+    # the module has to be compiled once, as in the docker image
+    subprocess.check_call([sys.executable, "-m", "compileall", "-q", "beacon.py"])
+    import_only = [sys.executable, "-c", "import sys; sys.path.insert(0, '.'); import beacon"]
+    print_latencies("python, no import", time_calls(lambda: subprocess.check_call([sys.executable, "-c", "pass"]),
+                                                    [()] * args.num))
+    print_latencies("import beacon", time_calls(lambda: subprocess.check_call(import_only), [()] * args.num))
+    print_latencies("CGI query", time_calls(cgi_request, [("chromosome=1&position=10150&alternateBases=A",)] * args.num))
+
+
+class BottleneckHandler(SocketServer.BaseRequestHandler):
+    """ answers 150 msecs per query of an IP or the delay in server.delays, closes the connection after one answer
+    like the UCSC bottleneck, if server.persistent is False """
+    def handle(self):
+        counts = self.server.counts
+        while True:
+            msg_len = self.request.recv(1)
+            if not msg_len:
+                return
+            ip = self.request.recv(ord(msg_len))
+            counts[ip] = counts.get(ip, 0) + 1
+            delay = str(self.server.delays.get(ip, counts[ip] * 150))
+            self.request.sendall(chr(len(delay)) + delay)
+            if not self.server.persistent:
+                return
+
+
+def start_bottleneck(persistent, delays={}):
+    " start a bottleneck server in a thread, return it "
+    SocketServer.ThreadingTCPServer.allow_reuse_address = True
+    server = SocketServer.ThreadingTCPServer(("127.0.0.1", 0), BottleneckHandler)
+    server.daemon_threads = True
+    server.persistent = persistent
+    server.counts = {}
+    server.delays = delays
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def bench_bottleneck(beacon, args):
+    ips = ["10.0.%d.%d" % (i // 256, i % 256) for i in range(args.ips)]
+    arg_list = [(random.choice(ips),) for i in range(args.num)]
+
+    server = start_bottleneck(False)
+    port = server.server_address[1]
+    print_latencies("connection per request", time_calls(lambda ip: beacon.queryBottleneck("127.0.0.1", port, ip), arg_list))
+    client = beacon.BottleneckClient("127.0.0.1", port, 0.2, 0, 0)
+    print_latencies("pooled, UCSC-style server", time_calls(client.getDelay, arg_list))
+    server.shutdown()
+
+    server = start_bottleneck(True)
+    port = server.server_address[1]
+    client = beacon.BottleneckClient("127.0.0.1", port, 0.2, 0, 0)
+    print_latencies("pooled, persistent server", time_calls(client.getDelay, arg_list))
+    client = beacon.BottleneckClient("127.0.0.1", port, 0.2, 1.0, 0)
+    print_latencies("pooled, 1 sec cache", time_calls(client.getDelay, arg_list))
+    server.shutdown()
+
+    # nothing listens on the port any more
+    client = beacon.BottleneckClient("127.0.0.1", port, 0.2, 0, 0)
+    print_latencies("pooled, server down", time_calls(client.getDelay, arg_list))
+
+
+def free_port():
+    " return a tcp port that nobody listens on "
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def daemon_client(job):
+    " one client process of the daemon load test: round-robin over its connections, returns the number of answers "
+    port, num, connections, ips, pipeline, seed = job
+    beacon = load_beacon()
+    random.seed(seed)
+    socks = [socket.create_connection(("127.0.0.1", port)) for i in range(connections)]
+    answers = 0
+    for i in range(num // pipeline):
+        sock = socks[i % connections]
+        batch = ["10.%d.%d.%d" % (ip >> 16, (ip >> 8) & 255, ip & 255) for ip in
+                 (random.randrange(ips) for j in range(pipeline))]
+        answers += len(beacon.bottleneckExchange(sock, batch))
+    for sock in socks:
+        sock.close()
+    return answers
+
+
+def bench_daemon(beacon, args):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "utils/bottleneck.py", "start", "-foreground", "-port=%d" % port])
+    try:
+        while True:
+            try:
+                beacon.queryBottleneck("127.0.0.1", port, "127.0.0.1", 1.0)
+                break
+            except EnvironmentError:
+                time.sleep(0.05)
+
+        arg_list = [(random.choice(["10.0.0.%d" % i for i in range(256)]),) for i in range(2000)]
+        print_latencies("connection per query", time_calls(lambda ip: beacon.queryBottleneck("127.0.0.1", port, ip), arg_list))
+        client = beacon.BottleneckClient("127.0.0.1", port, 1.0, 0, 0)
+        print_latencies("pooled client", time_calls(client.getDelay, arg_list))
+
+        jobs = [(port, args.num // args.jobs, args.connections // args.jobs, args.ips, args.pipeline, i)
+                for i in range(args.jobs)]
+        pool = multiprocessing.Pool(args.jobs)
+        start = time.time()
+        answers = sum(pool.map(daemon_client, jobs))
+        secs = time.time() - start
+        pool.close()
+        print("%d queries from %d IPs on %d connections, %d at once: %.0f queries/sec"
+              % (answers, args.ips, args.connections, args.pipeline, answers / secs))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_throttle(beacon, args):
+    from cherrypy import wsgiserver
+
+    # 127.0.0.2 is the address of the throttled clients
+    bottleneck = start_bottleneck(True, {"127.0.0.1": 0, "127.0.0.2": args.delay})
+    beacon.parseHgConf().update({"bottleneck.host": "127.0.0.1", "bottleneck.port": str(bottleneck.server_address[1])})
+    beacon.BotSleepDelay = 0
+    beacon.initServer()
+    beacon.wsgiReady = True
+    query = "/query?chromosome=1&position=10150&alternateBases=A"
+
+    def robot(port, stop):
+        # a new connection for every request, as with the normal client below: a keep-alive connection
+        # keeps its worker thread of cherrypy while it is open
+        while not stop.is_set():
+            conn = httplib.HTTPConnection("127.0.0.1", port, source_address=("127.0.0.2", 0))
+            conn.request("GET", query)
+            conn.getresponse().read()
+            conn.close()
+
+    for name, server in [("sleeping threads", wsgiserver.CherryPyWSGIServer(("127.0.0.1", 0), beacon.application,
+                                                                            numthreads=args.threads, request_queue_size=128)),
+                         ("delayed responses", beacon.makeWsgiServer(0, numthreads=args.threads))]:
+        server_thread = threading.Thread(target=server.start)
+        server_thread.daemon = True
+        server_thread.start()
+        while not server.ready:
+            time.sleep(0.01)
+        port = server.socket.getsockname()[1]
+        stop = threading.Event()
+        robots = [threading.Thread(target=robot, args=(port, stop)) for i in range(args.robots)]
+        for thread in robots:
+            thread.daemon = True
+            thread.start()
+        time.sleep(0.5)
+
+        latencies = []
+        start = time.time()
+        while time.time() - start < args.time:
+            req_start = time.time()
+            conn = httplib.HTTPConnection("127.0.0.1", port)
+            conn.request("GET", query)
+            conn.getresponse().read()
+            conn.close()
+            latencies.append(time.time() - req_start)
+        req_per_sec = len(latencies) / (time.time() - start)
+        stop.set()
+        # the robots wait for their last delayed answer, the sleeping server can only stop its threads after that
+        for thread in robots:
+            thread.join()
+        server.stop()
+        latencies.sort()
+        print_latencies(name, latencies)
+        print("%s: %.1f requests/sec of the normal client with %d throttled clients" % (name, req_per_sec, args.robots))
+    bottleneck.shutdown()
+
+
+def budget_client(job):
+    " one process of the budget benchmark, returns the sorted latencies of its queries "
+    file_name, num, ips, seed = job
+    beacon = load_beacon()
+    random.seed(seed)
+    budget = beacon.QueryBudget(file_name, 1000000, 1000000)
+    arg_list = [("10.%d.%d.%d" % (ip >> 16, (ip >> 8) & 255, ip & 255), 1)
+                for ip in (random.randrange(ips) for i in range(num))]
+    return time_calls(budget.charge, arg_list)
+
+
+def bench_budget(beacon, args):
+    tmp_dir = tempfile.mkdtemp()
+    file_name = os.path.join(tmp_dir, "limits")
+    try:
+        print_latencies("1 process", budget_client((file_name, args.num, args.ips, 0)))
+        arg_list = [("10.0.0.%d" % random.randrange(256),)] * (args.num // 100)
+        print_latencies("mapped per query, as a CGI",
+                        time_calls(lambda ip: beacon.QueryBudget(file_name, 1000000, 1000000).charge(ip, 1), arg_list))
+
+        pool = multiprocessing.Pool(args.jobs)
+        jobs = [(file_name, args.num // args.jobs, args.ips, i + 1) for i in range(args.jobs)]
+        latencies = sorted(sum(pool.map(budget_client, jobs), []))
+        pool.close()
+        print_latencies("%d processes at once" % args.jobs, latencies)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def gen_vcf_rows(num):
+    " yield num random (chrom, pos, allele) tuples with the chromosomes and variant types of utils/gen_vcf.py "
+    sys.path.insert(0, os.path.join(os.getcwd(), "utils"))
+    import gen_vcf
+    chroms = [(str(chrom), chrom_max) for chrom, chrom_max in gen_vcf.CHROMS]
+    for i in range(num):
+        chrom, chrom_max = random.choice(chroms)
+        var_type = random.choice(gen_vcf.VAR_TYPES)
+        if var_type == "SNP":
+            yield chrom, random.randint(0, chrom_max - 1), random.choice("ACGT")
+        elif var_type == "INS":
+            yield chrom, random.randint(1, chrom_max), "I" + "".join(random.choice("ACGT") for j in range(random.randint(1, gen_vcf.MAX_INS)))
+        else:
+            yield chrom, random.randint(1, chrom_max), "D%d" % random.randint(1, gen_vcf.MAX_DEL)
+
+
+def bench_schema(beacon, args):
+    with TempDbDir(beacon):
+        # streamed into a version 1 table, the rows of a big dataset do not fit into memory
+        start = time.time()
+        conn = beacon.dbOpen("benchRef")
+        beacon.dbMakeTable(conn, "ds1")
+        conn.execute("CREATE UNIQUE INDEX 'ds1_index' ON 'ds1' ('chrom', 'pos', 'allele')")
+        rows = gen_vcf_rows(args.rows)
+        sample = []
+        while True:
+            chunk = [row for row, i in zip(rows, range(100000))]
+            if len(chunk) == 0:
+                break
+            conn.executemany("INSERT OR IGNORE INTO ds1 VALUES (?,?,?)", chunk)
+            sample.extend(random.sample(chunk, min(len(chunk), args.num // 2 * 100000 // args.rows + 1)))
+        conn.commit()
+        conn.close()
+        print("import of %d variants: %.1f secs" % (args.rows, time.time() - start))
+
+        variants = sample[:args.num // 2] + [(chrom, pos + 1, allele) for chrom, pos, allele in sample[:args.num // 2]]
+        random.shuffle(variants)
+        singles = [(chrom, pos, allele, "benchRef", None) for chrom, pos, allele in variants]
+        batches = [([(chrom, pos, allele, None) for chrom, pos, allele in variants[i:i + args.batch_size]], "benchRef")
+                   for i in range(0, len(variants), args.batch_size)]
+        db_name = beacon.dbFileName("benchRef")
+        for schema in ["version 1", "packed"]:
+            if schema == "packed":
+                beacon.dbPool.closeAll()
+                beacon.catalogues.clear()
+                beacon.migrateDb("benchRef")
+            print("%s: %.1f MB" % (schema, os.path.getsize(db_name) / 1e6))
+            print_latencies("%s, single lookups" % schema, time_calls(beacon.lookupAllele, singles))
+            print_latencies("%s, batches of %d" % (schema, args.batch_size), time_calls(beacon.lookupAlleleBatch, batches))
+
+
+def write_vcf(file_name, rows):
+    " write (chrom, pos, allele) rows as a VCF file, with the lines of utils/gen_vcf.py "
+    with open(file_name, "w") as ofh:
+        ofh.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tDUMMY\n")
+        for chrom, pos, allele in rows:
+            if allele.startswith("I"):
+                ref, alt, pos = "A", "A" + allele[1:], pos - 1
+            elif allele.startswith("D"):
+                ref, alt, pos = "A" * (int(allele[1:]) + 1), "A", pos - 1
+            else:
+                ref, alt = "N", allele
+            ofh.write("%s\t%d\t.\t%s\t%s\t100.00\tPASS\tAN_OUSWES=2\tGT\t./.\n" % (chrom, pos + 1, ref, alt))
+
+
+def import_client(file_name, import_memory, schema, jobs=1, format="vcf"):
+    """ one import of a file or a directory, run in a new process, so its peak memory is its own.
+    Prints only the phases and a checksum of the imported rows. """
+    beacon = load_beacon()
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        with TempDbDir(beacon):
+            beacon.importFiles("benchRef", beacon.listInputFiles([file_name]), "ds1", format, schema=schema,
+                               importMemory=import_memory, jobs=jobs)
+            conn = beacon.dbOpen("benchRef")
+            checksum = 0
+            for row in conn.execute(beacon.makeRowsSql("ds1", schema == 2) + " ORDER BY 1, 2, 3"):
+                checksum = zlib.crc32(repr(row), checksum)
+            conn.close()
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    for line in output.splitlines():
+        if "peak memory" in line:
+            print("  " + line)
+    print("  checksum of the rows: %08x" % (checksum & 0xffffffff))
+
+
+def run_import_client(file_name, import_memory, schema, jobs=1, format="vcf"):
+    " run import_client() in a new interpreter, a forked process would share the memory of this one "
+    sys.stdout.flush()
+    subprocess.check_call([sys.executable, "-c", "import sys; sys.path.insert(0, 'utils'); import benchmark; "
+                           "benchmark.import_client(%r, %d, %d, %d, %r)" % (file_name, import_memory, schema, jobs, format)])
+
+
+def bench_import(beacon, args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            file_name = os.path.join(tmp_dir, "bench%d.vcf" % size)
+            write_vcf(file_name, gen_vcf_rows(size))
+            for import_memory in [1000000, args.import_memory]:
+                print("%d variants, %s:" % (size, "all rows in memory" if import_memory == 1000000 else
+                                            "memory budget %d MB" % import_memory))
+                run_import_client(file_name, import_memory, args.schema)
+            os.remove(file_name)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_jobs(beacon, args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(tmp_dir, "bench.vcf")
+        write_vcf(file_name, gen_vcf_rows(args.rows))
+        for jobs in args.jobs:
+            print("%d variants, %d parsing processes, %d cpus:" % (args.rows, jobs, multiprocessing.cpu_count()))
+            run_import_client(file_name, beacon.ImportMemory, args.schema, jobs)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def write_bgzf(file_name, in_file_name, block_size=65280):
+    " compress a file like bgzip: gzip members of at most block_size bytes with the block size in a header field "
+    with open(in_file_name, "rb") as ifh, open(file_name, "wb") as ofh:
+        while True:
+            chunk = ifh.read(block_size)
+            comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = comp.compress(chunk) + comp.flush()
+            ofh.write(struct.pack("<4sIBBHBBHH", "\x1f\x8b\x08\x04", 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25))
+            ofh.write(deflated)
+            ofh.write(struct.pack("<II", zlib.crc32(chunk) & 0xffffffff, len(chunk)))
+            if len(chunk) == 0:  # the empty block marks the end of the file
+                break
+
+
+def time_lines(name, lines, size):
+    " iterate over lines and print the MB/sec of the uncompressed size "
+    start = time.time()
+    for line in lines:
+        pass
+    secs = time.time() - start
+    print("{:<32} {:6.2f} secs  {:6.1f} MB/sec".format(name, secs, size / secs / 1e6))
+
+
+def bench_gunzip(beacon, args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(tmp_dir, "bench.vcf")
+        write_vcf(file_name, gen_vcf_rows(args.rows))
+        size = os.path.getsize(file_name)
+        with open(file_name + ".gz", "wb") as ofh:
+            subprocess.check_call(["gzip", "-c", file_name], stdout=ofh)
+        write_bgzf(file_name + ".bgz", file_name)
+        print("%d variants, %.1f MB, %d cpus" % (args.rows, size / 1e6, multiprocessing.cpu_count()))
+
+        time_lines("plain text", beacon.readLines(file_name), size)
+        import gzip
+        with gzip.open(file_name + ".gz") as ifh:
+            time_lines("gzip, Python's gzip module", ifh, size)
+        time_lines("gzip, readLines()", beacon.readLines(file_name + ".gz"), size)
+        with gzip.open(file_name + ".bgz") as ifh:
+            time_lines("BGZF, Python's gzip module", ifh, size)
+        for threads in args.threads:
+            time_lines("BGZF, readLines(), %d threads" % threads, beacon.readLines(file_name + ".bgz", threads), size)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def swap_client(db_dir, file_name, schema):
+    " one import into the DB of db_dir, run in a new process while the benchmark queries the DB "
+    beacon = load_beacon()
+    beacon.dbFileName = lambda refDb: os.path.join(db_dir, "beaconData.%s.sqlite" % refDb)
+    sys.stdout = StringIO.StringIO()
+    beacon.importFiles("benchRef", [file_name], "ds1", "vcf", schema=schema)
+
+
+def query_loop(beacon, variants, stop):
+    " look up the (chrom, pos, allele, expected) variants in a loop until stop is set, return latencies, errors and wrong answers "
+    latencies = []
+    errors = 0
+    wrong = 0
+    while not stop.is_set():
+        for chrom, pos, allele, expected in variants:
+            start = time.time()
+            try:
+                found = beacon.lookupAllele(chrom, pos, allele, "benchRef", "ds1")
+            except Exception:
+                errors += 1
+            else:
+                wrong += found != expected
+            latencies.append(time.time() - start)
+            if stop.is_set():
+                break
+    latencies.sort()
+    return latencies, errors, wrong
+
+
+def bench_swap(beacon, args):
+    with TempDbDir(beacon) as db_dir:
+        file_name = os.path.join(db_dir, "bench.vcf")
+        rows = list(gen_vcf_rows(args.rows))
+        write_vcf(file_name, rows)
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            beacon.importFiles("benchRef", [file_name], "ds1", "vcf", schema=args.schema)
+        finally:
+            sys.stdout = stdout
+        sample = random.sample(rows, 1000)
+        variants = [(chrom, pos, allele, True) for chrom, pos, allele in sample] + \
+                   [(chrom, pos + 1000000000, allele, False) for chrom, pos, allele in sample]
+        random.shuffle(variants)
+        print("%d variants, schema %d, %d cpus" % (args.rows, args.schema, multiprocessing.cpu_count()))
+
+        for phase in ["no import", "during the import"]:
+            stop = threading.Event()
+            if phase == "no import":
+                threading.Timer(5, stop.set).start()
+            else:
+                proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.path.insert(0, 'utils'); import benchmark; "
+                                         "benchmark.swap_client(%r, %r, %d)" % (db_dir, file_name, args.schema)])
+                threading.Thread(target=lambda: (proc.wait(), stop.set())).start()
+            start = time.time()
+            latencies, errors, wrong = query_loop(beacon, variants, stop)
+            print_latencies("%s, %.0f secs" % (phase, time.time() - start), latencies)
+            print("{:<28} max={:8.1f}us  errors={}  wrong answers={}".format("", latencies[-1] * 1e6, errors, wrong))
+
+
+def bench_backup(beacon, args):
+    with TempDbDir(beacon) as db_dir:
+        stdout = sys.stdout
+        for dataset, size in [("big", args.rows)] + [("small%d" % size, size) for size in args.sizes]:
+            file_name = os.path.join(db_dir, "bench.vcf")
+            write_vcf(file_name, gen_vcf_rows(size))
+            sys.stdout = StringIO.StringIO()
+            try:
+                beacon.importFiles("benchRef", [file_name], dataset, "vcf")
+            finally:
+                sys.stdout = stdout
+            os.remove(file_name)
+        db_name = beacon.dbFileName("benchRef")
+        print("DB with %d variants in the big dataset: %.1f MB" % (args.rows, os.path.getsize(db_name) / 1e6))
+
+        start = time.time()
+        shutil.copyfile(db_name, db_name + ".copy")
+        print("{:<36} {:8.2f} secs".format("copy of the DB file", time.time() - start))
+        os.remove(db_name + ".copy")
+        for size in args.sizes:
+            sys.stdout = StringIO.StringIO()
+            try:
+                start = time.time()
+                backup_name = beacon.backupDataSet("benchRef", "small%d" % size)
+                backup_secs = time.time() - start
+                start = time.time()
+                beacon.restoreDataSet(backup_name)
+                restore_secs = time.time() - start
+            finally:
+                sys.stdout = stdout
+            print("{:<36} {:8.2f} secs, {:.1f} MB, restore {:.2f} secs".format(
+                "backup of %d variants" % size, backup_secs, os.path.getsize(backup_name) / 1e6, restore_secs))
+
+
+def quiet_call(func, *args, **kwargs):
+    " call func without its progress messages, return the seconds it took "
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        start = time.time()
+        func(*args, **kwargs)
+        return time.time() - start
+    finally:
+        sys.stdout = stdout
+
+
+def bench_merge(beacon, args):
+    with TempDbDir(beacon) as db_dir:
+        base_name = os.path.join(db_dir, "base.vcf")
+        write_vcf(base_name, gen_vcf_rows(args.rows))
+        print("dataset of %d variants, schema %d" % (args.rows, args.schema))
+        for size in args.sizes:
+            delta_name = os.path.join(db_dir, "delta%d.vcf" % size)
+            write_vcf(delta_name, gen_vcf_rows(size))
+            quiet_call(beacon.importFiles, "benchRef", [base_name], "ds1", "vcf", schema=args.schema)
+            import_secs = quiet_call(beacon.importFiles, "benchRef", [base_name, delta_name], "ds1", "vcf", schema=args.schema)
+            quiet_call(beacon.importFiles, "benchRef", [base_name], "ds1", "vcf", schema=args.schema)
+            merge_secs = quiet_call(beacon.mergeFiles, "benchRef", [delta_name], "ds1", "vcf")
+            remove_secs = quiet_call(beacon.mergeFiles, "benchRef", [], "ds1", "vcf", removeNames=[delta_name])
+            print("{:>8} variants: import of all files {:7.2f} secs, merge {:6.2f} secs, remove {:6.2f} secs".format(
+                size, import_secs, merge_secs, remove_secs))
+            os.remove(delta_name)
+
+
+def bench_fingerprint(beacon, args):
+    with TempDbDir(beacon) as db_dir:
+        for size in args.sizes:
+            vcf_name = os.path.join(db_dir, "test.vcf")
+            write_vcf(vcf_name, gen_vcf_rows(size))
+            import_secs = quiet_call(beacon.importFiles, "benchRef", [vcf_name], "ds1", "vcf")
+            skip_secs = quiet_call(beacon.importFiles, "benchRef", [vcf_name], "ds1", "vcf")
+            # a new modification time with the same size makes the check read the file
+            os.utime(vcf_name, None)
+            hash_secs = quiet_call(beacon.importFiles, "benchRef", [vcf_name], "ds1", "vcf")
+            force_secs = quiet_call(beacon.importFiles, "benchRef", [vcf_name], "ds1", "vcf", force=True)
+            print("{:>8} variants: import {:7.2f} secs, unchanged {:8.4f} secs, touched {:6.2f} secs, "
+                  "forced {:7.2f} secs".format(size, import_secs, skip_secs, hash_secs, force_secs))
+            os.remove(vcf_name)
+
+
+def write_bed(file_name, rows):
+    " write (chrom, pos, allele) rows as a bed file with one allele per 1-bp feature "
+    with open(file_name, "w") as ofh:
+        for chrom, pos, allele in rows:
+            ofh.write("chr%s\t%d\t%d\t%s\n" % (chrom, pos, pos + 1, allele))
+
+
+def bench_formats(beacon, args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            dir_name = os.path.join(tmp_dir, "inputs")
+            os.mkdir(dir_name)
+            bed_name = os.path.join(dir_name, "bench.bed")
+            write_bed(bed_name, gen_vcf_rows(size // 2))
+            print("%d variants in a bed file, format bed:" % (size // 2))
+            run_import_client(bed_name, args.import_memory, 2, format="bed")
+            print("%d variants in a bed file, format auto:" % (size // 2))
+            run_import_client(bed_name, args.import_memory, 2, format="auto")
+            write_vcf(os.path.join(dir_name, "bench.vcf"), gen_vcf_rows(size - size // 2))
+            print("%d variants in a directory with a bed and a VCF file, format auto:" % size)
+            run_import_client(dir_name, args.import_memory, 2, format="auto")
+            shutil.rmtree(dir_name)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
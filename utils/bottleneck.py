@@ -0,0 +1,343 @@
+#!/usr/bin/env python2
+from __future__ import print_function, division
+
+# A drop-in replacement for the UCSC bottleneck server in utils/bottleneck, which slows down
+# hyperactive web robots. It speaks the same protocol: a client sends an IP address as a string
+# prefixed by its length as one byte and gets back the delay in milliseconds, also as a
+# length-prefixed string. Commands start with "?": "?list" and "?set ip milliseconds".
+#
+# Every query adds the penalty to the delay of an IP, every second without a query subtracts
+# the recovery. Unlike the UCSC server, a connection can send many queries and is only closed
+# by the client. One thread serves all connections with epoll, or select() where there is none.
+#
+#   utils/bottleneck.py start [-host=localhost] [-port=17776] [-penalty=150] [-recovery=10] [-state=FILE] [-foreground]
+#   utils/bottleneck.py query ip-address [count]
+#   utils/bottleneck.py list
+#   utils/bottleneck.py set ip-address milliseconds
+
+import argparse
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import time
+
+DEF_PORT = 17776
+DEF_PENALTY = 150
+DEF_RECOVERY = 10
+DEF_SAVE_INTERVAL = 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A server that helps slow down hyperactive web robots")
+    parser.add_argument('command', choices=["start", "query", "list", "set"], help="start the server or ask it")
+    parser.add_argument('args', nargs='*', help="query: ip-address [count], set: ip-address milliseconds")
+    parser.add_argument('-host', '--host', default="localhost", help="host of the server for query, list and set, start listens on it. Use 0.0.0.0 to accept connections "
+                        "from other hosts. Default: %(default)s")
+    parser.add_argument('-port', '--port', type=int, default=DEF_PORT, help="tcp port. Default: %(default)s")
+    parser.add_argument('-penalty', '--penalty', type=int, default=DEF_PENALTY,
+                        help="milliseconds added to the delay for each query. Default: %(default)s")
+    parser.add_argument('-recovery', '--recovery', type=int, default=DEF_RECOVERY,
+                        help="milliseconds subtracted from the delay for each second without a query. Default: %(default)s")
+    parser.add_argument('-state', '--state', help="keep the delays in this file, so a restart does not reset them")
+    parser.add_argument('-save-interval', '--save-interval', type=int, default=DEF_SAVE_INTERVAL,
+                        help="seconds between two writes of the state file. Default: %(default)s")
+    parser.add_argument('-foreground', '--foreground', action='store_true', help="do not detach from the terminal")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        server = BottleneckServer(args.port, args.penalty, args.recovery, args.state, args.save_interval, args.host)
+        if not args.foreground:
+            daemonize()
+        server.run()
+    elif args.command == "query":
+        if len(args.args) not in (1, 2):
+            parser.error("query needs an ip-address and optionally a count")
+        count = int(args.args[1]) if len(args.args) == 2 else 1
+        for delay in send_messages(args.host, args.port, [args.args[0]] * count):
+            print("%s millisecond delay recommended" % delay)
+    elif args.command == "list":
+        for line in send_messages(args.host, args.port, ["?list"], until_empty=True):
+            print(line)
+    elif args.command == "set":
+        if len(args.args) != 2:
+            parser.error("set needs an ip-address and milliseconds")
+        send_messages(args.host, args.port, ["?set %s %d" % (args.args[0], int(args.args[1]))])
+
+
+###
+
+
+def encode_message(msg):
+    " prefix a message with its length as one byte "
+    msg = msg.encode("ascii")[:255]
+    return bytes(bytearray([len(msg)])) + msg
+
+
+def decode_messages(buf):
+    " remove all complete messages from the bytearray buf and return them as strings "
+    msgs = []
+    while len(buf) != 0 and len(buf) > buf[0]:
+        msg_len = buf[0]
+        msgs.append(bytes(buf[1:1 + msg_len]).decode("ascii", "replace"))
+        del buf[:1 + msg_len]
+    return msgs
+
+
+def send_messages(host, port, msgs, until_empty=False):
+    """ send messages on one connection, return the answers. With until_empty, read answers
+    until the server sends an empty one, as for ?list """
+    sock = socket.create_connection((host, port), 10)
+    sock.sendall(b"".join(encode_message(msg) for msg in msgs))
+    buf = bytearray()
+    answers = []
+    while until_empty or len(answers) < len(msgs):
+        data = sock.recv(4096)
+        if not data:
+            break
+        buf.extend(data)
+        answers.extend(decode_messages(buf))
+        if until_empty and "" in answers:
+            answers = answers[:answers.index("")]
+            break
+    sock.close()
+    return answers
+
+
+def daemonize():
+    " detach from the terminal like the UCSC bottleneck "
+    if os.fork() != 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() != 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+
+class Tracker(object):
+    " the delay accounting of one IP "
+    __slots__ = ("delay", "last_access", "count")
+
+    def __init__(self, delay=0.0, last_access=0.0, count=0):
+        self.delay = delay
+        self.last_access = last_access
+        self.count = count
+
+    def current_delay(self, now, recovery):
+        " the delay in milliseconds after the recovery since the last access "
+        return max(0.0, self.delay - max(0.0, now - self.last_access) * recovery)
+
+
+class BottleneckServer(object):
+    " single-threaded bottleneck server, all sockets are non-blocking "
+    def __init__(self, port, penalty, recovery, state_file=None, save_interval=DEF_SAVE_INTERVAL, host="localhost"):
+        self.penalty = penalty
+        self.recovery = recovery
+        self.state_file = state_file
+        self.save_interval = save_interval
+        self.trackers = {}  # ip -> Tracker
+        self.conns = {}  # fd -> [socket, input bytearray, output bytearray]
+        self.running = True
+        self.queries = 0
+        if state_file is not None and os.path.isfile(state_file):
+            self.load_state()
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1024)
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+
+    def query(self, ip, now):
+        " account for one query of ip, return its delay in milliseconds "
+        tracker = self.trackers.get(ip)
+        if tracker is None:
+            tracker = self.trackers[ip] = Tracker()
+        tracker.delay = tracker.current_delay(now, self.recovery) + self.penalty
+        tracker.last_access = now
+        tracker.count += 1
+        self.queries += 1
+        return int(tracker.delay)
+
+    def answer(self, msg, now):
+        " return the list of answers to one message "
+        if not msg.startswith("?"):
+            return [str(self.query(msg, now))]
+        fields = msg.split()
+        if fields[0] == "?list":
+            lines = ["#IP_ADDRESS                hits  milliDelay"]
+            for ip, tracker in sorted(self.trackers.items()):
+                lines.append("%-24s %8d %10d" % (ip, tracker.count, tracker.current_delay(now, self.recovery)))
+            return lines + [""]
+        if fields[0] == "?set" and len(fields) == 3:
+            try:
+                delay = float(fields[2])
+                int(delay)  # nan and inf
+            except (ValueError, OverflowError):
+                return ["invalid delay %s" % fields[2]]
+            tracker = self.trackers.setdefault(fields[1], Tracker())
+            tracker.delay = delay
+            tracker.last_access = now
+            return [str(int(tracker.delay))]
+        return ["unknown command %s" % fields[0]]
+
+    def purge(self, now):
+        " forget the IPs whose delay has recovered to 0, they are the same as new ones "
+        self.trackers = dict((ip, tracker) for ip, tracker in self.trackers.items()
+                             if tracker.current_delay(now, self.recovery) > 0)
+
+    def load_state(self):
+        with open(self.state_file) as ifh:
+            state = json.load(ifh)
+        for ip, (delay, last_access, count) in state["trackers"].items():
+            self.trackers[str(ip)] = Tracker(delay, last_access, count)
+
+    def save_state(self):
+        " write the delays to a temporary file and rename it to the state file "
+        self.purge(time.time())
+        state = {"trackers": dict((ip, [t.delay, t.last_access, t.count]) for ip, t in self.trackers.items())}
+        tmp_name = self.state_file + ".tmp"
+        with open(tmp_name, "w") as ofh:
+            json.dump(state, ofh)
+        os.rename(tmp_name, self.state_file)
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        " serve until SIGTERM or SIGINT, then save the state "
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        poller = EpollPoller() if hasattr(select, "epoll") else SelectPoller()
+        poller.register(self.listener.fileno(), False)
+        last_save = time.time()
+        while self.running:
+            try:
+                events = poller.poll(1.0)
+            except (IOError, OSError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            now = time.time()
+            for fd, readable, writable in events:
+                if fd == self.listener.fileno():
+                    self.accept(poller)
+                    continue
+                conn = self.conns.get(fd)
+                if conn is None:
+                    continue
+                if readable:
+                    self.read(poller, fd, conn, now)
+                if writable and fd in self.conns:
+                    self.write(poller, fd, conn)
+            if now - last_save > self.save_interval:
+                if self.state_file is not None:
+                    self.save_state()
+                else:
+                    self.purge(now)
+                last_save = now
+        if self.state_file is not None:
+            self.save_state()
+
+    def accept(self, poller):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.conns[sock.fileno()] = [sock, bytearray(), bytearray()]
+            poller.register(sock.fileno(), False)
+
+    def read(self, poller, fd, conn, now):
+        sock, inbuf, outbuf = conn
+        try:
+            data = sock.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if not data:
+            self.close(poller, fd)
+            return
+        inbuf.extend(data)
+        for msg in decode_messages(inbuf):
+            for answer in self.answer(msg, now):
+                outbuf.extend(encode_message(answer))
+        if len(outbuf) != 0:
+            self.write(poller, fd, conn)
+
+    def write(self, poller, fd, conn):
+        sock, inbuf, outbuf = conn
+        try:
+            sent = sock.send(outbuf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                sent = 0
+            else:
+                self.close(poller, fd)
+                return
+        del outbuf[:sent]
+        # only wait for writability while there is something left to send
+        poller.modify(fd, len(outbuf) != 0)
+
+    def close(self, poller, fd):
+        poller.unregister(fd)
+        self.conns.pop(fd)[0].close()
+
+
+class EpollPoller(object):
+    " the part of select.epoll that the server needs, events are (fd, readable, writable) "
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.writing = {}
+
+    def register(self, fd, writing):
+        self.epoll.register(fd, select.EPOLLIN | (select.EPOLLOUT if writing else 0))
+        self.writing[fd] = writing
+
+    def modify(self, fd, writing):
+        if self.writing[fd] != writing:
+            self.epoll.modify(fd, select.EPOLLIN | (select.EPOLLOUT if writing else 0))
+            self.writing[fd] = writing
+
+    def unregister(self, fd):
+        self.epoll.unregister(fd)
+        del self.writing[fd]
+
+    def poll(self, timeout):
+        return [(fd, bool(ev & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR)), bool(ev & select.EPOLLOUT))
+                for fd, ev in self.epoll.poll(timeout)]
+
+
+class SelectPoller(object):
+    " the same for select(), which is limited to FD_SETSIZE connections "
+    def __init__(self):
+        self.writing = {}
+
+    def register(self, fd, writing):
+        self.writing[fd] = writing
+
+    def modify(self, fd, writing):
+        self.writing[fd] = writing
+
+    def unregister(self, fd):
+        del self.writing[fd]
+
+    def poll(self, timeout):
+        readable, writable, _ = select.select(list(self.writing), [fd for fd, w in self.writing.items() if w], [], timeout)
+        readable = set(readable)
+        writable = set(writable)
+        return [(fd, fd in readable, fd in writable) for fd in readable | writable]
+
+
+if __name__ == '__main__':
+    main()
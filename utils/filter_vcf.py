@@ -6,6 +6,7 @@ import datetime
 import gzip
 import os.path
 from pybedtools import BedTool
+import subprocess
 import sys
 import vcf
 
@@ -70,40 +71,49 @@ def main():
     if args.verbose:
         print("{}\tBeginning parse of {}".format(now(), input_filename))
 
-    reader = vcf.Reader(filename=input_filename)
+    vcf_file, gunzip = open_vcf(input_filename)
+    reader = vcf.Reader(fsock=vcf_file)
     if not args.dry_run:
         writer = vcf.Writer(gzip.open(output_filename, 'wb'), reader)
-    for var in reader:
-        write_var = True
-        meta["seen"] += 1
-
-        # TODO: use params or config for field names rather than hardcoding
-        if "indications_OUSWES" in var.INFO:
-            inds = sum([int(x.split(":")[1]) for x in var.INFO["indications_OUSWES"]])
-            if inds < args.threshold:
-                write_var = False
-                meta["under_threshold"] += 1
-                if inds == 1:
-                    meta["unique"] += 1
-        else:
-            meta["missing_indications"] += 1
-            inds = -1
-            write_var = False
-
-        if "AF_OUSWES" in var.INFO:
-            if len(var.INFO["AF_OUSWES"]) > 1:
-                meta["af_long"] += 1
-            else:
-                if var.INFO["AF_OUSWES"][0] > args.allele_frequency:
+    stopped = False
+    try:
+        for var in reader:
+            write_var = True
+            meta["seen"] += 1
+
+            # TODO: use params or config for field names rather than hardcoding
+            if "indications_OUSWES" in var.INFO:
+                inds = sum([int(x.split(":")[1]) for x in var.INFO["indications_OUSWES"]])
+                if inds < args.threshold:
                     write_var = False
-                    meta["af_filtered"] += 1
-
-        if write_var and not args.dry_run:
-            writer.write_record(var)
-
-        if args.debug and meta["seen"] >= 100:
-            break
+                    meta["under_threshold"] += 1
+                    if inds == 1:
+                        meta["unique"] += 1
+            else:
+                meta["missing_indications"] += 1
+                inds = -1
+                write_var = False
 
+            if "AF_OUSWES" in var.INFO:
+                if len(var.INFO["AF_OUSWES"]) > 1:
+                    meta["af_long"] += 1
+                else:
+                    if var.INFO["AF_OUSWES"][0] > args.allele_frequency:
+                        write_var = False
+                        meta["af_filtered"] += 1
+
+            if write_var and not args.dry_run:
+                writer.write_record(var)
+
+            if args.debug and meta["seen"] >= 100:
+                stopped = True  # the decompression stops when its output is closed
+                break
+    finally:
+        vcf_file.close()
+        status = gunzip.wait() if gunzip is not None else 0
+    if status != 0 and not stopped:
+        print("Decompression of {} failed".format(input_filename))
+        sys.exit(1)
     if args.bed:
         os.unlink(tmp_fname)
 
@@ -146,5 +156,29 @@ def now():
 ###
 
 
+def find_executable(name):
+    for dir_name in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(dir_name, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def open_vcf(filename):
+    """ open a plain, gzip or bgzip compressed VCF file, return the file and the decompressing process or None.
+    Compressed files are read through pigz or gzip -dc, which decompress in another process and faster than
+    the gzip module, if one of them is installed. """
+    with open(filename, "rb") as ifh:
+        compressed = ifh.read(2) == b"\x1f\x8b"
+    if not compressed:
+        return open(filename), None
+    program = find_executable("pigz") or find_executable("gzip")
+    if program is None:
+        return gzip.open(filename, "rt" if sys.version_info[0] >= 3 else "rb"), None
+    proc = subprocess.Popen([program, "-dc", filename], stdout=subprocess.PIPE, bufsize=1024 * 1024,
+                            universal_newlines=True)
+    return proc.stdout, proc
+
+
 if __name__ == '__main__':
     main()